@@ -0,0 +1,126 @@
+# Micro-benchmark of the parsing of saved pages, full BeautifulSoup trees against lxml and precompiled XPath expressions
+# It runs on the recorded pages of tests/pages: python benchmarks/bench_parsing.py
+# --cache-dir runs it on the pages cached by a run of the counter instead, e.g. the whole website
+
+# Default libraries
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# Make the helpers importable when running from anywhere
+SECTION_COUNT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SECTION_COUNT_PATH))
+
+# Custom libraries
+from helpers import parsing, scraping
+from helpers.http_cache import entry_text, HttpCache, DEFAULT_CACHE_DIR
+from section_count import DEFAULT_BASE_URL, DEFAULT_WIKI_URL, SECTIONS_PATH
+
+
+PARSERS = {
+    "soup": scraping,
+    "lxml": parsing,
+}
+
+PAGES_PATH = SECTION_COUNT_PATH / "tests" / "pages"
+
+
+# Recorded pages by kind, from their place in the folder
+def load_page_fixtures(path=PAGES_PATH):
+    return {
+        "main":     [(path / "sections.html").read_text(encoding="utf-8")],
+        "country":  [page_path.read_text(encoding="utf-8") for page_path in sorted((path / "country").glob("*.html"))],
+        "wiki":     [page_path.read_text(encoding="utf-8") for page_path in sorted((path / "wiki").glob("*.html"))],
+    }
+
+
+# Cached pages by kind, from their urls
+def load_cache_fixtures(cache, base_url, wiki_url):
+    fixtures = {"main": [], "country": [], "wiki": []}
+    main_url = base_url.rstrip('/') + SECTIONS_PATH
+
+    for url in cache.urls():
+        text = entry_text(cache.load(url))
+
+        if url == main_url:
+            fixtures["main"].append(text)
+        elif url == wiki_url:
+            fixtures["wiki"].append(text)
+        elif url.startswith(base_url.rstrip('/') + '/'):
+            fixtures["country"].append(text)
+
+    return fixtures
+
+
+def parse_all(module, kind, texts, base_url):
+    if kind == "main":
+        return [module.parse_main_page(text, base_url) for text in texts]
+    elif kind == "country":
+        return [module.parse_country_page(text) for text in texts]
+    else:
+        return [module.parse_wiki_page(text).to_dict() for text in texts]
+
+
+# Best time of a few rounds over all the pages of a kind, per page
+def time_parser(module, kind, texts, base_url, rounds):
+    durations = []
+
+    for _ in range(rounds):
+        start = time.perf_counter()
+        parse_all(module, kind, texts, base_url)
+        durations.append(time.perf_counter() - start)
+
+    return min(durations) / len(texts)
+
+
+def setup_bench_argparser():
+    ap = argparse.ArgumentParser(description="Parsing benchmark of the ESN Automatic Section Counter")
+    ap.add_argument("-p",   "--pages",      action="store", type=str,   default=str(PAGES_PATH),        help="set the folder of the recorded pages (default is {})".format(PAGES_PATH))
+    ap.add_argument("-cd",  "--cache-dir",  action="store", type=str,   default=None,                   help="use the pages cached in a folder by the counter instead of the recorded ones, e.g. {}".format(DEFAULT_CACHE_DIR))
+    ap.add_argument("-b",   "--base-url",   action="store", type=str,   default=DEFAULT_BASE_URL,       help="set the address of the ESN website the cached pages were fetched from (default is {})".format(DEFAULT_BASE_URL))
+    ap.add_argument("-w",   "--wiki-url",   action="store", type=str,   default=DEFAULT_WIKI_URL,       help="set the address of the wiki article of the cached pages (default is {})".format(DEFAULT_WIKI_URL))
+    ap.add_argument("-r",   "--rounds",     action="store", type=int,   default=5,                      help="number of timed rounds over the pages (default is 5)")
+    ap.add_argument("-o",   "--output",     action="store", type=str,   default=None, metavar="PATH",   help="path of the JSON results")
+    return ap
+
+
+if __name__ == "__main__":
+    args = vars(setup_bench_argparser().parse_args())
+    base_url = args["base_url"]
+
+    if args["cache_dir"] is None:
+        fixtures = load_page_fixtures(Path(args["pages"]))
+    else:
+        fixtures = load_cache_fixtures(HttpCache(args["cache_dir"]), base_url=base_url, wiki_url=args["wiki_url"])
+
+    if not any(fixtures.values()):
+        sys.exit("No cached pages found, run section_count.py once to fill the cache.")
+
+    results = dict()
+
+    for kind, texts in fixtures.items():
+        if not texts:
+            continue
+
+        # Both parsers must agree before their speed means anything
+        expected = parse_all(scraping, kind, texts, base_url)
+
+        if parse_all(parsing, kind, texts, base_url) != expected:
+            sys.exit("The parsers disagree on the {} pages.".format(kind))
+
+        results[kind] = {name: time_parser(module, kind, texts, base_url, args["rounds"]) for name, module in PARSERS.items()}
+        results[kind]["pages"] = len(texts)
+
+        print("{}: {} page(s), soup {:.2f} ms, lxml {:.2f} ms per page, {:.1f}x faster".format(
+            kind,
+            len(texts),
+            results[kind]["soup"] * 1000,
+            results[kind]["lxml"] * 1000,
+            results[kind]["soup"] / results[kind]["lxml"],
+        ))
+
+    if args["output"]:
+        with open(args["output"], "w") as f:
+            json.dump(results, f, indent=4)
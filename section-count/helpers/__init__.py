@@ -0,0 +1,5 @@
+from .fetching import *
+from .history import *
+from .http_cache import *
+from .scraping import *
+from .parsing import *
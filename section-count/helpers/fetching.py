@@ -0,0 +1,158 @@
+# Default libraries
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# External libraries
+import requests
+import tqdm
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Custom libraries
+from helpers.http_cache import entry_text, CacheMiss
+
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_TIMEOUT = 20
+
+# Rate limiting and server errors are worth another try, other errors are final
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+USER_AGENT = "esntools-section-count"
+
+
+# Session keeping a pool of connections alive per host, shared by all threads
+# Failed connections and retryable statuses are retried with an exponential backoff
+def make_session(concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    retry = Retry(total=retries,
+                  backoff_factor=backoff,
+                  status_forcelist=RETRY_STATUSES,
+                  allowed_methods=("GET",),
+                  raise_on_status=False)
+
+    # Threads wait for a free connection rather than opening connections that are thrown away after use
+    adapter = HTTPAdapter(pool_maxsize=concurrency, pool_block=True, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+
+    return session
+
+
+# Fetch pages through a pooled session, a few at a time, and time each request
+# With a cache, fresh pages aren't requested and stale ones are only downloaded again if they changed
+# Offline, every page comes from the cache
+class Fetcher:
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, timeout=DEFAULT_TIMEOUT, cache=None, offline=False):
+        self.session = make_session(concurrency=concurrency, retries=retries, backoff=backoff)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.timings = []
+        self.lock = threading.Lock()
+
+    def record(self, url, start, source, status=None, attempts=0, n_bytes=0):
+        with self.lock:
+            self.timings.append({
+                "url":      url,
+                "source":   source,
+                "status":   status,
+                "seconds":  time.perf_counter() - start,
+                "attempts": attempts,
+                "bytes":    n_bytes,
+            })
+
+    def get_text(self, url):
+        start = time.perf_counter()
+        entry = self.cache.load(url) if self.cache is not None else None
+
+        if entry is not None and (self.offline or self.cache.is_fresh(entry)):
+            self.record(url, start, source="cache")
+            return entry_text(entry)
+
+        if self.offline:
+            raise CacheMiss("{} was never fetched, run once online to cache it".format(url))
+
+        headers = self.cache.conditional_headers(entry) if entry is not None else None
+        response = self.session.get(url, timeout=self.timeout, headers=headers)
+        revalidated = response.status_code == 304 and entry is not None
+
+        # The retries of urllib3 keep the history of the failed attempts
+        retries = getattr(response.raw, "retries", None)
+
+        self.record(url,
+                    start,
+                    source="revalidated" if revalidated else "network",
+                    status=response.status_code,
+                    attempts=1 + (len(retries.history) if retries is not None else 0),
+                    n_bytes=len(response.content))
+
+        if revalidated:
+            return entry_text(self.cache.touch(entry))
+
+        response.raise_for_status()
+
+        if self.cache is not None:
+            self.cache.store(url,
+                             response.content,
+                             encoding=response.encoding or response.apparent_encoding,
+                             etag=response.headers.get("ETag"),
+                             last_modified=response.headers.get("Last-Modified"))
+
+        return response.text
+
+    # Fetch pages concurrently and parse each of them with a function, results are in the order of the urls
+    def map(self, parse, urls, progress=True):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = executor.map(lambda url: parse(self.get_text(url)), urls)
+            return list(tqdm.tqdm(results, total=len(urls), disable=not progress))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def timing_summary(timings, wall_time):
+    durations = sorted(timing["seconds"] for timing in timings)
+
+    if not durations:
+        return "No pages fetched"
+
+    sources = {source: sum(1 for timing in timings if timing["source"] == source) for source in ("network", "revalidated", "cache")}
+
+    return "{} page(s) in {:.2f} s: {} downloaded, {} unchanged, {} from the cache, median {:.0f} ms, slowest {:.0f} ms, {} retried, {:.1f} kB transferred".format(
+        len(durations),
+        wall_time,
+        sources["network"],
+        sources["revalidated"],
+        sources["cache"],
+        statistics.median(durations) * 1000,
+        durations[-1] * 1000,
+        sum(1 for timing in timings if timing["attempts"] > 1),
+        sum(timing["bytes"] for timing in timings) / 1024,
+    )
+
+
+def write_report(path, timings, wall_time, extra=None):
+    report = {
+        "wall_time":    wall_time,
+        "requests":     timings,
+    }
+
+    report.update(extra or dict())
+
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4)
@@ -0,0 +1,130 @@
+# Default libraries
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+
+# External libraries
+import pandas as pd
+
+
+DEFAULT_HISTORY_PATH = "history.sqlite"
+
+SOURCES = ("website", "wiki")
+
+# Runs are only ever appended, each with the full counts per country of both sources
+# Counts are keyed by run then country, and indexed by country for the series of a single one
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id                  INTEGER PRIMARY KEY,
+    taken_at                TEXT NOT NULL,
+    global_section_count    INTEGER,
+    global_country_count    INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS runs_taken_at ON runs (taken_at);
+
+CREATE TABLE IF NOT EXISTS counts (
+    run_id      INTEGER NOT NULL REFERENCES runs (run_id),
+    source      TEXT NOT NULL,
+    country     TEXT NOT NULL,
+    sections    INTEGER NOT NULL,
+    PRIMARY KEY (run_id, source, country)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS counts_country ON counts (source, country, run_id);
+"""
+
+
+def open_history(path=DEFAULT_HISTORY_PATH):
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+# Store the counts of a run of count_sections, returns its id
+def record_run(connection, results, taken_at=None):
+    taken_at = taken_at or datetime.now(timezone.utc)
+
+    with connection:
+        run_id = connection.execute(
+            "INSERT INTO runs (taken_at, global_section_count, global_country_count) VALUES (?, ?, ?)",
+            (taken_at.isoformat(timespec="seconds"), int(results["global_section_count"]), int(results["global_country_count"])),
+        ).lastrowid
+
+        for source, country_counts in (("website", results["main_country_counts"]), ("wiki", results["wiki_country_counts"])):
+            # The wiki may list a country twice, the last row wins like in a dict
+            rows = {country: int(sections) for country, sections in country_counts.items()}
+            connection.executemany("INSERT INTO counts VALUES (?, ?, ?, ?)", [(run_id, source, country, sections) for country, sections in rows.items()])
+
+    return run_id
+
+
+def list_runs(connection):
+    return pd.read_sql_query("SELECT * FROM runs ORDER BY run_id", connection, index_col="run_id")
+
+
+# A run is given by its id, by a negative offset to the latest run like -1 for the one before it, or by a date, for the last run taken by then
+# Returns the id or offset as an int, or the date in UTC, raises ValueError for anything else
+def parse_run_reference(reference):
+    reference = str(reference).strip()
+
+    if reference.lstrip("-").isdigit():
+        return int(reference)
+
+    try:
+        taken_by = datetime.fromisoformat(reference)
+    except ValueError:
+        raise ValueError("'{}' is neither a run id, a negative offset like -1, nor a date like 2024-05-01".format(reference)) from None
+
+    # Dates are stored in UTC, so that they compare as text
+    if taken_by.tzinfo is None:
+        return taken_by.replace(tzinfo=timezone.utc)
+
+    return taken_by.astimezone(timezone.utc)
+
+
+# Id of a run from a reference of parse_run_reference, returns None if there is no such run
+def find_run(connection, reference):
+    reference = parse_run_reference(reference)
+
+    if isinstance(reference, datetime):
+        row = connection.execute("SELECT run_id FROM runs WHERE taken_at <= ? ORDER BY taken_at DESC, run_id DESC LIMIT 1", (reference.isoformat(timespec="seconds"),)).fetchone()
+    elif reference > 0:
+        row = connection.execute("SELECT run_id FROM runs WHERE run_id = ?", (reference,)).fetchone()
+    else:
+        row = connection.execute("SELECT run_id FROM runs ORDER BY run_id DESC LIMIT 1 OFFSET ?", (-reference,)).fetchone()
+
+    return None if row is None else row[0]
+
+
+def load_snapshot(connection, run_id, source="website"):
+    rows = connection.execute("SELECT country, sections FROM counts WHERE run_id = ? AND source = ?", (run_id, source)).fetchall()
+    return pd.Series(dict(rows), name=source, dtype=int)
+
+
+# Countries whose count changed between two runs, with None for the ones that appeared or disappeared
+# Only the two snapshots are read
+def diff_runs(connection, old_run_id, new_run_id, source="website"):
+    old = load_snapshot(connection, old_run_id, source=source).rename('before')
+    new = load_snapshot(connection, new_run_id, source=source).rename('after')
+
+    diff = old.to_frame().join(new.to_frame(), how='outer').astype('Int64')
+    diff = diff[diff['before'].ne(diff['after']).fillna(True)]
+    diff.index.name = None
+
+    return diff.sort_index()
+
+
+# Write the whole history in long format, one row per run, source and country, as CSV or JSON from the file extension
+def export_history(connection, path):
+    table = pd.read_sql_query(
+        "SELECT runs.run_id, taken_at, source, country, sections FROM counts JOIN runs USING (run_id) ORDER BY runs.run_id, source, country",
+        connection,
+    )
+
+    if Path(path).suffix.lower() == ".json":
+        table.to_json(path, orient="records", indent=4)
+    else:
+        table.to_csv(path, index=False)
+
+    return len(table)
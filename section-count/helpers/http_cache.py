@@ -0,0 +1,109 @@
+# Default libraries
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+
+DEFAULT_CACHE_DIR = ".http_cache"
+DEFAULT_TTL = 3600
+
+CACHE_VERSION = 1
+
+
+# Raised in offline mode for pages that were never fetched
+class CacheMiss(LookupError):
+    pass
+
+
+def write_atomically(path, data):
+    path_tmp = path.with_name(path.name + ".tmp")
+    path_tmp.write_bytes(data)
+    os.replace(path_tmp, path)
+
+
+# Responses stored on disk by url, a JSON file with the validators next to the body
+# Entries younger than the TTL are used as they are, older ones are revalidated with the server
+class HttpCache:
+    def __init__(self, path=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+
+    def entry_paths(self, url):
+        key = hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+        return self.path / (key + ".json"), self.path / (key + ".body")
+
+    # Entry of a url with its body, or None if it isn't cached
+    def load(self, url):
+        path_meta, path_body = self.entry_paths(url)
+
+        try:
+            meta = json.loads(path_meta.read_text())
+            body = path_body.read_bytes()
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if meta.get("version") != CACHE_VERSION or meta.get("url") != url:
+            return None
+
+        meta["body"] = body
+        return meta
+
+    # The body is written first, so that metadata never points to a missing or older body
+    def store(self, url, body, encoding, etag=None, last_modified=None):
+        path_meta, path_body = self.entry_paths(url)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        meta = {
+            "version":          CACHE_VERSION,
+            "url":              url,
+            "encoding":         encoding,
+            "etag":             etag,
+            "last_modified":    last_modified,
+            "fetched_at":       time.time(),
+        }
+
+        write_atomically(path_body, body)
+        write_atomically(path_meta, json.dumps(meta, indent=4).encode())
+
+        meta["body"] = body
+        return meta
+
+    # A 304 answer makes the entry fresh again
+    def touch(self, entry):
+        entry = dict(entry)
+        body = entry.pop("body")
+        entry["fetched_at"] = time.time()
+
+        write_atomically(self.entry_paths(entry["url"])[0], json.dumps(entry, indent=4).encode())
+
+        entry["body"] = body
+        return entry
+
+    # Cached urls, for tools working on saved pages
+    def urls(self):
+        for path_meta in sorted(self.path.glob("*.json")):
+            try:
+                yield json.loads(path_meta.read_text())["url"]
+            except (ValueError, KeyError):
+                continue
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    # Headers asking the server to answer 304 if the page didn't change since it was cached, from the validators it gave
+    def conditional_headers(self, entry):
+        headers = dict()
+
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+
+def entry_text(entry):
+    return entry["body"].decode(entry["encoding"] or "utf-8", errors="replace")
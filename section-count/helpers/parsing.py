@@ -0,0 +1,89 @@
+# Default libraries
+import re
+from unicodedata import normalize
+
+# External libraries
+import lxml.html
+import pandas as pd
+from lxml import etree
+
+# Custom libraries
+from helpers.scraping import rebase_url, GLOBAL_COUNTS_REGEX, SECTION_COUNT_REGEX
+
+
+# Expressions compiled once and applied to lxml trees, much cheaper than building BeautifulSoup trees
+# The content block is found like get_main_content does, through the first div under each div
+MAIN_CONTENT_XPATH = etree.XPath("((((//*[@id='content-block']//div)[1]//div)[1]//div)[1]//div)[1]")
+FIRST_PARAGRAPH_XPATH = etree.XPath("(.//p)[1]")
+COUNTRY_LINKS_XPATH = etree.XPath("((.//div)[1]//div)/descendant::a[1]/@href")
+
+COUNTRY_NAME_XPATH = etree.XPath("(//h1[contains(concat(' ', normalize-space(@class), ' '), ' page-header ')])[1]")
+SECTION_COUNT_XPATH = etree.XPath("(//div[contains(concat(' ', normalize-space(@class), ' '), ' num_sections_country ')])[1]")
+
+WIKI_TABLES_XPATH = etree.XPath("//table[contains(concat(' ', normalize-space(@class), ' '), ' wikitable ') and contains(concat(' ', normalize-space(@class), ' '), ' sortable ')]")
+ROWS_XPATH = etree.XPath(".//tr")
+HEADER_CELLS_XPATH = etree.XPath(".//th")
+CELLS_XPATH = etree.XPath(".//td")
+
+GLOBAL_COUNTS_PATTERN = re.compile(GLOBAL_COUNTS_REGEX)
+SECTION_COUNT_PATTERN = re.compile(SECTION_COUNT_REGEX)
+
+# Everything from an opening parenthesis on, and the marks of footnotes
+WIKI_NAME_CLEANUP_PATTERN = re.compile(r"\(.*|[†*]", re.DOTALL)
+
+
+def parse_tree(text):
+    return lxml.html.fromstring(text)
+
+
+def first_element(xpath, node):
+    elements = xpath(node)
+
+    if not elements:
+        raise ValueError("Element not found: {}".format(xpath.path))
+
+    return elements[0]
+
+
+# Global counts and country links of the sections page
+def parse_main_page(text, base_url):
+    content = first_element(MAIN_CONTENT_XPATH, parse_tree(text))
+
+    paragraph = normalize("NFKD", first_element(FIRST_PARAGRAPH_XPATH, content).text_content())
+    global_counts = [int(elem) for elem in GLOBAL_COUNTS_PATTERN.search(paragraph).groups()]
+    country_urls = [rebase_url(href, base_url) for href in COUNTRY_LINKS_XPATH(content)]
+
+    return global_counts, country_urls
+
+
+def parse_country_page(text):
+    tree = parse_tree(text)
+
+    national_org_name = first_element(COUNTRY_NAME_XPATH, tree).text_content()
+    section_count = int(SECTION_COUNT_PATTERN.search(first_element(SECTION_COUNT_XPATH, tree).text_content()).group(1))
+
+    return national_org_name, section_count
+
+
+# Local sections per country of the wiki table, cleaned like get_wiki_country_counts does, as a single series
+def parse_wiki_page(text):
+    wiki_table_candidates = WIKI_TABLES_XPATH(parse_tree(text))
+
+    if len(wiki_table_candidates) > 1:
+        raise ValueError("There are multiple valid tags. Further clarification needed.")
+    elif len(wiki_table_candidates) == 0:
+        raise ValueError("No valid tag detected.")
+
+    rows = ROWS_XPATH(wiki_table_candidates[0])
+    headers = [elem.text_content().strip() for elem in HEADER_CELLS_XPATH(rows[0])]
+    name_index, count_index = headers.index('Name'), headers.index('Local sections')
+
+    names = []
+    counts = []
+
+    for row in rows[1:-1]:
+        cells = [elem.text_content().strip() for elem in CELLS_XPATH(row)]
+        names.append(WIKI_NAME_CLEANUP_PATTERN.sub('', cells[name_index]).strip())
+        counts.append(int(cells[count_index].replace('-', '0')))
+
+    return pd.Series(counts, index=names, name='wiki', dtype=int)
@@ -0,0 +1,104 @@
+# Parsing of the pages through full BeautifulSoup trees, as done by the notebook
+# helpers.parsing gets the same results faster, these functions are kept as its reference
+
+# Default libraries
+import re
+from unicodedata import normalize
+from urllib.parse import urljoin, urlparse
+
+# External libraries
+import pandas as pd
+from bs4 import BeautifulSoup
+
+
+GLOBAL_COUNTS_REGEX = r"The ESN network consists at this moment of (\d+) local sections in (\d+) countries."
+SECTION_COUNT_REGEX = r"Number of sections: (\d+)"
+
+# Names of the website that differ from the ones of the wiki
+WEBSITE_NAME_FIXES = {
+    'ESN UK': 'ESN United Kingdom',
+}
+
+
+def get_soup(text):
+    return BeautifulSoup(text, 'lxml')
+
+
+def get_main_content(soup):
+    return soup.find(id='content-block').find('div').find('div').find('div').find('div')
+
+
+def get_global_counts(content):
+    text = normalize("NFKD", content.find('p').get_text())
+    return [int(elem) for elem in re.search(GLOBAL_COUNTS_REGEX, text).groups()]
+
+
+# Links are moved under the base url, so that a local copy of the website can stand in for it
+def rebase_url(href, base_url):
+    url = urlparse(urljoin(base_url + '/', href))
+    return base_url.rstrip('/') + url.path + ('?' + url.query if url.query else '')
+
+
+def get_country_urls(content, base_url):
+    country_divs = content.find('div').find_all('div')
+    return [rebase_url(elem.find('a')['href'], base_url) for elem in country_divs]
+
+
+def get_country_section_count(soup):
+    national_org_name = soup.find('h1', {'class': 'page-header'}).text
+
+    section_count_paragraph = soup.find('div', {'class': 'num_sections_country'}).text
+    section_count = int(re.search(SECTION_COUNT_REGEX, section_count_paragraph).group(1))
+
+    return national_org_name, section_count
+
+
+def parse_country_page(text):
+    return get_country_section_count(get_soup(text))
+
+
+def parse_main_page(text, base_url):
+    main_content = get_main_content(get_soup(text))
+    return get_global_counts(main_content), get_country_urls(main_content, base_url)
+
+
+def parse_wiki_page(text):
+    return get_wiki_country_counts(get_soup(text))
+
+
+def get_cells(row, tag):
+    return [elem.text.strip() for elem in row.find_all(tag)]
+
+
+def get_wiki_country_counts(soup):
+    wiki_table_candidates = soup.select('.wikitable.sortable')
+
+    if len(wiki_table_candidates) > 1:
+        raise ValueError("There are multiple valid tags. Further clarification needed.")
+    elif len(wiki_table_candidates) == 0:
+        raise ValueError("No valid tag detected.")
+
+    rows = wiki_table_candidates[0].find_all('tr')
+    headers = get_cells(rows[0], tag='th')
+    rows = [get_cells(elem, tag='td') for elem in rows[1:-1]]
+
+    table = pd.DataFrame(rows, columns=headers)
+    table['Name'] = table['Name'] \
+        .str.split('(').apply(pd.Series)[0] \
+        .str.replace('†', '', regex=False) \
+        .str.replace('*', '', regex=False) \
+        .str.strip()
+    table['Local sections'] = table['Local sections'].str.replace('-', '0').astype(int)
+
+    wiki_country_counts = table[['Name', 'Local sections']].set_index('Name')['Local sections']
+    wiki_country_counts = wiki_country_counts.rename('wiki')
+    wiki_country_counts.index.name = None
+
+    return wiki_country_counts
+
+
+# Countries whose counts differ between the wiki and the website
+def compare_counts(wiki_country_counts, main_country_counts):
+    counts_comparison = wiki_country_counts.to_frame().join(main_country_counts.to_frame(), how='outer').fillna(0).astype(int)
+    counts_comparison['different'] = counts_comparison['wiki'] != counts_comparison['website']
+    return counts_comparison[counts_comparison['different']][['wiki', 'website']]
@@ -0,0 +1,186 @@
+# Default libraries
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# External libraries
+import pandas as pd
+
+# Custom libraries
+from helpers.fetching import (
+    timing_summary,
+    write_report,
+    Fetcher,
+    DEFAULT_BACKOFF,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT
+)
+
+from helpers.http_cache import (
+    CacheMiss,
+    HttpCache,
+    DEFAULT_CACHE_DIR,
+    DEFAULT_TTL
+)
+
+from helpers.history import (
+    diff_runs,
+    export_history,
+    find_run,
+    open_history,
+    parse_run_reference,
+    record_run,
+    DEFAULT_HISTORY_PATH,
+    SOURCES
+)
+
+from helpers.parsing import parse_country_page, parse_main_page, parse_wiki_page
+from helpers.scraping import compare_counts, WEBSITE_NAME_FIXES
+
+
+DEFAULT_BASE_URL = "https://www.esn.org"
+DEFAULT_WIKI_URL = "https://en.wikipedia.org/wiki/Erasmus_Student_Network"
+
+SECTIONS_PATH = "/sections"
+
+
+# Scrape the global counts and the counts per country of the website, and the counts per country of the wiki
+# The wiki page is fetched while the country pages are
+def count_sections(fetcher, base_url=DEFAULT_BASE_URL, wiki_url=DEFAULT_WIKI_URL, progress=True):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        wiki_text = executor.submit(fetcher.get_text, wiki_url)
+
+        global_counts, country_urls = parse_main_page(fetcher.get_text(base_url.rstrip('/') + SECTIONS_PATH), base_url)
+        global_section_count, global_country_count = global_counts
+
+        main_country_counts = pd.Series(dict(fetcher.map(parse_country_page, country_urls, progress=progress)), dtype=int)
+        main_country_counts = main_country_counts.rename('website').rename(index=WEBSITE_NAME_FIXES)
+
+        wiki_country_counts = parse_wiki_page(wiki_text.result())
+
+    return {
+        "global_section_count":     global_section_count,
+        "global_country_count":     global_country_count,
+        "main_country_counts":      main_country_counts,
+        "wiki_country_counts":      wiki_country_counts,
+        "counts_comparison":        compare_counts(wiki_country_counts, main_country_counts),
+    }
+
+
+def print_results(results):
+    agg_section_count, agg_country_count = results["main_country_counts"].sum(), results["main_country_counts"].count()
+    counts_comparison = results["counts_comparison"]
+
+    print("Results as of", datetime.today().strftime("%B %d, %Y at %H:%M:%S"))
+    print("The official website currently indicates ESN comprises", results["global_section_count"], "sections in", results["global_country_count"], "countries.")
+
+    if results["global_section_count"] == agg_section_count:
+        print("The aggregate and global section counts are the same.")
+    else:
+        print("The aggregate section count is however different at", agg_section_count)
+
+    if results["global_country_count"] == agg_country_count:
+        print("The aggregate and global country counts are the same.")
+    else:
+        print("The aggregate country count is however different at", agg_country_count)
+
+    if len(counts_comparison) == 0:
+        print("No differences detected between the website and the wiki!")
+    else:
+        print("The following differences were detected between the website and the wiki:")
+        print()
+        print(counts_comparison)
+
+
+# Changes of the counts of each source between two runs of the history
+def print_diff(history, old_run_id, new_run_id):
+    print("Changes from run", old_run_id, "to run", new_run_id)
+
+    for source in SOURCES:
+        diff = diff_runs(history, old_run_id, new_run_id, source=source)
+
+        if len(diff) == 0:
+            print("No changes on the {}.".format(source))
+        else:
+            print("Changes on the {} (<NA> marks a country that appeared or disappeared):".format(source))
+            print()
+            print(diff)
+            print()
+
+
+def setup_argparser():
+    ap = argparse.ArgumentParser(description="ESN Automatic Section Counter")
+    ap.add_argument("-b",   "--base-url",       action="store", type=str,   default=DEFAULT_BASE_URL,       help="set the address of the ESN website, e.g. a local server serving saved pages (default is {})".format(DEFAULT_BASE_URL))
+    ap.add_argument("-w",   "--wiki-url",       action="store", type=str,   default=DEFAULT_WIKI_URL,       help="set the address of the wiki article listing the sections (default is {})".format(DEFAULT_WIKI_URL))
+    ap.add_argument("-c",   "--concurrency",    action="store", type=int,   default=DEFAULT_CONCURRENCY,    help="set the number of pages fetched at the same time (default is {})".format(DEFAULT_CONCURRENCY))
+    ap.add_argument("-r",   "--retries",        action="store", type=int,   default=DEFAULT_RETRIES,        help="set the number of retries of failed requests (default is {})".format(DEFAULT_RETRIES))
+    ap.add_argument("-bo",  "--backoff",        action="store", type=float, default=DEFAULT_BACKOFF,        help="set the backoff factor between retries in seconds, doubled after each retry (default is {})".format(DEFAULT_BACKOFF))
+    ap.add_argument("-t",   "--timeout",        action="store", type=float, default=DEFAULT_TIMEOUT,        help="set the timeout of each request in seconds (default is {})".format(DEFAULT_TIMEOUT))
+    ap.add_argument("-cd",  "--cache-dir",      action="store", type=str,   default=DEFAULT_CACHE_DIR,      help="set the folder of the cache of fetched pages (default is {})".format(DEFAULT_CACHE_DIR))
+    ap.add_argument("-ttl", "--ttl",            action="store", type=float, default=DEFAULT_TTL,            help="set the age in seconds under which cached pages are used without asking the server, older ones are downloaded again only if they changed (default is {})".format(DEFAULT_TTL))
+    ap.add_argument("-nc",  "--no-cache",       action="store_true",                                        help="fetch every page from the network without caching it")
+    ap.add_argument("-off", "--offline",        action="store_true",                                        help="replay the cached pages without any network access")
+    ap.add_argument("-hp",  "--history",        action="store", type=str,   default=DEFAULT_HISTORY_PATH,   help="set the SQLite file where the counts of each run are added (default is {})".format(DEFAULT_HISTORY_PATH))
+    ap.add_argument("-nh",  "--no-history",     action="store_true",                                        help="do not record the counts of this run")
+    ap.add_argument("-d",   "--diff",           action="store", type=str,   default=None, nargs="?", const="-1", metavar="RUN",    help="show the changes between the latest run and an earlier one, given by its id, by a negative offset like -1 for the one before the latest, or by a date like 2024-05-01 for the last run by then (default is -1 when given without a value)")
+    ap.add_argument("-ex",  "--export",         action="store", type=str,   default=None, metavar="PATH",   help="export the whole history to a CSV file, or to JSON if the path ends with .json, one row per run, source and country")
+    ap.add_argument("-nf",  "--no-fetch",       action="store_true",                                        help="only work on the history, e.g. with --diff or --export, without fetching any page")
+    ap.add_argument("-rp",  "--report",         action="store", type=str,   default=None, metavar="PATH",   help="write a JSON report with the timing of each request")
+    ap.add_argument("-q",   "--quiet",          action="store_true",                                        help="do not show the progress bar")
+    return ap
+
+
+if __name__ == "__main__":
+    args = vars(setup_argparser().parse_args())
+    start_time = time.perf_counter()
+
+    if args["offline"] and args["no_cache"]:
+        sys.exit("Offline mode replays the cache, it can't be used without it.")
+
+    if args["no_history"] and (args["diff"] is not None or args["export"]):
+        sys.exit("Diffs and exports are made from the history, they can't be used without it.")
+
+    # A bad run is reported before any page is fetched
+    if args["diff"] is not None:
+        try:
+            parse_run_reference(args["diff"])
+        except ValueError as e:
+            sys.exit("Invalid --diff run: {}".format(e))
+
+    history = None if args["no_history"] else open_history(args["history"])
+
+    if not args["no_fetch"]:
+        cache = None if args["no_cache"] else HttpCache(args["cache_dir"], ttl=args["ttl"])
+
+        with Fetcher(concurrency=args["concurrency"], retries=args["retries"], backoff=args["backoff"], timeout=args["timeout"], cache=cache, offline=args["offline"]) as fetcher:
+            try:
+                results = count_sections(fetcher, base_url=args["base_url"], wiki_url=args["wiki_url"], progress=not args["quiet"])
+            except CacheMiss as e:
+                sys.exit("Missing page in offline mode: {}".format(e))
+
+        wall_time = time.perf_counter() - start_time
+
+        print_results(results)
+        print(timing_summary(fetcher.timings, wall_time))
+
+        if args["report"]:
+            write_report(args["report"], fetcher.timings, wall_time, extra={"concurrency": args["concurrency"]})
+            print("Report written to", args["report"])
+
+        # Replayed pages say nothing new about the sections
+        if history is not None and not args["offline"]:
+            print("Run", record_run(history, results), "recorded in", args["history"])
+
+    if args["diff"] is not None:
+        old_run_id, new_run_id = find_run(history, args["diff"]), find_run(history, 0)
+
+        if old_run_id is None or new_run_id is None:
+            sys.exit("No run '{}' in the history.".format(args["diff"]))
+
+        print_diff(history, old_run_id, new_run_id)
+
+    if args["export"]:
+        print(export_history(history, args["export"]), "row(s) of history exported to", args["export"])
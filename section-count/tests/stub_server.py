@@ -0,0 +1,133 @@
+# Local HTTP server serving the recorded pages of tests/pages, standing in for the ESN website and the wiki
+# A url path is served from the file of the same path with an .html extension, e.g. /country/austria from pages/country/austria.html
+
+# Default libraries
+import hashlib
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+PAGES_PATH = Path(__file__).resolve().parent / "pages"
+
+SECTIONS_PAGE = "/sections"
+WIKI_PAGE = "/wiki/Erasmus_Student_Network"
+
+# Failures left to answer for a path, until it is served normally
+ALWAYS = -1
+
+# Date of the recorded pages, as given in Last-Modified
+RECORDED_AT = 1704067200
+
+VALIDATORS = ("etag", "last_modified")
+
+
+# Recorded pages by url path
+def load_pages(path=PAGES_PATH):
+    return {"/" + page_path.relative_to(path).with_suffix("").as_posix(): page_path.read_bytes() for page_path in sorted(path.rglob("*.html"))}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            failures = server.failures.get(self.path, 0)
+
+            if failures > 0:
+                server.failures[self.path] = failures - 1
+
+        if failures != 0:
+            self.send_body(503, b"Service Unavailable")
+        elif self.path in server.pages:
+            self.send_page(server.pages[self.path], server.modified.get(self.path, RECORDED_AT))
+        else:
+            self.send_body(404, b"Not Found")
+
+    # Pages come with the validators the server is set to give, and a 304 answer if they match the request
+    def send_page(self, body, modified):
+        headers = dict()
+
+        if "etag" in self.server.validators:
+            headers["ETag"] = '"{}"'.format(hashlib.blake2b(body, digest_size=8).hexdigest())
+
+        if "last_modified" in self.server.validators:
+            headers["Last-Modified"] = formatdate(modified, usegmt=True)
+
+        if "ETag" in headers and self.headers.get("If-None-Match") == headers["ETag"]:
+            status = 304
+        elif "ETag" not in headers and "Last-Modified" in headers and self.headers.get("If-Modified-Since") == headers["Last-Modified"]:
+            status = 304
+        else:
+            status = 200
+
+        with self.server.lock:
+            self.server.statuses.append((self.path, status))
+
+        self.send_body(status, b"" if status == 304 else body, headers=headers)
+
+    def send_body(self, status, body, headers=dict()):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Server on a free port of localhost, run in a thread while used as a context manager
+# Failures give the number of 503 answers of a path before it is served, or ALWAYS
+# Validators are the headers pages are served with, a page is only revalidated through Last-Modified without an ETag
+class StubServer:
+    def __init__(self, pages=None, failures=None, validators=VALIDATORS):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.pages = load_pages() if pages is None else pages
+        self.server.failures = dict(failures or dict())
+        self.server.validators = validators
+        self.server.modified = dict()
+        self.server.hits = dict()
+        self.server.statuses = []
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    @property
+    def wiki_url(self):
+        return self.base_url + WIKI_PAGE
+
+    @property
+    def hits(self):
+        return self.server.hits
+
+    # Answers given to the pages that were found, 200 or 304
+    @property
+    def statuses(self):
+        return self.server.statuses
+
+    # Change a page, as if the website was updated later on
+    def update_page(self, path, body):
+        with self.server.lock:
+            self.server.pages[path] = body
+            self.server.modified[path] = self.server.modified.get(path, RECORDED_AT) + 3600
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,95 @@
+# Tests of the concurrent fetching against the recorded pages of a local stub server
+# Run them from the section-count folder: python -m unittest discover -s tests
+
+# Default libraries
+import sys
+import unittest
+from pathlib import Path
+
+# External libraries
+import requests
+
+# Make the helpers importable when running from anywhere
+SECTION_COUNT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SECTION_COUNT_PATH))
+
+# Custom libraries
+from helpers.fetching import timing_summary, Fetcher
+from helpers.parsing import parse_country_page
+from section_count import count_sections
+from stub_server import StubServer, ALWAYS
+
+
+RETRIES = 3
+
+
+def make_fetcher(concurrency):
+    return Fetcher(concurrency=concurrency, retries=RETRIES, backoff=0, timeout=5)
+
+
+def run_count(server, concurrency):
+    with make_fetcher(concurrency) as fetcher:
+        return count_sections(fetcher, base_url=server.base_url, wiki_url=server.wiki_url, progress=False)
+
+
+class TestConcurrentFetching(unittest.TestCase):
+    def test_concurrent_counts_match_serial_counts(self):
+        with StubServer() as server:
+            serial = run_count(server, concurrency=1)
+            concurrent = run_count(server, concurrency=4)
+
+        self.assertEqual(serial["global_section_count"], 61)
+        self.assertEqual(serial["global_country_count"], 4)
+        self.assertEqual(serial["main_country_counts"].to_dict(), {"ESN Austria": 14, "ESN Belgium": 16, "ESN Germany": 27, "ESN United Kingdom": 4})
+
+        for key in ("global_section_count", "global_country_count"):
+            self.assertEqual(concurrent[key], serial[key])
+
+        for key in ("main_country_counts", "wiki_country_counts", "counts_comparison"):
+            self.assertTrue(concurrent[key].equals(serial[key]), key)
+
+    # The wiki lists a section less for Belgium, and Liechtenstein without any section is no difference
+    def test_differences_with_the_wiki(self):
+        with StubServer() as server:
+            comparison = run_count(server, concurrency=4)["counts_comparison"]
+
+        self.assertEqual(comparison.to_dict("index"), {"ESN Belgium": {"wiki": 15, "website": 16}})
+
+
+class TestRetries(unittest.TestCase):
+    def test_server_errors_are_retried(self):
+        with StubServer(failures={"/country/belgium": 2}) as server:
+            with make_fetcher(concurrency=4) as fetcher:
+                results = count_sections(fetcher, base_url=server.base_url, wiki_url=server.wiki_url, progress=False)
+
+            hits = server.hits["/country/belgium"]
+
+        self.assertEqual(results["main_country_counts"]["ESN Belgium"], 16)
+        self.assertEqual(hits, 3)
+
+        timing = next(timing for timing in fetcher.timings if timing["url"].endswith("/country/belgium"))
+        self.assertEqual(timing["status"], 200)
+        self.assertEqual(timing["attempts"], 3)
+        self.assertIn("1 retried", timing_summary(fetcher.timings, wall_time=1))
+
+    # A page failing after every retry fails the run, and its request is in the timings with its last status
+    def test_failures_are_reported_per_request(self):
+        with StubServer(failures={"/country/germany": ALWAYS}) as server:
+            urls = [server.base_url + path for path in ("/country/austria", "/country/germany")]
+
+            with make_fetcher(concurrency=2) as fetcher:
+                with self.assertRaises(requests.HTTPError) as raised:
+                    fetcher.map(parse_country_page, urls, progress=False)
+
+            hits = server.hits["/country/germany"]
+
+        self.assertEqual(raised.exception.response.url, urls[1])
+        self.assertEqual(hits, RETRIES + 1)
+
+        timings = {timing["url"]: timing for timing in fetcher.timings}
+        self.assertEqual((timings[urls[0]]["status"], timings[urls[0]]["attempts"]), (200, 1))
+        self.assertEqual((timings[urls[1]]["status"], timings[urls[1]]["attempts"]), (503, RETRIES + 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
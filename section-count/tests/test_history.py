@@ -0,0 +1,144 @@
+# Tests of the history of the counts, on an in-memory SQLite database
+# Run them from the section-count folder: python -m unittest discover -s tests
+
+# Default libraries
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+
+# External libraries
+import pandas as pd
+
+# Make the helpers importable when running from anywhere
+SECTION_COUNT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SECTION_COUNT_PATH))
+
+# Custom libraries
+from helpers.history import diff_runs, export_history, find_run, list_runs, open_history, parse_run_reference, record_run
+
+
+FIRST_TAKEN_AT = datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+SECOND_TAKEN_AT = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+
+def make_results(website, wiki):
+    return {
+        "global_section_count":     sum(website.values()),
+        "global_country_count":     len(website),
+        "main_country_counts":      pd.Series(website),
+        "wiki_country_counts":      pd.Series(wiki),
+    }
+
+
+# Austria grows, Belgium stays, Germany shrinks, Latvia disappears and Malta appears
+FIRST_RESULTS = make_results({"ESN Austria": 14, "ESN Belgium": 16, "ESN Germany": 27, "ESN Latvia": 3}, {"ESN Austria": 14, "ESN Belgium": 15})
+SECOND_RESULTS = make_results({"ESN Austria": 15, "ESN Belgium": 16, "ESN Germany": 26, "ESN Malta": 2}, {"ESN Austria": 15, "ESN Belgium": 15})
+
+
+class HistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.history = open_history(":memory:")
+        self.first = record_run(self.history, FIRST_RESULTS, taken_at=FIRST_TAKEN_AT)
+        self.second = record_run(self.history, SECOND_RESULTS, taken_at=SECOND_TAKEN_AT)
+
+    def tearDown(self):
+        self.history.close()
+
+
+class TestRuns(HistoryTestCase):
+    def test_runs_are_recorded(self):
+        runs = list_runs(self.history)
+
+        self.assertEqual(list(runs.index), [self.first, self.second])
+        self.assertEqual(list(runs["taken_at"]), ["2024-05-01T12:00:00+00:00", "2024-06-01T12:00:00+00:00"])
+        self.assertEqual(list(runs["global_section_count"]), [60, 59])
+
+    def test_find_run(self):
+        self.assertEqual(find_run(self.history, self.first), self.first)
+        self.assertEqual(find_run(self.history, 0), self.second)
+        self.assertEqual(find_run(self.history, "-1"), self.first)
+        self.assertEqual(find_run(self.history, "2024-05-15"), self.first)
+        self.assertEqual(find_run(self.history, "2024-06-01T14:00:00+02:00"), self.second)
+
+        for missing in ("-2", "99", "2024-04-30"):
+            self.assertIsNone(find_run(self.history, missing), missing)
+
+    def test_invalid_references(self):
+        for reference in ("yesterday", "2024-13-01", "1.5", ""):
+            with self.assertRaises(ValueError, msg=reference):
+                find_run(self.history, reference)
+
+        self.assertEqual(parse_run_reference(" -1 "), -1)
+
+
+class TestDiff(HistoryTestCase):
+    def test_added_removed_and_changed_countries(self):
+        diff = diff_runs(self.history, self.first, self.second)
+
+        self.assertEqual(list(diff.index), ["ESN Austria", "ESN Germany", "ESN Latvia", "ESN Malta"])
+        self.assertEqual(diff.loc["ESN Austria"].tolist(), [14, 15])
+        self.assertEqual(diff.loc["ESN Germany"].tolist(), [27, 26])
+        self.assertEqual(diff.loc["ESN Latvia", "before"], 3)
+        self.assertTrue(pd.isna(diff.loc["ESN Latvia", "after"]))
+        self.assertTrue(pd.isna(diff.loc["ESN Malta", "before"]))
+        self.assertEqual(diff.loc["ESN Malta", "after"], 2)
+
+    def test_sources_are_kept_apart(self):
+        diff = diff_runs(self.history, self.first, self.second, source="wiki")
+
+        self.assertEqual(diff.to_dict("index"), {"ESN Austria": {"before": 14, "after": 15}})
+        self.assertEqual(len(diff_runs(self.history, self.second, self.second)), 0)
+
+
+class TestExport(HistoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        super().tearDown()
+
+    def test_csv(self):
+        path = Path(self.tmp_dir.name) / "history.csv"
+        n_rows = export_history(self.history, path)
+        table = pd.read_csv(path)
+
+        self.assertEqual(n_rows, 4 + 2 + 4 + 2)
+        self.assertEqual(list(table.columns), ["run_id", "taken_at", "source", "country", "sections"])
+        self.assertEqual(len(table), n_rows)
+        self.assertEqual(table.iloc[0].tolist(), [self.first, "2024-05-01T12:00:00+00:00", "website", "ESN Austria", 14])
+        self.assertEqual(table.iloc[-1].tolist(), [self.second, "2024-06-01T12:00:00+00:00", "wiki", "ESN Belgium", 15])
+
+    def test_json(self):
+        path = Path(self.tmp_dir.name) / "history.json"
+        n_rows = export_history(self.history, path)
+        records = json.loads(path.read_text())
+
+        self.assertEqual(len(records), n_rows)
+        self.assertIn({"run_id": self.second, "taken_at": "2024-06-01T12:00:00+00:00", "source": "website", "country": "ESN Malta", "sections": 2}, records)
+        self.assertNotIn("ESN Malta", {record["country"] for record in records if record["run_id"] == self.first})
+
+
+# A bad --diff value stops the script with a message before any page is fetched
+class TestCommandLine(unittest.TestCase):
+    def test_invalid_diff(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            process = subprocess.run(
+                [sys.executable, "section_count.py", "--no-fetch", "--history", str(Path(tmp_dir) / "history.sqlite"), "--diff", "yesterday"],
+                cwd=SECTION_COUNT_PATH,
+                capture_output=True,
+                text=True,
+            )
+
+        self.assertEqual(process.returncode, 1)
+        self.assertIn("Invalid --diff run: 'yesterday' is neither a run id", process.stderr)
+        self.assertNotIn("Traceback", process.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
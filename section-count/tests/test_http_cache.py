@@ -0,0 +1,161 @@
+# Tests of the on-disk HTTP cache against the recorded pages of a local stub server
+# Run them from the section-count folder: python -m unittest discover -s tests
+
+# Default libraries
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# Make the helpers importable when running from anywhere
+SECTION_COUNT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SECTION_COUNT_PATH))
+
+# Custom libraries
+from helpers.fetching import Fetcher
+from helpers.http_cache import HttpCache, CacheMiss
+from section_count import count_sections
+from stub_server import StubServer, load_pages
+
+
+AUSTRIA_PAGE = "/country/austria"
+
+TTL = 60
+
+
+def make_fetcher(cache, offline=False):
+    return Fetcher(concurrency=4, retries=0, backoff=0, timeout=5, cache=cache, offline=offline)
+
+
+def fetch(cache, url, offline=False):
+    with make_fetcher(cache, offline=offline) as fetcher:
+        text = fetcher.get_text(url)
+
+    return text, fetcher.timings[0]["source"]
+
+
+# Make an entry look as if it was fetched some seconds earlier
+def age_entry(cache, url, seconds):
+    path_meta = cache.entry_paths(url)[0]
+    meta = json.loads(path_meta.read_text())
+    meta["fetched_at"] -= seconds
+    path_meta.write_text(json.dumps(meta))
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = HttpCache(Path(self.tmp_dir.name) / "cache", ttl=TTL)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+class TestRevalidation(CacheTestCase):
+    def assert_revalidated(self, server):
+        url = server.base_url + AUSTRIA_PAGE
+        first, first_source = fetch(self.cache, url)
+        age_entry(self.cache, url, TTL + 1)
+        second, second_source = fetch(self.cache, url)
+
+        self.assertEqual((first_source, second_source), ("network", "revalidated"))
+        self.assertEqual(server.statuses, [(AUSTRIA_PAGE, 200), (AUSTRIA_PAGE, 304)])
+        self.assertEqual(second, first)
+
+        # The 304 answer makes the entry fresh again
+        self.assertEqual(fetch(self.cache, url)[1], "cache")
+        self.assertEqual(server.hits[AUSTRIA_PAGE], 2)
+
+    def test_etag(self):
+        with StubServer(validators=("etag",)) as server:
+            self.assert_revalidated(server)
+
+        self.assertIsNone(self.cache.load(server.base_url + AUSTRIA_PAGE)["last_modified"])
+
+    def test_last_modified(self):
+        with StubServer(validators=("last_modified",)) as server:
+            self.assert_revalidated(server)
+
+        self.assertIsNone(self.cache.load(server.base_url + AUSTRIA_PAGE)["etag"])
+
+    # A page changed on the server is downloaded again and replaces the cached one
+    def test_changed_page_is_downloaded(self):
+        with StubServer() as server:
+            url = server.base_url + AUSTRIA_PAGE
+            fetch(self.cache, url)
+            server.update_page(AUSTRIA_PAGE, b"<html>changed</html>")
+            age_entry(self.cache, url, TTL + 1)
+            text, source = fetch(self.cache, url)
+
+        self.assertEqual((text, source), ("<html>changed</html>", "network"))
+        self.assertEqual(server.statuses, [(AUSTRIA_PAGE, 200), (AUSTRIA_PAGE, 200)])
+        self.assertEqual(self.cache.load(url)["body"], b"<html>changed</html>")
+
+
+class TestExpiry(CacheTestCase):
+    def test_fresh_entries_are_not_requested(self):
+        with StubServer() as server:
+            url = server.base_url + AUSTRIA_PAGE
+            fetch(self.cache, url)
+            age_entry(self.cache, url, TTL - 10)
+            source = fetch(self.cache, url)[1]
+            hits = server.hits[AUSTRIA_PAGE]
+
+        self.assertEqual((source, hits), ("cache", 1))
+
+    def test_expired_entries_are_revalidated(self):
+        with StubServer() as server:
+            url = server.base_url + AUSTRIA_PAGE
+            fetch(self.cache, url)
+            age_entry(self.cache, url, TTL + 1)
+            source = fetch(self.cache, url)[1]
+            hits = server.hits[AUSTRIA_PAGE]
+
+        self.assertEqual((source, hits), ("revalidated", 2))
+
+
+class TestReplay(CacheTestCase):
+    # Offline, even expired entries are used as they are, with no server to ask
+    def test_replay_without_server(self):
+        with StubServer() as server:
+            url = server.base_url + AUSTRIA_PAGE
+            fetched = fetch(self.cache, url)[0]
+
+        age_entry(self.cache, url, TTL + 1)
+        text, source = fetch(self.cache, url, offline=True)
+
+        self.assertEqual((text, source), (fetched, "cache"))
+        self.assertEqual(text, load_pages()[AUSTRIA_PAGE].decode())
+
+    def test_replay_miss(self):
+        with StubServer() as server:
+            url = server.base_url + AUSTRIA_PAGE
+
+        with self.assertRaises(CacheMiss):
+            fetch(self.cache, url, offline=True)
+
+        self.assertEqual(list(self.cache.urls()), [])
+
+    # The comparison made from the replayed pages is the one made online, the server being gone
+    def test_comparison_from_replayed_pages(self):
+        with StubServer() as server:
+            with make_fetcher(self.cache) as fetcher:
+                online = count_sections(fetcher, base_url=server.base_url, wiki_url=server.wiki_url, progress=False)
+
+        with make_fetcher(self.cache, offline=True) as fetcher:
+            replayed = count_sections(fetcher, base_url=server.base_url, wiki_url=server.wiki_url, progress=False)
+
+        self.assertEqual({timing["source"] for timing in fetcher.timings}, {"cache"})
+        self.assertEqual(replayed["global_section_count"], 61)
+        self.assertEqual(replayed["counts_comparison"].to_dict("index"), {"ESN Belgium": {"wiki": 15, "website": 16}})
+
+        for key in ("global_section_count", "global_country_count"):
+            self.assertEqual(replayed[key], online[key])
+
+        for key in ("main_country_counts", "wiki_country_counts", "counts_comparison"):
+            self.assertTrue(replayed[key].equals(online[key]), key)
+
+
+if __name__ == "__main__":
+    unittest.main()
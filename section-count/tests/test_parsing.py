@@ -0,0 +1,54 @@
+# Tests of the lxml parsers against the BeautifulSoup ones of the notebook, on the recorded pages
+# Run them from the section-count folder: python -m unittest discover -s tests
+
+# Default libraries
+import sys
+import unittest
+from pathlib import Path
+
+# Make the helpers importable when running from anywhere
+SECTION_COUNT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SECTION_COUNT_PATH))
+
+# Custom libraries
+from helpers import parsing, scraping
+from stub_server import load_pages, SECTIONS_PAGE, WIKI_PAGE
+
+
+BASE_URL = "https://www.esn.org"
+
+
+class TestParsing(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pages = {path: body.decode("utf-8") for path, body in load_pages().items()}
+
+    def test_main_page(self):
+        text = self.pages[SECTIONS_PAGE]
+        global_counts, country_urls = parsing.parse_main_page(text, BASE_URL)
+
+        self.assertEqual((global_counts, country_urls), scraping.parse_main_page(text, BASE_URL))
+        self.assertEqual(global_counts, [61, 4])
+        self.assertEqual(country_urls, [BASE_URL + "/country/" + name for name in ("austria", "belgium", "germany", "united-kingdom")])
+
+    def test_country_pages(self):
+        country_paths = [path for path in self.pages if path.startswith("/country/")]
+        self.assertEqual(len(country_paths), 4)
+
+        for path in country_paths:
+            with self.subTest(path=path):
+                self.assertEqual(parsing.parse_country_page(self.pages[path]), scraping.parse_country_page(self.pages[path]))
+
+        self.assertEqual(parsing.parse_country_page(self.pages["/country/united-kingdom"]), ("ESN UK", 4))
+
+    # Names lose their parentheses and footnote marks, and "-" counts as no section
+    def test_wiki_page(self):
+        counts = parsing.parse_wiki_page(self.pages[WIKI_PAGE])
+
+        self.assertTrue(counts.equals(scraping.parse_wiki_page(self.pages[WIKI_PAGE])))
+        self.assertEqual(counts.name, "wiki")
+        self.assertEqual(counts.to_dict(), {"ESN Austria": 14, "ESN Belgium": 15, "ESN Germany": 27, "ESN Liechtenstein": 0, "ESN United Kingdom": 4})
+
+
+if __name__ == "__main__":
+    unittest.main()
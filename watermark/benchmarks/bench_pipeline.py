@@ -0,0 +1,329 @@
+# Benchmark suite of the watermarking pipeline, on synthetic inputs generated locally
+# Run it from the watermark folder: python benchmarks/bench_pipeline.py -o bench.json
+
+# Default libraries
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Make the helpers importable when running from anywhere
+WATERMARK_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(WATERMARK_PATH))
+
+# External libraries
+import PIL
+from PIL import Image
+
+# Custom libraries
+from helpers.batch import process_job
+from helpers.encoders import OUTPUT_FORMAT_OPTIONS
+from helpers.file_operations import attempt_open_image, load_logos, load_pillow_heif
+from helpers.image_manipulation import (
+	compute_positioning_data,
+	compute_positioning_settings,
+	generate_watermarked_image,
+	logo_dims_from_image_and_ratio,
+	nearest_integer_scale,
+	scale_logos_with_supersampling,
+	EXIF_ORIENTATION_TAG
+)
+from helpers.others import (
+	color_mapping_from_setting,
+	position_list_from_setting,
+	settings_from_args,
+	setup_argparser,
+	COLOR_OPTIONS,
+	DEFAULT_VALUES,
+	LOGO_FILENAMES,
+	POSITION_OPTIONS
+)
+from helpers.stamp_cache import STAMP_CACHE
+from helpers.timing import pop_timings
+
+
+# Pillow format name and extension of the synthetic inputs
+INPUT_FORMATS = {
+	"jpeg":	("JPEG", ".jpg"),
+	"png":	("PNG", ".png"),
+	"webp":	("WEBP", ".webp"),
+	"heif":	("HEIF", ".heic"),
+}
+
+ASPECT_RATIO = 3 / 2
+
+
+def dims_from_megapixels(megapixels):
+	height = int((megapixels * 1e6 / ASPECT_RATIO) ** .5)
+	return int(height * ASPECT_RATIO), height
+
+
+# Gradients and noise, so that encoders have some real work to do
+def synthetic_image(size):
+	red = Image.linear_gradient("L").resize(size)
+	green = Image.radial_gradient("L").resize(size)
+	blue = Image.effect_noise(size, 48)
+	return Image.merge("RGB", (red, green, blue))
+
+
+# Write the synthetic corpus, JPEG inputs get every EXIF orientation
+def generate_corpus(corpus_path, megapixels_list, input_formats):
+	corpus = []
+
+	for megapixels in megapixels_list:
+		image = synthetic_image(dims_from_megapixels(megapixels))
+
+		for input_format in input_formats:
+			pil_format, ext = INPUT_FORMATS[input_format]
+			orientations = range(1, 9) if input_format == "jpeg" else [1]
+
+			for orientation in orientations:
+				exif = Image.Exif()
+				exif[EXIF_ORIENTATION_TAG] = orientation
+
+				image_path = corpus_path / "{}mp_o{}{}".format(megapixels, orientation, ext)
+				image.save(image_path, format=pil_format, exif=exif.tobytes())
+
+				corpus.append({
+					"path":			image_path,
+					"format":		input_format,
+					"megapixels":	megapixels,
+					"orientation":	orientation,
+				})
+
+	return corpus
+
+
+def measure(function, repeats):
+	durations = []
+
+	for _ in range(repeats):
+		start = time.perf_counter()
+		function()
+		durations.append(time.perf_counter() - start)
+
+	return {
+		"min":		min(durations),
+		"median":	statistics.median(durations),
+		"mean":		statistics.mean(durations),
+	}
+
+
+def build_settings(cli_args, path_output, path_invalid):
+	ap = setup_argparser(default_vals=DEFAULT_VALUES, color_options=COLOR_OPTIONS, pos_choices=POSITION_OPTIONS, format_choices=OUTPUT_FORMAT_OPTIONS)
+	return settings_from_args(vars(ap.parse_args(cli_args)), path_output=path_output, path_invalid=path_invalid)
+
+
+def bench_open(corpus, path_invalid, repeats):
+	results = []
+
+	for item in corpus:
+		seconds = measure(lambda: attempt_open_image(item["path"], path_invalid=path_invalid, attempt_rotate=True), repeats)
+		results.append({
+			"benchmark":	"attempt_open_image",
+			"params":		{key: item[key] for key in ("format", "megapixels", "orientation")},
+			"seconds":		seconds,
+		})
+
+	return results
+
+
+def bench_positioning(megapixels_list, logos, settings, repeats, iterations=1000):
+	results = []
+
+	for megapixels in megapixels_list:
+		image_size = dims_from_megapixels(megapixels)
+		logo_dims = logo_dims_from_image_and_ratio(logos["color"].size, image_size, settings["image_watermark_ratio"])
+		positioning_settings = compute_positioning_settings(logo_dims, settings=settings)
+		logo_ss_size = nearest_integer_scale(logo_dims, scale_factor=settings["ss_factor"])
+
+		def run():
+			for _ in range(iterations):
+				for position_str in POSITION_OPTIONS[:4]:
+					compute_positioning_data(image_size, logo_ss_size, position_str, positioning_settings, settings["ss_factor"])
+
+		seconds = measure(run, repeats)
+		results.append({
+			"benchmark":	"compute_positioning_data",
+			"params":		{"megapixels": megapixels, "calls": 4 * iterations},
+			"seconds":		{key: value / (4 * iterations) for key, value in seconds.items()},
+		})
+
+	return results
+
+
+def bench_generate(megapixels_list, logos, settings, ss_factors, repeats):
+	results = []
+
+	for megapixels in megapixels_list:
+		image = synthetic_image(dims_from_megapixels(megapixels))
+		logo_dims = logo_dims_from_image_and_ratio(logos["color"].size, image.size, settings["image_watermark_ratio"])
+		positioning_settings = compute_positioning_settings(logo_dims, settings=settings)
+
+		for ss_factor in ss_factors:
+			logos_ss = scale_logos_with_supersampling(logos, target_dims=logo_dims, ss_factor=ss_factor)
+			positioning_data = compute_positioning_data(image.size,
+														logo_ss_size=logos_ss["color"].size,
+														position_str=POSITION_OPTIONS[0],
+														positioning_settings=positioning_settings,
+														ss_factor=ss_factor)
+
+			seconds = measure(lambda: generate_watermarked_image(	image,
+																	logo_ss=logos_ss["white"],
+																	circle_color=COLOR_OPTIONS["magenta"],
+																	ss_factor=ss_factor,
+																	positioning_data=positioning_data), repeats)
+			results.append({
+				"benchmark":	"generate_watermarked_image",
+				"params":		{"megapixels": megapixels, "ss_factor": ss_factor},
+				"seconds":		seconds,
+			})
+
+	return results
+
+
+# Full runs of single images, through the same function as the command line tool
+def bench_end_to_end(corpus, logos, work_path, ss_factors, engines, output_formats, repeats):
+	results = []
+	items = [item for item in corpus if item["orientation"] == 1]
+	fanouts = {
+		"single":	("magenta", "bottom_right"),
+		"all":		("all", "all"),
+	}
+
+	for item in items:
+		for engine in engines:
+			for ss_factor in ss_factors:
+				for fanout, (color_setting, position_setting) in fanouts.items():
+					for output_format in output_formats:
+						path_output = Path(tempfile.mkdtemp(dir=work_path))
+						settings = build_settings(	["-e", engine, "-ss", str(ss_factor), "-c", color_setting, "-p", position_setting, "-of", output_format],
+													path_output=path_output,
+													path_invalid=work_path / "invalid")
+
+						job = (	item["path"],
+								position_list_from_setting(position_setting),
+								color_mapping_from_setting(color_setting))
+
+						# Every repeat starts with a cold stamp cache, like the first image of a run
+						def run():
+							STAMP_CACHE.clear()
+							process_job(job, logos=logos, settings=settings)
+
+						seconds = measure(run, repeats)
+						pop_timings()
+
+						results.append({
+							"benchmark":	"end_to_end",
+							"params":		{
+								"format":			item["format"],
+								"megapixels":		item["megapixels"],
+								"engine":			engine,
+								"ss_factor":		ss_factor,
+								"fanout":			fanout,
+								"output_format":	output_format,
+							},
+							"seconds":		seconds,
+						})
+
+	return results
+
+
+def result_key(result):
+	return result["benchmark"] + json.dumps(result["params"], sort_keys=True)
+
+
+# Print the ratio of each median to the one of a previous report
+def compare_results(results, baseline_path, threshold):
+	with open(baseline_path) as f:
+		baseline = {result_key(result): result for result in json.load(f)["results"]}
+
+	regressions = 0
+
+	for result in results:
+		previous = baseline.get(result_key(result))
+
+		if previous is None:
+			continue
+
+		ratio = result["seconds"]["median"] / previous["seconds"]["median"]
+
+		if ratio > 1 + threshold:
+			regressions += 1
+			print("Regression x{:.2f}: {} {}".format(ratio, result["benchmark"], result["params"]))
+
+	print(regressions, "regression(s) above {:.0%}".format(threshold))
+	return regressions
+
+
+def setup_bench_argparser():
+	ap = argparse.ArgumentParser(description="Benchmarks of the ESN Lausanne Watermark Inserter")
+	ap.add_argument("-o",	"--output",			action="store", type=str,	default="bench.json",									help="path of the JSON results (default is 'bench.json')")
+	ap.add_argument("-mp",	"--megapixels",		action="store", type=float,	default=[1, 6, 24], nargs="+",							help="resolutions of the synthetic inputs (default is 1 6 24)")
+	ap.add_argument("-f",	"--formats",		action="store", type=str,	default=["jpeg", "png", "webp", "heif"], nargs="+",		help="formats of the synthetic inputs, HEIF is skipped if pillow-heif can't write it")
+	ap.add_argument("-ss",	"--ss-factors",		action="store", type=int,	default=[1, 2, 4], nargs="+",							help="supersampling factors to compare (default is 1 2 4)")
+	ap.add_argument("-e",	"--engines",		action="store", type=str,	default=["stamp", "numpy", "supersample"], nargs="+",	help="compositing engines of the end-to-end runs")
+	ap.add_argument("-of",	"--output-formats",	action="store", type=str,	default=["png", "jpeg", "webp"], nargs="+",				help="output formats of the end-to-end runs (default is png jpeg webp)")
+	ap.add_argument("-r",	"--repeats",		action="store", type=int,	default=3,												help="number of timed repeats of each benchmark (default is 3)")
+	ap.add_argument("-c",	"--compare",		action="store", type=str,	default=None, metavar="PATH",							help="compare the results with a previous JSON report and exit with an error on regressions")
+	ap.add_argument("-t",	"--threshold",		action="store", type=float,	default=.1,												help="relative slowdown reported as a regression (default is 0.1)")
+	return ap
+
+
+if __name__ == "__main__":
+	args = vars(setup_bench_argparser().parse_args())
+
+	# Load every Pillow plugin, so that the list of writable formats is complete
+	Image.init()
+	load_pillow_heif()
+	input_formats = [input_format for input_format in args["formats"] if INPUT_FORMATS[input_format][0] in Image.SAVE]
+
+	logos = load_logos(WATERMARK_PATH / "logos", LOGO_FILENAMES)
+
+	with tempfile.TemporaryDirectory() as work_dir:
+		work_path = Path(work_dir)
+		corpus_path = work_path / "corpus"
+		path_invalid = work_path / "invalid"
+		corpus_path.mkdir()
+		path_invalid.mkdir()
+
+		print("Generating the synthetic corpus")
+		corpus = generate_corpus(corpus_path, args["megapixels"], input_formats)
+		default_settings = build_settings([], path_output=work_path, path_invalid=path_invalid)
+
+		results = []
+
+		print("Benchmarking attempt_open_image")
+		results += bench_open(corpus, path_invalid, args["repeats"])
+
+		print("Benchmarking compute_positioning_data")
+		results += bench_positioning(args["megapixels"], logos, default_settings, args["repeats"])
+
+		print("Benchmarking generate_watermarked_image")
+		results += bench_generate(args["megapixels"], logos, default_settings, args["ss_factors"], args["repeats"])
+
+		print("Benchmarking end-to-end runs")
+		results += bench_end_to_end(corpus, logos, work_path, args["ss_factors"], args["engines"], args["output_formats"], args["repeats"])
+
+	report = {
+		"environment": {
+			"python":		platform.python_version(),
+			"pillow":		PIL.__version__,
+			"platform":		platform.platform(),
+			"cpu_count":	os.cpu_count(),
+		},
+		"results": results,
+	}
+
+	with open(args["output"], "w") as f:
+		json.dump(report, f, indent="\t")
+
+	print("Results written to", args["output"])
+
+	if args["compare"] and compare_results(results, args["compare"], args["threshold"]) > 0:
+		sys.exit(1)
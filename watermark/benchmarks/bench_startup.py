@@ -0,0 +1,110 @@
+# Startup time benchmark of the command line tool, with budgets checked on python -X importtime
+# Run it from anywhere: python benchmarks/bench_startup.py --budget-ms 150
+
+# Default libraries
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+WATERMARK_PATH = Path(__file__).resolve().parent.parent
+
+# Backends that must not be imported before a file needing them is seen
+LAZY_MODULES = ["rawpy", "pillow_heif", "numpy", "watchdog", "http.server"]
+
+
+def run_python(args):
+	return subprocess.run([sys.executable] + args, cwd=WATERMARK_PATH, capture_output=True, text=True, check=True)
+
+
+# Wall time of a fresh interpreter importing the tool, and of one printing the help of the command line
+def measure_startup(repeats):
+	results = dict()
+
+	for name, args in (("import", ["-c", "import watermark"]), ("help", ["watermark.py", "--help"])):
+		durations = []
+
+		for _ in range(repeats):
+			start = time.perf_counter()
+			run_python(args)
+			durations.append(time.perf_counter() - start)
+
+		results[name] = {
+			"min":		min(durations),
+			"median":	statistics.median(durations),
+		}
+
+	return results
+
+
+# Cumulative import time of each module in microseconds, from the lines "import time: self | cumulative | name"
+def parse_importtime(stderr):
+	cumulative = dict()
+
+	for line in stderr.splitlines():
+		if not line.startswith("import time:") or "cumulative" in line:
+			continue
+
+		_, total, name = line[len("import time:"):].split("|")
+		cumulative[name.strip()] = int(total)
+
+	return cumulative
+
+
+def check_budgets(cumulative, budget_ms, lazy_modules):
+	failures = []
+	total_ms = cumulative.get("watermark", 0) / 1000
+
+	if total_ms > budget_ms:
+		failures.append("importing watermark took {:.1f} ms, above the budget of {} ms".format(total_ms, budget_ms))
+
+	for module in lazy_modules:
+		if module in cumulative:
+			failures.append("{} is imported at startup ({:.1f} ms)".format(module, cumulative[module] / 1000))
+
+	return total_ms, failures
+
+
+def setup_bench_argparser():
+	ap = argparse.ArgumentParser(description="Startup benchmark of the ESN Lausanne Watermark Inserter")
+	ap.add_argument("-o",	"--output",		action="store", type=str,	default=None, metavar="PATH",	help="path of the JSON results")
+	ap.add_argument("-r",	"--repeats",	action="store", type=int,	default=10,						help="number of timed interpreter starts (default is 10)")
+	ap.add_argument("-b",	"--budget-ms",	action="store", type=float,	default=150,					help="cumulative import time allowed for the tool, in milliseconds (default is 150)")
+	ap.add_argument("-t",	"--top",		action="store", type=int,	default=10,						help="number of slowest imports to print (default is 10)")
+	return ap
+
+
+if __name__ == "__main__":
+	args = vars(setup_bench_argparser().parse_args())
+
+	startup = measure_startup(args["repeats"])
+
+	for name, seconds in startup.items():
+		print("{}: median {:.1f} ms, min {:.1f} ms".format(name, seconds["median"] * 1000, seconds["min"] * 1000))
+
+	# The fastest of a few runs is checked, the slower ones mostly measure noise from the machine
+	runs = [parse_importtime(run_python(["-X", "importtime", "-c", "import watermark"]).stderr) for _ in range(3)]
+	cumulative = min(runs, key=lambda imports: imports.get("watermark", 0))
+
+	print("Slowest imports:")
+
+	for name, total in sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:args["top"]]:
+		print("\t{:>8.1f} ms\t{}".format(total / 1000, name))
+
+	total_ms, failures = check_budgets(cumulative, args["budget_ms"], LAZY_MODULES)
+
+	if args["output"]:
+		with open(args["output"], "w") as f:
+			json.dump({"startup": startup, "import_ms": total_ms, "imports_us": cumulative, "failures": failures}, f, indent="\t")
+
+	for failure in failures:
+		print("Budget exceeded:", failure)
+
+	if failures:
+		sys.exit(1)
+
+	print("Import time of {:.1f} ms within the budget of {} ms".format(total_ms, args["budget_ms"]))
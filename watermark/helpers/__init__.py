@@ -1,3 +1,15 @@
-from .file_operations import *
-from .image_manipulation import *
-from .others import *
\ No newline at end of file
+# Helpers used to be star-imported here, their names are now resolved on first access so that importing
+# one helper module doesn't import all the others
+import importlib
+
+STAR_MODULES = ("file_operations", "image_manipulation", "others")
+
+
+def __getattr__(name):
+	for module_name in STAR_MODULES:
+		module = importlib.import_module("." + module_name, __name__)
+
+		if not name.startswith("_") and hasattr(module, name):
+			return getattr(module, name)
+
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
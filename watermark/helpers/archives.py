@@ -0,0 +1,195 @@
+# Default libraries
+import io
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+# Custom libraries
+from helpers.file_operations import extension_match, glob_all_except, IGNORE_EXTS
+from helpers.image_manipulation import variant_output_name
+from helpers.journal import write_atomically
+
+
+# Write modes of tarfile for each compressed suffix, streamed so that the archive is never seeked
+TAR_WRITE_MODES = {
+	".tar":		"w|",
+	".tgz":		"w|gz",
+	".tar.gz":	"w|gz",
+	".tar.bz2":	"w|bz2",
+	".tar.xz":	"w|xz",
+}
+
+ARCHIVE_SUFFIXES = (".zip",) + tuple(TAR_WRITE_MODES)
+
+# Encoded outputs waiting for the archive writer
+WRITE_QUEUE_SIZE = 16
+
+
+def is_archive(path):
+	return path.name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+# Folders created by archivers and files like .DS_Store are not pictures
+def is_skipped_member(name):
+	return name.startswith("__MACOSX/") or extension_match(PurePosixPath(name), IGNORE_EXTS)
+
+
+# Member names as relative paths, or None for the ones that would leave the output, being absolute or going up with ".."
+# Backslashes are read as separators and drive letters as absolute, like Windows archivers do
+def safe_member_path(name):
+	path = PurePosixPath(name.replace("\\", "/"))
+
+	if not path.parts or path.is_absolute() or ".." in path.parts or path.parts[0].endswith(":"):
+		return None
+
+	return path
+
+
+# Yield the (name, bytes) of every file of a zip or tar archive, or of a folder, reading one member at a time
+def iter_input_members(path_input):
+	if path_input.name.lower().endswith(".zip"):
+		with zipfile.ZipFile(path_input) as archive:
+			for info in archive.infolist():
+				if not info.is_dir() and not is_skipped_member(info.filename):
+					yield info.filename, archive.read(info)
+	elif is_archive(path_input):
+		with tarfile.open(path_input, "r|*") as archive:
+			for member in archive:
+				if member.isfile() and not is_skipped_member(member.name):
+					yield member.name, archive.extractfile(member).read()
+	else:
+		for path in glob_all_except(path_input, excluded_patterns=["*.gitkeep"]):
+			if path.is_file() and not is_skipped_member(path.name):
+				yield path.name, path.read_bytes()
+
+
+# Write (name, bytes) pairs into a zip or tar archive, or into a folder
+# Outputs are already compressed images, so zip members are stored as they are
+class OutputWriter:
+	def __init__(self, path_output):
+		self.path_output = path_output
+		self.archive = None
+		name = path_output.name.lower()
+
+		if name.endswith(".zip"):
+			self.archive = zipfile.ZipFile(path_output, "w", compression=zipfile.ZIP_STORED)
+		elif is_archive(path_output):
+			mode = next(mode for suffix, mode in TAR_WRITE_MODES.items() if name.endswith(suffix))
+			self.archive = tarfile.open(path_output, mode)
+
+	def write(self, name, data):
+		if safe_member_path(name) is None:
+			raise ValueError("Unsafe output name: " + name)
+
+		if isinstance(self.archive, zipfile.ZipFile):
+			self.archive.writestr(zipfile.ZipInfo(name, date_time=time.localtime()[:6]), data)
+		elif self.archive is not None:
+			info = tarfile.TarInfo(name)
+			info.size = len(data)
+			info.mtime = time.time()
+			self.archive.addfile(info, io.BytesIO(data))
+		else:
+			path = self.path_output / name
+
+			# Links already in the output folder could still lead out of it
+			if not path.resolve().is_relative_to(self.path_output.resolve()):
+				raise ValueError("Output outside of the output folder: " + name)
+
+			path.parent.mkdir(parents=True, exist_ok=True)
+			write_atomically(path, lambda path_tmp: path_tmp.write_bytes(data))
+
+	def close(self):
+		if self.archive is not None:
+			self.archive.close()
+
+
+# Watermark every member of the input into the output, each side being an archive or a folder
+# Members are decoded from memory, watermarked in threads and their outputs go to a writer thread, without any temporary file
+def run_archive(path_input, path_output, path_invalid, watermarker, n_threads=1):
+	if n_threads == 0:
+		n_threads = os.cpu_count() or 1
+
+	writer = OutputWriter(path_output)
+	write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+	counts = {"ok": 0, "invalid": 0}
+
+	errors = []
+
+	# After a failed write, the queue is still drained so that processing doesn't block on it
+	def write_outputs():
+		while (item := write_queue.get()) is not None:
+			if errors:
+				continue
+
+			try:
+				writer.write(*item)
+			except Exception as e:
+				errors.append(e)
+
+	writer_thread = threading.Thread(target=write_outputs, daemon=True)
+	writer_thread.start()
+
+	def process(name, data, choices):
+		member_path = safe_member_path(name)
+
+		# Members that would be written outside of the output are rejected like invalid ones
+		if member_path is None:
+			return name, data, None
+
+		try:
+			image, source_info = watermarker.load_bytes(data, filename=member_path.name)
+		except ValueError:
+			return name, data, None
+
+		def emit(variant):
+			output_name = variant_output_name(member_path, variant["suffix"], watermarker.settings, variant["source_info"])
+			return str(member_path.parent / output_name), watermarker.encode(variant["image"], source_info=variant["source_info"])
+
+		return name, data, watermarker.watermark_variants(image, source_info=source_info, emit=emit, choices=choices)
+
+	def handle(result):
+		name, data, outputs = result
+
+		# Invalid members are kept in the invalid folder, like invalid files of an input folder
+		if outputs is None:
+			counts["invalid"] += 1
+			invalid_name = PurePosixPath(name.replace("\\", "/")).name
+
+			if invalid_name not in ("", ".", ".."):
+				(path_invalid / invalid_name).write_bytes(data)
+		else:
+			counts["ok"] += 1
+
+			for output in outputs:
+				write_queue.put(output)
+
+		print("Processed {} images | Invalid: {}".format(counts["ok"], counts["invalid"]), end="\r")
+
+	try:
+		# Choices are drawn in member order, and at most a few members per thread are held in memory
+		with ThreadPoolExecutor(max_workers=n_threads) as executor:
+			pending = []
+
+			for name, data in iter_input_members(path_input):
+				pending.append(executor.submit(process, name, data, watermarker.draw_choices()))
+
+				if len(pending) >= 2 * n_threads:
+					handle(pending.pop(0).result())
+
+			while pending:
+				handle(pending.pop(0).result())
+	finally:
+		write_queue.put(None)
+		writer_thread.join()
+		writer.close()
+
+	if errors:
+		raise errors[0]
+
+	print()
+	return counts
@@ -0,0 +1,107 @@
+# Default libraries
+import os
+import random
+import signal
+from concurrent.futures import ProcessPoolExecutor
+
+# Custom libraries
+from helpers.encoders import init_encode_pool, wait_for_encodes
+from helpers.file_operations import attempt_open_image, load_logos, set_pixel_limit
+from helpers.image_manipulation import watermark_image
+from helpers.manifest import file_content_hash
+from helpers.others import position_list_from_setting, color_mapping_from_setting
+from helpers.stamp_cache import STAMP_CACHE
+from helpers.timing import pop_timings, set_input_format
+
+
+# State of a worker process, filled once by the pool initializer
+WORKER_STATE = dict()
+
+
+# Draw the random positions and colors of every image upfront, so that they don't depend on which worker runs first
+def plan_jobs(image_paths, position_setting, color_setting, seed=None):
+	rng = random.Random(seed)
+	jobs = []
+
+	for image_path in image_paths:
+		position_list = position_list_from_setting(position_setting, rng=rng)
+		color_mapping = color_mapping_from_setting(color_setting, rng=rng)
+		jobs.append((image_path, position_list, color_mapping))
+
+	return jobs
+
+
+# Open, watermark and save a single image
+# Returns its status ("ok", "ignored" or "invalid"), the paths of its outputs, its stage timings and its content hash if the run is incremental
+def process_job(job, logos, settings):
+	image_path, position_list, color_mapping = job
+
+	result = {
+		"path":			image_path,
+		"status":		"ok",
+		"outputs":		[],
+		"content_hash":	None,
+		"timings":		[],
+	}
+
+	set_input_format(image_path.suffix[1:].lower())
+
+	# Hash before opening, invalid files get moved away
+	if settings["incremental"]:
+		result["content_hash"] = file_content_hash(image_path)
+
+	image, source_info = attempt_open_image(image_path=image_path,
+											path_invalid=settings["invalid_path"],
+											attempt_rotate=settings["rotate"],
+											max_size=settings["max_size"],
+											rotate_pixels=settings["orientation_mode"] == "transpose",
+											large_image_pixels=settings["large_image_pixels"])
+
+	if image is None:
+		result["status"] = "ignored" if image_path.exists() else "invalid"
+		result["timings"] = pop_timings()
+		return result
+
+	result["outputs"] = watermark_image(image,
+										path=image_path,
+										logos=logos,
+										position_list=position_list,
+										color_mapping=color_mapping,
+										settings=settings,
+										source_info=source_info)
+
+	# Worker processes exit without joining threads, so pending encodes must be done before reporting
+	wait_for_encodes()
+	result["timings"] = pop_timings()
+
+	return result
+
+
+# Load the logos once per worker process, interruptions are left to the main process which waits for running jobs
+def init_worker(logo_path, logo_filenames, settings):
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	set_pixel_limit(settings["large_image_pixels"])
+	STAMP_CACHE.resize(settings["stamp_cache_size"])
+	init_encode_pool(settings["encode_threads"])
+	WORKER_STATE["logos"] = load_logos(logo_path, logo_filenames)
+	WORKER_STATE["settings"] = settings
+
+
+def process_job_in_worker(job):
+	return process_job(job, logos=WORKER_STATE["logos"], settings=WORKER_STATE["settings"])
+
+
+# Process all jobs and yield their results in order, using a pool of worker processes if more than one job is asked
+def run_jobs(jobs, logos, logo_path, logo_filenames, settings, n_jobs=1):
+	if n_jobs == 0:
+		n_jobs = os.cpu_count() or 1
+
+	if n_jobs == 1:
+		for job in jobs:
+			yield process_job(job, logos=logos, settings=settings)
+		return
+
+	with ProcessPoolExecutor(	max_workers=n_jobs,
+								initializer=init_worker,
+								initargs=(logo_path, logo_filenames, settings)) as executor:
+		yield from executor.map(process_job_in_worker, jobs)
@@ -0,0 +1,207 @@
+# Default libraries
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# External libraries
+from PIL import Image
+
+# Custom libraries
+from helpers.file_operations import invalidate_path, load_backend_for
+from helpers.image_manipulation import orient_image, EXIF_ORIENTATION_TAG
+from helpers.journal import write_atomically
+from helpers.manifest import file_content_hash
+from helpers.prescan import work_size, PRESCAN_THREADS
+
+
+# Longest side of the thumbnails compared by perceptual hashing, JPEG files are decoded at about this size
+THUMBNAIL_SIZE = 64
+
+# Differing bits out of 64 under which two thumbnails show the same picture
+PERCEPTUAL_MAX_DISTANCE = 4
+
+# Relative difference of aspect ratio under which two pictures can be the same, crops are not duplicates
+ASPECT_TOLERANCE = 0.02
+
+# Mean difference of the channels of 4x4 color thumbnails under which two pictures can be the same
+# The difference hash only sees luminance edges, this tells apart flat or gradient pictures of different colors
+COLOR_MAX_DISTANCE = 12
+
+
+# Difference hash of an image, each bit telling whether a pixel of a 9x8 grayscale thumbnail is darker than its right neighbour
+# It comes with the aspect ratio and a 4x4 color thumbnail, all taken upright, or None for files Pillow can't open
+def perceptual_hash(image_path):
+	try:
+		load_backend_for(image_path)
+
+		with Image.open(image_path) as image:
+			orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+			image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+			thumbnail = orient_image(image.convert("RGB"), orientation)
+	except Exception:
+		return None
+
+	pixels = list(thumbnail.convert("L").resize((9, 8), Image.Resampling.BILINEAR).getdata())
+	bits = 0
+
+	for row in range(8):
+		for col in range(8):
+			bits = (bits << 1) | (pixels[row * 9 + col] < pixels[row * 9 + col + 1])
+
+	colors = thumbnail.resize((4, 4), Image.Resampling.BOX).tobytes()
+
+	return bits, thumbnail.width / thumbnail.height, colors
+
+
+def is_perceptual_match(hash_a, hash_b):
+	(bits_a, aspect_a, colors_a), (bits_b, aspect_b, colors_b) = hash_a, hash_b
+
+	if bin(bits_a ^ bits_b).count("1") > PERCEPTUAL_MAX_DISTANCE:
+		return False
+
+	if abs(aspect_a - aspect_b) > ASPECT_TOLERANCE * max(aspect_a, aspect_b):
+		return False
+
+	return sum(abs(a - b) for a, b in zip(colors_a, colors_b)) <= COLOR_MAX_DISTANCE * len(colors_a)
+
+
+# Group the jobs showing the same picture, keeping the first job of each group, which is the largest one in work order
+# Files are only hashed when another file has the same size, perceptual hashes then group the remaining ones if asked
+# Returns the jobs to process and the duplicates of each kept input
+def plan_dedup(jobs, mode="exact", n_threads=PRESCAN_THREADS):
+	paths = [job[0] for job in jobs]
+	sizes = {path: path.stat().st_size for path in paths}
+	size_counts = dict()
+
+	for size in sizes.values():
+		size_counts[size] = size_counts.get(size, 0) + 1
+
+	with ThreadPoolExecutor(max_workers=n_threads) as executor:
+		colliding = [path for path in paths if size_counts[sizes[path]] > 1]
+		keys = dict(zip(colliding, executor.map(file_content_hash, colliding)))
+
+	kept = dict()
+	duplicates = dict()
+
+	for path in paths:
+		key = (sizes[path], keys.get(path, path))
+
+		if key in kept:
+			duplicates[kept[key]].append(path)
+		else:
+			kept[key] = path
+			duplicates[path] = []
+
+	if mode == "perceptual":
+		unique_paths = list(duplicates)
+
+		with ThreadPoolExecutor(max_workers=n_threads) as executor:
+			hashes = dict(zip(unique_paths, executor.map(perceptual_hash, unique_paths)))
+
+		kept_hashes = []
+
+		for path in unique_paths:
+			if hashes[path] is None:
+				continue
+
+			match = next((kept_path for kept_path, kept_hash in kept_hashes if is_perceptual_match(hashes[path], kept_hash)), None)
+
+			if match is None:
+				kept_hashes.append((path, hashes[path]))
+			else:
+				duplicates[match] += [path] + duplicates.pop(path)
+
+	return [job for job in jobs if job[0] in duplicates], {path: dups for path, dups in duplicates.items() if dups}
+
+
+# Duplicates an interrupted run left, grouped as it planned them, and the jobs left without them
+# Inputs finished before the interruption come back as results, so that their outputs can be linked to their duplicates
+def resume_dedup(journal, jobs, image_paths, settings):
+	paths_by_name = {image_path.name: image_path for image_path in image_paths}
+	duplicates = dict()
+	finished = []
+
+	for name, dup_names in journal["duplicates"].items():
+		dup_paths = [paths_by_name[dup_name] for dup_name in dup_names if dup_name not in journal["done"] and dup_name in paths_by_name]
+
+		if name not in paths_by_name or not dup_paths:
+			continue
+
+		duplicates[paths_by_name[name]] = dup_paths
+
+		if name in journal["done"]:
+			record = journal["done"][name]
+
+			finished.append({
+				"path":			paths_by_name[name],
+				"status":		record["status"],
+				"outputs":		record["outputs"],
+				"content_hash":	file_content_hash(paths_by_name[name]) if settings["incremental"] else None,
+				"timings":		[],
+				"resumed":		True,
+			})
+
+	dup_paths = {dup_path for dups in duplicates.values() for dup_path in dups}
+
+	return [job for job in jobs if job[0] not in dup_paths], duplicates, finished
+
+
+# Work and input bytes spared by the duplicates, from the prescan of the inputs
+def dedup_summary(duplicates, image_infos):
+	infos = {info["path"]: info for info in image_infos}
+	dup_paths = [dup_path for dups in duplicates.values() for dup_path in dups]
+
+	return "Deduplication: {} duplicate(s) of {} image(s), {:.1f} MP not decoded and {:.1f} MB not read".format(
+		len(dup_paths),
+		len(duplicates),
+		sum(work_size(infos[dup_path]) for dup_path in dup_paths if infos[dup_path]["dims"] is not None) / 1e6,
+		sum(infos[dup_path]["size"] for dup_path in dup_paths) / 1024 ** 2,
+	)
+
+
+# Hard-link a file, or copy it where links aren't possible, like across devices or on FAT drives
+# Returns whether a link was made
+def link_or_copy(path_src, path_dst):
+	try:
+		os.link(path_src, path_dst)
+		return True
+	except OSError:
+		shutil.copyfile(path_src, path_dst)
+		return False
+
+
+# Give the duplicates of a processed input the outputs of that input, under their own names
+# Returns the results of the duplicates, which share the status of the input
+def link_duplicates(result, duplicates, settings):
+	dup_results = []
+	prefix_length = len(settings["prefix"] + result["path"].stem)
+
+	for dup_path in duplicates.get(result["path"], []):
+		dup_result = {
+			"path":			dup_path,
+			"status":		result["status"],
+			"outputs":		[],
+			"content_hash":	None,
+			"timings":		[],
+			"links":		0,
+		}
+
+		if result["status"] == "invalid":
+			invalidate_path(dup_path, settings["invalid_path"])
+		elif result["status"] == "ok":
+			if result["content_hash"] is not None:
+				dup_result["content_hash"] = file_content_hash(dup_path)
+
+			for path_out in result["outputs"]:
+				path_out = settings["output_path"] / Path(path_out).name
+				path_dup_out = path_out.with_name(settings["prefix"] + dup_path.stem + path_out.name[prefix_length:])
+				linked = []
+
+				write_atomically(path_dup_out, lambda path_tmp: linked.append(link_or_copy(path_out, path_tmp)))
+				dup_result["outputs"].append(path_dup_out)
+				dup_result["links"] += sum(linked)
+
+		dup_results.append(dup_result)
+
+	return dup_results
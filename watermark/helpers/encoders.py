@@ -0,0 +1,205 @@
+# Default libraries
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# External libraries
+from PIL import ExifTags, Image
+
+# Custom libraries
+from helpers.journal import write_atomically
+from helpers.others import is_large_image
+from helpers.timing import timed, with_input_format
+
+
+OUTPUT_FORMAT_OPTIONS = [
+	"png",
+	"jpeg",
+	"webp",
+	"avif",
+	"gif",
+	"match",
+]
+
+# Pillow format name and file extension of each output format
+OUTPUT_FORMATS = {
+	"png":	("PNG", "png"),
+	"jpeg":	("JPEG", "jpg"),
+	"webp":	("WEBP", "webp"),
+	"avif":	("AVIF", "avif"),
+	"gif":	("GIF", "gif"),
+}
+
+# Output formats that can hold every frame of an animation, the others only keep the first one
+ANIMATED_OUTPUT_FORMATS = ("png", "webp", "avif", "gif")
+
+OUTPUT_EXTS = tuple("." + ext for _, ext in OUTPUT_FORMATS.values())
+
+# Output format of each input format in "match" mode, formats that can't be written fall back to JPEG
+MATCHED_FORMATS = {
+	"JPEG":	"jpeg",
+	"MPO":	"jpeg",
+	"PNG":	"png",
+	"WEBP":	"webp",
+	"AVIF":	"avif",
+	"GIF":	"gif",
+	"HEIF":	"jpeg",
+	"NEF":	"jpeg",
+}
+
+# Modes each encoder accepts as is, other modes get converted
+ENCODER_MODES = {
+	"png":	("1", "L", "LA", "I", "P", "RGB", "RGBA"),
+	"jpeg":	("L", "RGB", "CMYK"),
+	"webp":	("RGB", "RGBA"),
+	"avif":	("RGB", "RGBA"),
+	"gif":	("1", "L", "P", "RGB", "RGBA"),
+}
+
+# Thread pool of the current process, Pillow releases the GIL while encoding
+ENCODE_POOL = {
+	"executor":		None,
+	"max_pending":	0,
+	"pending":		[],
+}
+
+
+# Whether Pillow can write AVIF, natively or through a plugin
+# Pillow only fills its registry of formats once Image.init() has run, which nothing may have triggered yet
+def can_write_avif():
+	Image.init()
+	return "AVIF" in Image.SAVE
+
+
+# Register an AVIF plugin if one is installed, returns whether AVIF can be written
+def register_avif_plugin():
+	if can_write_avif():
+		return True
+
+	try:
+		import pillow_avif # noqa: F401, registers itself on import
+	except ImportError:
+		try:
+			from pillow_heif import register_avif_opener
+			register_avif_opener()
+		except ImportError:
+			return False
+
+	return can_write_avif()
+
+
+def output_format_from_setting(format_setting, source_info):
+	if format_setting == "match":
+		source_format = source_info["format"] if source_info else None
+		output_format = MATCHED_FORMATS.get(source_format, "png")
+
+		# Animations whose format can't be written, like HEIF sequences, are kept animated in WebP
+		if source_info and source_info["animation"] and output_format not in ANIMATED_OUTPUT_FORMATS:
+			return "webp"
+
+		return output_format
+
+	return format_setting
+
+
+def output_extension(output_format):
+	return OUTPUT_FORMATS[output_format][1]
+
+
+def convert_for_encoder(image, output_format):
+	if image.mode in ENCODER_MODES[output_format]:
+		return image
+
+	has_alpha = "A" in image.mode or "transparency" in image.info
+
+	if has_alpha and "RGBA" in ENCODER_MODES[output_format]:
+		return image.convert("RGBA")
+
+	return image.convert("RGB")
+
+
+def encoder_options(output_format, settings, source_info):
+	if output_format == "png":
+		options = {
+			"compress_level":	settings["png_compress_level"],
+			"optimize":			settings["png_optimize"],
+		}
+	else:
+		options = {
+			"quality":			settings["quality"],
+		}
+
+	if settings["keep_metadata"] and source_info:
+		if len(source_info["exif"]) > 0:
+			options["exif"] = source_info["exif"].tobytes()
+
+		if source_info["icc_profile"]:
+			options["icc_profile"] = source_info["icc_profile"]
+
+	# Pixels left in their stored orientation need the tag to be displayed upright
+	elif source_info and source_info["orientation"] != 1:
+		exif = Image.Exif()
+		exif[ExifTags.Base.Orientation] = source_info["orientation"]
+		options["exif"] = exif.tobytes()
+
+	return options
+
+
+# Encode an image to a path or file object in the given output format
+@timed("save")
+def encode_image(image, fp, output_format, settings, source_info=None):
+	if output_format == "avif":
+		register_avif_plugin()
+
+	image = convert_for_encoder(image, output_format)
+	options = encoder_options(output_format, settings, source_info)
+	animation = source_info["animation"] if source_info else None
+
+	# Pillow only stores the part of each frame that changed since the previous one, in every animated format
+	if animation and output_format in ANIMATED_OUTPUT_FORMATS:
+		options["save_all"] = True
+		options["append_images"] = [convert_for_encoder(frame, output_format) for frame in animation["frames"]]
+		options["duration"] = animation["durations"]
+
+		# A missing loop count plays the animation once, GIF outputs get the same by leaving it out
+		if animation["loop"] is not None:
+			options["loop"] = animation["loop"]
+		elif output_format != "gif":
+			options["loop"] = 1
+
+	# Outputs written to a path appear complete or not at all
+	if isinstance(fp, (str, os.PathLike)):
+		write_atomically(fp, lambda path_tmp: image.save(path_tmp, format=OUTPUT_FORMATS[output_format][0], **options))
+	else:
+		image.save(fp, format=OUTPUT_FORMATS[output_format][0], **options)
+
+
+def init_encode_pool(n_threads):
+	if n_threads > 1:
+		ENCODE_POOL["executor"] = ThreadPoolExecutor(max_workers=n_threads)
+		ENCODE_POOL["max_pending"] = n_threads
+
+
+# Encode an image in the thread pool if there is one, or right away otherwise
+def submit_encode(image, fp, output_format, settings, source_info=None):
+	executor = ENCODE_POOL["executor"]
+
+	# The frames of an animation are patched in place for the next variant, so they are encoded right away
+	# Large images are encoded right away too, rather than copied for the pool
+	if executor is None or (source_info and source_info["animation"]) or is_large_image(image.size, settings["large_image_pixels"]):
+		encode_image(image, fp, output_format, settings, source_info)
+		return
+
+	# Each pending encode holds a copy of the image, so their number is bounded
+	pending = ENCODE_POOL["pending"]
+
+	while len(pending) >= ENCODE_POOL["max_pending"]:
+		pending.pop(0).result()
+
+	pending.append(executor.submit(with_input_format(encode_image), image.copy(), fp, output_format, settings, source_info))
+
+
+def wait_for_encodes():
+	pending = ENCODE_POOL["pending"]
+
+	while pending:
+		pending.pop(0).result()
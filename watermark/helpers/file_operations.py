@@ -1,33 +1,46 @@
 # Default libraries
+import fnmatch
+import io
+import math
 import shutil
 from pathlib import Path
 
 # External libraries
-import rawpy as rp
 from PIL import Image, ImageSequence, UnidentifiedImageError
 
 # Custom libraries
-from helpers.image_manipulation import tilt_img
+from helpers.image_manipulation import get_exif_orientation, orient_image, tilt_img, EXIF_ORIENTATION_TAG
+from helpers.others import is_large_image, LARGE_IMAGE_LIMIT_FACTOR
+from helpers.timing import timed
 
 
-OTHER_EXTS = ('.jpg', '.png', '.jpeg', '.ico', '.webp')
+OTHER_EXTS = ('.jpg', '.png', '.jpeg', '.ico', '.webp', '.gif', '.tif', '.tiff')
 HEI_EXTS = ('.heic', '.heif')
 RAWPY_EXTS = ('.nef',)
 IMG_EXTS = OTHER_EXTS + HEI_EXTS + RAWPY_EXTS
 
+# Pillow turns the pixels of these formats upright as it decodes them, like pillow-heif does for HEIF files
+DECODER_ORIENTED_FORMATS = ('TIFF',)
+
+# Pages of these formats are separate pictures rather than frames, only the first one is watermarked
+PAGED_FORMATS = ('TIFF',)
+
 IGNORE_EXTS = ('.ds_store')
 
 INVALID_COUNT = 0
 
+# Rotations applied by LibRaw for its flip values, needed to match embedded previews with the demosaiced image
+RAWPY_FLIP_TRANSPOSES = {
+	3: Image.Transpose.ROTATE_180,
+	5: Image.Transpose.ROTATE_90,
+	6: Image.Transpose.ROTATE_270,
+}
+
 
 # Glob all filenames in a given path with a given pattern, but exclude the patterns in the exclusion list
 def glob_all_except(path, base_pattern="*", excluded_patterns=[]):
-	matches = set(path.glob(base_pattern))
-
-	for pattern in excluded_patterns:
-		matches = matches - set(path.glob(pattern))
-
-	return list(matches)
+	matches = [match for match in path.glob(base_pattern) if not any(fnmatch.fnmatch(match.name, pattern) for pattern in excluded_patterns)]
+	return sorted(matches)
 
 
 def extension_match(image_path, extension_list):
@@ -58,62 +71,278 @@ def create_dir_if_missing(dir_path):
 	return False
 
 
-def open_rawpy_image(image_path):
-    image = rp.imread(image_path)
-    image = image.postprocess(use_camera_wb=True)
+# Open the logo files once and load their pixels so the file handles get closed
+def load_logos(logo_path, logo_filenames):
+	logos = dict()
+
+	for key, filename in logo_filenames.items():
+		logos[key] = Image.open(logo_path / filename)
+		logos[key].load()
+
+	return logos
+
+
+# Format backends, only imported once a file that needs them is seen, as they are slow to import
+BACKENDS = dict()
+
+
+def load_rawpy():
+    if "rawpy" not in BACKENDS:
+        import rawpy
+        BACKENDS["rawpy"] = rawpy
+
+    return BACKENDS["rawpy"]
+
+
+# Pillow warns about images above this many pixels as possible decompression bombs, and refuses those of twice as many
+DEFAULT_MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS
+
+
+def set_pixel_limit(large_image_pixels):
+    if large_image_pixels is None:
+        Image.MAX_IMAGE_PIXELS = DEFAULT_MAX_IMAGE_PIXELS
+    else:
+        Image.MAX_IMAGE_PIXELS = max(DEFAULT_MAX_IMAGE_PIXELS, large_image_pixels * LARGE_IMAGE_LIMIT_FACTOR)
+
+
+# Also enables the HEIF/HEIC Pillow plugin
+def load_pillow_heif():
+    if "pillow_heif" not in BACKENDS:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+        BACKENDS["pillow_heif"] = pillow_heif
+
+    return BACKENDS["pillow_heif"]
+
+
+# Import the backend needed to decode a file, if any
+def load_backend_for(image_path):
+    if extension_match(image_path, RAWPY_EXTS):
+        load_rawpy()
+    elif extension_match(image_path, HEI_EXTS):
+        load_pillow_heif()
+
+
+# Errors raised by the backends that were imported, on files that can't be decoded
+def backend_errors():
+    errors = (UnidentifiedImageError, OSError, Image.DecompressionBombError)
+
+    if "rawpy" in BACKENDS:
+        errors += (BACKENDS["rawpy"].LibRawError,)
+
+    return errors
+
+
+# Check whether an image of the given size still covers the requested maximum size
+def covers_max_size(size, max_size):
+    return max_size is None or max(size) >= max_size
+
+
+# Open the JPEG preview embedded in a raw file, if there is one
+def open_rawpy_thumbnail(raw):
+    rp = load_rawpy()
+
+    try:
+        thumbnail = raw.extract_thumb()
+    except (rp.LibRawNoThumbnailError, rp.LibRawUnsupportedThumbnailError):
+        return None
+
+    if thumbnail.format != rp.ThumbFormat.JPEG:
+        return None
+
+    image = Image.open(io.BytesIO(thumbnail.data))
+    image.load()
+
+    transpose = RAWPY_FLIP_TRANSPOSES.get(raw.sizes.flip)
+    return image if transpose is None else image.transpose(transpose)
+
+
+# Open a raw file with the cheapest decode that covers the maximum size: embedded preview, half-size demosaic or full demosaic
+def open_rawpy_image(image_path, max_size=None):
+    rp = load_rawpy()
+
+    with rp.imread(image_path if hasattr(image_path, "read") else str(image_path)) as raw:
+        if max_size is not None:
+            image = open_rawpy_thumbnail(raw)
+
+            if image is not None and covers_max_size(image.size, max_size):
+                return image
+
+        half_size = max_size is not None and covers_max_size((raw.sizes.width // 2, raw.sizes.height // 2), max_size)
+        image = raw.postprocess(use_camera_wb=True, half_size=half_size)
+
     image = Image.fromarray(image)
     return image
 
 
-def open_hei_image(image_path):
+def open_hei_image(image_path, max_size=None):
+    pillow_heif = load_pillow_heif()
     image = Image.open(image_path)
     image = next(ImageSequence.Iterator(image))
+
+    # Recent pillow-heif versions can decode the thumbnails stored in the file
+    if max_size is not None and hasattr(pillow_heif, "thumbnail"):
+        thumbnail = pillow_heif.thumbnail(image, min_box=max_size)
+
+        if thumbnail is not image and covers_max_size(thumbnail.size, max_size):
+            image = thumbnail
+
     return image
 
 
-def universal_load_image(image_path):
+# Let the JPEG decoder scale the DCT down, as long as the result covers the maximum size
+def open_other_image(image_path, max_size=None):
+    image = Image.open(image_path)
+
+    if max_size is not None and image.format == "JPEG" and max(image.size) > max_size:
+        scale = max_size / max(image.size)
+        image.draft(image.mode, (math.ceil(scale * image.size[0]), math.ceil(scale * image.size[1])))
+
+    # Pillow can't read the EXIF data of a multi-page TIFF file anymore once its pixels are loaded
+    if image.format == "TIFF":
+        image.getexif()
+
+    return image
+
+
+# The format is found from the path, the data is read from the file object instead if one is given
+@timed("decode")
+def universal_load_image(image_path, max_size=None, fp=None):
     image = None
     flag = 'img'
     is_hei = False
+    source = image_path if fp is None else fp
 
     if extension_match(image_path, IGNORE_EXTS):
         flag = 'ignore'
     elif extension_match(image_path, RAWPY_EXTS):
-        image = open_rawpy_image(image_path)
+        image = open_rawpy_image(source, max_size=max_size)
     elif extension_match(image_path, HEI_EXTS):
-        image = open_hei_image(image_path)
+        image = open_hei_image(source, max_size=max_size)
         is_hei = True
     elif extension_match(image_path, OTHER_EXTS):
-        image = Image.open(image_path)
+        image = open_other_image(source, max_size=max_size)
     else:
         flag = 'invalid'
 
+    # Decode the pixels right away, so that broken files are caught here
+    if image is not None:
+        image.load()
+
     return image, flag, is_hei
 
 
 def attempt_open_image_attempt_tilt(image):
     # TODO : Implement no-tilt option in CLI arguments
-    # For non-HEI file types, try to re-orient the picture if it is allowed and orientation data is available 
-    try:
-        # TODO : Potentiellement getexif existe partout alors que _getexif pas
-        image._getexif()
-        image = tilt_img(image)
-    except AttributeError:
-        # TODO : Setting for what to do when image can't be rotated
-        pass
-     
-    return image
+    # For non-HEI file types, re-orient the picture from its EXIF data, read through getexif like the tag mode does
+    # Only JPEG and TIFF files have _getexif, PNG and WebP files would come out unrotated
+    return tilt_img(image)
+
+
+# Keep the metadata of the source file that can be passed through to the outputs
+# The EXIF data is a copy, getexif() returns the one cached by the image, which orienting the pixels edits
+def get_source_info(image, image_path, is_hei=False):
+    exif = Image.Exif()
+    exif.load(image.getexif().tobytes())
+    oriented_by_decoder = is_hei or image.format in DECODER_ORIENTED_FORMATS
+
+    # The pixels are upright already, so the passed-through EXIF data must not rotate them again
+    if oriented_by_decoder and EXIF_ORIENTATION_TAG in exif:
+        exif[EXIF_ORIENTATION_TAG] = 1
+
+    return {
+        "format": image.format or image_path.suffix[1:].upper(),
+        "exif": exif,
+        "icc_profile": image.info.get("icc_profile"),
+        "orientation": 1,
+        "oriented_by_decoder": oriented_by_decoder,
+        "animation": None,
+    }
+
+
+# Split an animated image into RGBA frames, palettes can't take a blended watermark
+# Returns the first frame and the other frames with the durations and loop count, or the image itself and None if it is still
+def split_animation(image):
+    if getattr(image, "n_frames", 1) <= 1 or image.format in PAGED_FORMATS:
+        return image, None
 
+    frames = []
+    durations = []
 
-def attempt_open_image(image_path, path_invalid, attempt_rotate):
-    image, flag, is_hei = universal_load_image(image_path)
+    for frame in ImageSequence.Iterator(image):
+        frames.append(frame.convert("RGBA"))
+        durations.append(frame.info.get("duration", 100))
+
+    return frames[0], {
+        "frames":       frames[1:],
+        "durations":    durations,
+        "loop":         image.info.get("loop"),
+    }
+
+
+# Split animations and shrink what the decoder could not, the watermark geometry then follows the reduced size
+def finish_loading_image(image, image_path, is_hei=False, max_size=None):
+    source_info = get_source_info(image, image_path, is_hei=is_hei)
+    image, source_info["animation"] = split_animation(image)
+
+    if max_size is not None:
+        image.thumbnail((max_size, max_size))
+
+        for frame in source_info["animation"]["frames"] if source_info["animation"] else []:
+            frame.thumbnail((max_size, max_size))
+
+    return image, source_info
+
+
+# Decode an image, moving it to the invalid folder if it can't be
+def attempt_load_image(image_path, path_invalid, max_size=None, fp=None):
+    try:
+        image, flag, is_hei = universal_load_image(image_path, max_size=max_size, fp=fp)
+
+        if image is not None:
+            image, source_info = finish_loading_image(image, image_path, is_hei=is_hei, max_size=max_size)
+    except backend_errors():
+        image, flag, is_hei = None, 'invalid', False
 
     if flag == 'ignore':
-        return None
+        return None, None
     elif flag == 'invalid':
-        invalidate_path(image_path, path_inv)
+        invalidate_path(image_path, path_invalid)
+        return None, None
 
-    if not is_hei and attempt_rotate:
-        image = attempt_open_image_attempt_tilt(image)
+    return image, source_info
+
+
+# With rotate_pixels off, the pixels keep their stored orientation and the watermark follows the EXIF orientation instead
+# Large images are never turned, it would take a second buffer the size of the image
+def attempt_orient_image(image, source_info, attempt_rotate, rotate_pixels=True, large_image_pixels=None):
+    is_hei = source_info["oriented_by_decoder"]
+    rotate_pixels = rotate_pixels and not is_large_image(image.size, large_image_pixels)
+
+    if not is_hei and attempt_rotate and not rotate_pixels:
+        source_info["orientation"] = get_exif_orientation(image)
+    elif not is_hei and attempt_rotate:
+        tilted_image = attempt_open_image_attempt_tilt(image)
+
+        # The other frames of an animation turn the same way as the first one
+        if tilted_image is not image and source_info["animation"]:
+            orientation = get_exif_orientation(image)
+            source_info["animation"]["frames"] = [orient_image(frame, orientation) for frame in source_info["animation"]["frames"]]
+
+        # The pixels are upright now, so the passed-through EXIF data must not rotate them again
+        if tilted_image is not image and EXIF_ORIENTATION_TAG in source_info["exif"]:
+            source_info["exif"][EXIF_ORIENTATION_TAG] = 1
+
+        image = tilted_image
 
     return image
+
+
+def attempt_open_image(image_path, path_invalid, attempt_rotate, max_size=None, rotate_pixels=True, large_image_pixels=None, fp=None):
+    image, source_info = attempt_load_image(image_path, path_invalid=path_invalid, max_size=max_size, fp=fp)
+
+    if image is None:
+        return None, None
+
+    image = attempt_orient_image(image, source_info, attempt_rotate=attempt_rotate, rotate_pixels=rotate_pixels, large_image_pixels=large_image_pixels)
+    return image, source_info
@@ -1,18 +1,45 @@
+# Default libraries
+import math
+
 # External libraries
-from PIL import ImageDraw
+from PIL import Image, ImageDraw
 
 # Custom libraries
-from helpers.others import color_mapping_from_setting # Needs to disappear
+from helpers.encoders import output_format_from_setting, output_extension, submit_encode
+from helpers.stamp_cache import STAMP_CACHE
+from helpers.timing import timed
+
 
+EXIF_ORIENTATION_TAG = 274
 
-TILT_MAP = {
-	0: 0,
-	1: 180,
-	2: 270,
-	3: 90,
+# Lossless operations turning the stored pixels upright for each EXIF orientation
+EXIF_TRANSPOSES = {
+	2: Image.Transpose.FLIP_LEFT_RIGHT,
+	3: Image.Transpose.ROTATE_180,
+	4: Image.Transpose.FLIP_TOP_BOTTOM,
+	5: Image.Transpose.TRANSPOSE,
+	6: Image.Transpose.ROTATE_270,
+	7: Image.Transpose.TRANSVERSE,
+	8: Image.Transpose.ROTATE_90,
 }
 
-EXIF_ORIENTATION_TAG = 274
+# Operations undoing the ones above, the others are their own inverse
+INVERSE_TRANSPOSES = {
+	Image.Transpose.ROTATE_90:	Image.Transpose.ROTATE_270,
+	Image.Transpose.ROTATE_270:	Image.Transpose.ROTATE_90,
+}
+
+# Position of a point of the upright image in the stored image of size (w, h), for each EXIF orientation
+ORIENTED_TO_STORED_POINT = {
+	1: lambda x, y, w, h: (x, y),
+	2: lambda x, y, w, h: (w - x, y),
+	3: lambda x, y, w, h: (w - x, h - y),
+	4: lambda x, y, w, h: (x, h - y),
+	5: lambda x, y, w, h: (y, x),
+	6: lambda x, y, w, h: (y, h - x),
+	7: lambda x, y, w, h: (w - y, h - x),
+	8: lambda x, y, w, h: (w - y, x),
+}
 
 ESN_CIRCLE_COLOR_MAP = {
 	"white": "color",
@@ -28,21 +55,53 @@ def get_dict_value_or_none_value(dictionary: dict, key):
 	return dictionary.get(key, dictionary[None])
 
 
-# Auromatically tilt an image based on its EXIF data
-def tilt_img(image):
-	try:
-		exif = image._getexif()
-	except AttributeError:
-		exif = image.getexif()
+# Get the EXIF orientation of an image, 1 if it is missing or not between 1 and 8
+def get_exif_orientation(image):
+	tilt = image.getexif().get(EXIF_ORIENTATION_TAG)
+	return tilt if tilt in range(1, 9) else 1
+
+
+# Turn stored pixels upright, returns the image itself if there is nothing to do
+def orient_image(image, orientation):
+	transpose = EXIF_TRANSPOSES.get(orientation)
+	return image if transpose is None else image.transpose(transpose)
 
-	tilt = exif.get(EXIF_ORIENTATION_TAG)
 
-	# Don't tilt if exif orientation value is not between 1 and 8
-	if tilt is None or tilt not in range(1, 9):
+# Turn upright pixels back to the stored orientation
+def unorient_image(image, orientation):
+	transpose = EXIF_TRANSPOSES.get(orientation)
+
+	if transpose is None:
 		return image
-	
-	tilt_idx = TILT_MAP[(tilt - 1) // 2]
-	return image.rotate(tilt_idx, expand=True)
+
+	return image.transpose(INVERSE_TRANSPOSES.get(transpose, transpose))
+
+
+# Size of the image once upright
+def oriented_size(size, orientation):
+	return (size[1], size[0]) if orientation >= 5 else tuple(size)
+
+
+# Bounding box in the stored image of a bounding box of the upright image
+def stored_bbox_from_oriented_bbox(bbox, orientation, stored_size):
+	x0, y0, x1, y1 = bbox
+	to_stored = ORIENTED_TO_STORED_POINT[orientation]
+
+	corner_a = to_stored(x0, y0, *stored_size)
+	corner_b = to_stored(x1, y1, *stored_size)
+
+	return (
+		min(corner_a[0], corner_b[0]),
+		min(corner_a[1], corner_b[1]),
+		max(corner_a[0], corner_b[0]),
+		max(corner_a[1], corner_b[1]),
+	)
+
+
+# Auromatically tilt an image based on its EXIF data, with exact transpositions
+@timed("orient")
+def tilt_img(image):
+	return orient_image(image, get_exif_orientation(image))
 
 
 def logo_dims_from_image_and_ratio(logo_size, image_size, image_watermark_ratio):
@@ -65,6 +124,11 @@ def scale_logos_with_supersampling(logos, target_dims, ss_factor=1):
 	return {key: logo.resize(ss_dims) for key, logo in logos.items()}
 
 
+def scale_logo_with_supersampling(logo, target_dims, ss_factor=1):
+	ss_dims = nearest_integer_scale(target_dims, scale_factor=ss_factor)
+	return logo.resize(ss_dims)
+
+
 def crop_image_with_supersampling(image, bbox, ss_factor=1):
 	crop = image.crop(box=bbox)
 	ss_dims = nearest_integer_scale(crop.size, scale_factor=ss_factor)
@@ -94,11 +158,9 @@ def paste_image_on_image_at_bbox(image, pasted_image, bbox, copy_image=False):
 	return new_image
 
 
-# Watermark an image with a given position and color
-def generate_watermarked_image(image, logo_ss, circle_color, ss_factor, positioning_data):
-	watermark_canvas_ss = crop_image_with_supersampling(image,
-											   			bbox=positioning_data["watermark_bbox"],
-														ss_factor=ss_factor)
+# Watermark a crop of the watermark bounding box with a given color
+def generate_watermarked_canvas(region, logo_ss, circle_color, ss_factor, positioning_data):
+	watermark_canvas_ss = region.resize(nearest_integer_scale(region.size, scale_factor=ss_factor))
 	
 	if circle_color is not None:
 		watermark_canvas_ss = draw_ellipse_with_supersampling(	watermark_canvas_ss,
@@ -110,8 +172,17 @@ def generate_watermarked_image(image, logo_ss, circle_color, ss_factor, position
 														pasted_image=logo_ss,
 														bbox=positioning_data["logo_pos_in_watermark_ss_bbox"])
 
-	watermark_canvas = resize_to_bbox_size(	watermark_canvas_ss,
-								   			bbox=positioning_data["watermark_bbox"])
+	return resize_to_bbox_size(	watermark_canvas_ss,
+								bbox=positioning_data["watermark_bbox"])
+
+
+# Watermark an image with a given position and color
+def generate_watermarked_image(image, logo_ss, circle_color, ss_factor, positioning_data):
+	watermark_canvas = generate_watermarked_canvas(	image.crop(box=positioning_data["watermark_bbox"]),
+													logo_ss=logo_ss,
+													circle_color=circle_color,
+													ss_factor=ss_factor,
+													positioning_data=positioning_data)
 	
 	watermarked_image = paste_image_on_image_at_bbox(	image,
 											   		pasted_image=watermark_canvas,
@@ -121,29 +192,197 @@ def generate_watermarked_image(image, logo_ss, circle_color, ss_factor, position
 	return watermarked_image
 
 
-# Watermark an image with a given position and a list of colors
-def watermark_image_pos(image, path, logos_ss, settings, positioning_data):
-	color_mapping = color_mapping_from_setting(settings["color_setting"])
-	
+# Render the watermark alone on a transparent canvas the size of the watermark bounding box
+def render_watermark_stamp(logo_ss, circle_color, ss_factor, positioning_data):
+	stamp_dims = dims_from_bbox(positioning_data["watermark_bbox"])
+	stamp_ss = Image.new("RGBA", nearest_integer_scale(stamp_dims, scale_factor=ss_factor), (0, 0, 0, 0))
+
+	if circle_color is not None:
+		stamp_ss = draw_ellipse_with_supersampling(	stamp_ss,
+													bbox=positioning_data["circle_bbox_in_watermark_bbox"],
+													color=tuple(circle_color[:3]) + (255,),
+													ss_factor=ss_factor)
+
+	# Paste the logo on its own layer first, as alpha compositing does not accept negative offsets
+	logo_layer_ss = Image.new("RGBA", stamp_ss.size, (0, 0, 0, 0))
+	logo_layer_ss.paste(logo_ss.convert("RGBA"), positioning_data["logo_pos_in_watermark_ss_bbox"])
+	stamp_ss.alpha_composite(logo_layer_ss)
+
+	# Downsample with premultiplied alpha so that the transparent background does not bleed into the edges
+	return stamp_ss.convert("RGBa").resize(stamp_dims).convert("RGBA")
+
+
+# Get the stamp of a watermark variant from the cache, rendering it on a miss
+def get_watermark_stamp(logos, logo_name, logo_dims, circle_color, ss_factor, positioning_data, engine="stamp", stamp_cache=STAMP_CACHE):
+	# The geometry relative to the watermark bounding box covers the logo size, circle ratio, offsets and position
+	key = (
+		engine,
+		logo_name,
+		tuple(nearest_integer_scale(logo_dims, scale_factor=ss_factor)),
+		ss_factor,
+		circle_color,
+		dims_from_bbox(positioning_data["watermark_bbox"]),
+		positioning_data["circle_bbox_in_watermark_bbox"],
+		positioning_data["logo_pos_in_watermark_ss_bbox"],
+	)
+
+	def render():
+		logo_ss = scale_logo_with_supersampling(logos[logo_name], target_dims=logo_dims, ss_factor=ss_factor)
+		return render_watermark_stamp(logo_ss, circle_color=circle_color, ss_factor=ss_factor, positioning_data=positioning_data)
+
+	# The NumPy engine skips supersampling, the logo is scaled once to its final size
+	def render_array():
+		from helpers.numpy_compositing import render_watermark_stamp_array # NumPy is only imported by the engine using it
+
+		logo_pos_ss_x, logo_pos_ss_y = positioning_data["logo_pos_in_watermark_ss_bbox"]
+		return render_watermark_stamp_array(logos[logo_name],
+											logo_dims=nearest_integer_scale(logo_dims, scale_factor=1),
+											logo_pos=(round(logo_pos_ss_x / ss_factor), round(logo_pos_ss_y / ss_factor)),
+											circle_color=circle_color,
+											canvas_dims=dims_from_bbox(positioning_data["watermark_bbox"]),
+											circle_bbox=positioning_data["circle_bbox_in_watermark_bbox"])
+
+	return stamp_cache.get(key, render_array if engine == "numpy" else render)
+
+
+# Watermark a crop of the watermark bounding box with the selected engine
+@timed("variant")
+def generate_watermarked_region(region, logos, logos_ss, logo_name, logo_dims, circle_color, settings, positioning_data, stamp_cache=STAMP_CACHE):
+	if settings["engine"] == "supersample":
+		return generate_watermarked_canvas(	region,
+											logo_ss=logos_ss[logo_name],
+											circle_color=circle_color,
+											ss_factor=settings["ss_factor"],
+											positioning_data=positioning_data)
+
+	stamp = get_watermark_stamp(logos,
+								logo_name=logo_name,
+								logo_dims=logo_dims,
+								circle_color=circle_color,
+								ss_factor=settings["ss_factor"],
+								positioning_data=positioning_data,
+								engine=settings["engine"],
+								stamp_cache=stamp_cache)
+
+	if settings["engine"] == "numpy":
+		from helpers.numpy_compositing import blend_stamp_array
+		return blend_stamp_array(region, stamp=stamp)
+
+	# Alpha composite the stamp in a single paste
+	return paste_image_on_image_at_bbox(region,
+										pasted_image=stamp,
+										bbox=(0, 0),
+										copy_image=True)
+
+
+# Save a watermarked variant of an image and return its path
+def variant_output_name(path, suffix, settings, source_info=None):
+	output_format = output_format_from_setting(settings["format"], source_info)
+	return settings["prefix"] + path.stem + suffix + "." + output_extension(output_format)
+
+
+def variant_output_path(path, suffix, settings, source_info=None):
+	return settings["output_path"] / variant_output_name(path, suffix, settings, source_info)
+
+
+def save_variant(image, path, suffix, settings, source_info=None):
+	output_format = output_format_from_setting(settings["format"], source_info)
+	path_out = variant_output_path(path, suffix, settings, source_info)
+	submit_encode(image, path_out, output_format=output_format, settings=settings, source_info=source_info)
+	return path_out
+
+
+# Watermark the region of the frames of an image under a given position with a list of colors, the frames themselves are left untouched
+# When the pixels are left in their stored orientation, only the watermark region is turned upright and back
+def generate_variants_pos(frames, logos, logos_ss, logo_dims, color_mapping, settings, position_suffix, positioning_data, orientation=1, stamp_cache=STAMP_CACHE):
+	bbox = stored_bbox_from_oriented_bbox(positioning_data["watermark_bbox"], orientation=orientation, stored_size=frames[0].size)
+	original_regions = [frame.crop(box=bbox) for frame in frames]
+	oriented_regions = [orient_image(original_region, orientation) for original_region in original_regions]
+	variants = []
+
 	# Loop through the selected colors
 	for i, (color_name, color) in enumerate(color_mapping.items()):
 
-		logo_ss = logos_ss[get_dict_value_or_none_value(ESN_CIRCLE_COLOR_MAP, color_name)]
+		logo_name = get_dict_value_or_none_value(ESN_CIRCLE_COLOR_MAP, color_name)
 		circle_color = color if settings["draw_circle"] else None
 
-		watermarked_image = generate_watermarked_image(	image,
-														logo_ss=logo_ss,
-														circle_color=circle_color,
-														ss_factor=settings["ss_factor"],
-														positioning_data=positioning_data)
+		patches = []
+
+		# The stamp engines render the watermark once, every other frame only pastes it from the cache
+		for frame, original_region, oriented_region in zip(frames, original_regions, oriented_regions):
+			watermarked_region = generate_watermarked_region(	oriented_region,
+																logos=logos,
+																logos_ss=logos_ss,
+																logo_name=logo_name,
+																logo_dims=logo_dims,
+																circle_color=circle_color,
+																settings=settings,
+																positioning_data=positioning_data,
+																stamp_cache=stamp_cache)
+
+			patches.append({
+				"image":			frame,
+				"bbox":				bbox,
+				"region":			unorient_image(watermarked_region, orientation),
+				"original_region":	original_region,
+			})
 		
 		if len(color_mapping) == 1:
-			suffix = ""
+			suffix = position_suffix
 		else:
-			suffix = "_" + str(i)
+			suffix = position_suffix + "_" + str(i)
+
+		variants.append({
+			"image":		frames[0],
+			"suffix":		suffix,
+			"patches":		patches,
+		})
+
+	return variants
+
+
+# Patch each variant in place in its bounding box on every frame, hand it to the emit function, then restore the original pixels
+def apply_variants(variants, emit):
+	results = []
+
+	for variant in variants:
+		for patch in variant["patches"]:
+			paste_image_on_image_at_bbox(patch["image"], pasted_image=patch["region"], bbox=patch["bbox"])
+
+		results.append(emit(variant))
+
+		# Restore without mask so that transparent pixels are put back as well
+		for patch in variant["patches"]:
+			patch["image"].paste(patch["original_region"], patch["bbox"][:2])
+
+	return results
+
+
+# Compute the paddings, circle radius and circle offset from the logo dimensions
+def compute_positioning_settings(logo_dims, settings):
+	target_logo_w, target_logo_h = logo_dims
+
+	# Get logo padding from padding ratio and logo height
+	# TODO : Make this configurable (h or w)
+	logo_padding = target_logo_h * settings["logo_padding_ratio"]
 
-	path_out = settings["output_path"] / (settings["prefix"] + path.stem + suffix + "." + settings["format"])
-	watermarked_image.save(path_out, format="png", compress_level=4)
+	# Get circle radius from logo width and logo-circle ratio
+	# TODO : Make this configurable (h or w)
+	circle_radius = target_logo_w * settings["logo_circle_ratio"] / 2
+
+	# Get logo center
+	logo_padding_x = logo_padding + target_logo_w / 2
+	logo_padding_y = logo_padding + target_logo_h / 2
+
+	# Get absolute circle offset
+	circle_offset_abs_x = target_logo_w * (settings["circle_offset_ratio_x"] - .5)
+	circle_offset_abs_y = target_logo_h * (settings["circle_offset_ratio_y"] - .5)
+
+	return {
+		"logo_paddings": (logo_padding_x, logo_padding_y),
+		"circle_offset_abs": (circle_offset_abs_x, circle_offset_abs_y),
+		"circle_radius": circle_radius,
+	}
 
 
 def compute_positioning_data(image_size, logo_ss_size, position_str, positioning_settings, ss_factor):
@@ -213,51 +452,118 @@ def compute_positioning_data(image_size, logo_ss_size, position_str, positioning
 	}
 
 
-# Watermark an image with a list of positions and a list of colors
-def watermark_image(image, path, logos, position_list, settings):
+# Shrink an image and the other frames of its animation so that its longest side is the given size
+def downscale_rendition(image, source_info, size):
+	scale = size / max(image.size)
+	dims = (max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale)))
+	rendition_info = dict(source_info)
+
+	if source_info["animation"]:
+		rendition_info["animation"] = dict(source_info["animation"])
+		rendition_info["animation"]["frames"] = [frame.resize(dims, Image.LANCZOS, reducing_gap=3.0) for frame in source_info["animation"]["frames"]]
+
+	return image.resize(dims, Image.LANCZOS, reducing_gap=3.0), rendition_info
+
+
+# Renditions of an image as (suffix, image, source info), from the largest to the smallest
+# Each one is downscaled from the previous one, images already small enough are not upscaled
+@timed("resize")
+def make_renditions(image, source_info, sizes):
+	if not sizes:
+		return [("", image, source_info)]
+
+	renditions = []
+
+	for size in sorted(sizes, key=lambda size: math.inf if size is None else size, reverse=True):
+		if size is not None and max(image.size) > size:
+			image, source_info = downscale_rendition(image, source_info, size)
+
+		renditions.append(("" if size is None else "_" + str(size), image, source_info))
+
+	return renditions
+
+
+# Watermark regions of an image for a list of positions, a list of colors and a list of rendition sizes
+@timed("watermark")
+def generate_variants(image, logos, position_list, color_mapping, settings, source_info=None, stamp_cache=STAMP_CACHE):
+	if source_info is None:
+		source_info = {"orientation": 1, "animation": None}
+
+	variants = []
+
+	for rendition_suffix, rendition, rendition_info in make_renditions(image, source_info, settings["sizes"]):
+		for variant in generate_rendition_variants(rendition, logos, position_list, color_mapping, settings, source_info=rendition_info, stamp_cache=stamp_cache):
+			variant["suffix"] += rendition_suffix
+			variant["source_info"] = rendition_info
+			variants.append(variant)
+
+	return variants
+
+
+# The watermark is proportioned to each rendition, the stamp cache keeps one stamp per rendition size
+def generate_rendition_variants(image, logos, position_list, color_mapping, settings, source_info, stamp_cache=STAMP_CACHE):
+	# Place the watermark on the upright image, even if the pixels are stored in another orientation
+	orientation = source_info["orientation"]
+	image_size = oriented_size(image.size, orientation)
+
 	# Compute logo dimensions from image dimensions and image-watermark ratio
 	target_logo_w, target_logo_h = logo_dims_from_image_and_ratio(	logo_size=logos["color"].size,
-												 					image_size=image.size,
+												 					image_size=image_size,
 																	image_watermark_ratio=settings["image_watermark_ratio"])
 	
-	# Get scaled and supersampled logos
-	logos_ss = scale_logos_with_supersampling(	logos=logos,
-										   		target_dims=(target_logo_w, target_logo_h),
-												ss_factor=settings["ss_factor"])
+	# Get scaled and supersampled logos, the cached engines only scale them on cache misses
+	if settings["engine"] in ("stamp", "numpy"):
+		logos_ss = None
+	else:
+		logos_ss = scale_logos_with_supersampling(	logos=logos,
+											   		target_dims=(target_logo_w, target_logo_h),
+													ss_factor=settings["ss_factor"])
 
-	# Get logo padding from padding ratio and logo height
-	# TODO : Make this configurable (h or w)
-	logo_padding = target_logo_h * settings["logo_padding_ratio"]
+	logo_ss_size = nearest_integer_scale((target_logo_w, target_logo_h), scale_factor=settings["ss_factor"])
 
-	# Get circle radius from logo width and logo-circle ratio
-	# TODO : Make this configurable (h or w)
-	circle_radius = target_logo_w * settings["logo_circle_ratio"] / 2
+	positioning_settings = compute_positioning_settings((target_logo_w, target_logo_h), settings=settings)
 
-	# Get logo center
-	logo_padding_x = logo_padding + target_logo_w / 2
-	logo_padding_y = logo_padding + target_logo_h / 2
+	# The other frames of an animation are watermarked at the same place
+	frames = [image]
 
-	# Get absolute circle offset
-	circle_offset_abs_x = target_logo_w * (settings["circle_offset_ratio_x"] - .5)
-	circle_offset_abs_y = target_logo_h * (settings["circle_offset_ratio_y"] - .5)
+	if source_info["animation"]:
+		frames += source_info["animation"]["frames"]
 
-	positioning_settings = {
-		"logo_paddings": (logo_padding_x, logo_padding_y),
-		"circle_offset_abs": (circle_offset_abs_x, circle_offset_abs_y),
-		"circle_radius": circle_radius,
-	}
+	variants = []
 
 	# Iterate through the given positions
 	for position_str in position_list:
 		# Get positioning data
-		positioning_data = compute_positioning_data(image_size=image.size,
-											  		logo_ss_size=get_any_dict_value(logos_ss).size,
+		positioning_data = compute_positioning_data(image_size=image_size,
+											  		logo_ss_size=logo_ss_size,
 													position_str=position_str,
 													positioning_settings=positioning_settings,
 													ss_factor=settings["ss_factor"])
 
-		watermark_image_pos(image,
-							path=path,
-							logos_ss=logos_ss,
-							positioning_data=positioning_data,
-							settings=settings)
+		# Only suffix the position when several of them are generated
+		position_suffix = "_" + position_str if len(position_list) > 1 else ""
+
+		variants += generate_variants_pos(	frames,
+											logos=logos,
+											logos_ss=logos_ss,
+											logo_dims=(target_logo_w, target_logo_h),
+											color_mapping=color_mapping,
+											position_suffix=position_suffix,
+											positioning_data=positioning_data,
+											settings=settings,
+											orientation=orientation,
+											stamp_cache=stamp_cache)
+
+	return variants
+
+
+# Watermark an image with a list of positions and a list of colors, and save every variant
+def watermark_image(image, path, logos, position_list, color_mapping, settings, source_info=None):
+	variants = generate_variants(	image,
+									logos=logos,
+									position_list=position_list,
+									color_mapping=color_mapping,
+									settings=settings,
+									source_info=source_info)
+
+	return apply_variants(variants, emit=lambda variant: save_variant(variant["image"], path=path, suffix=variant["suffix"], settings=settings, source_info=variant["source_info"]))
@@ -0,0 +1,133 @@
+# Default libraries
+import json
+import os
+from pathlib import Path
+
+# Custom libraries
+from helpers.manifest import settings_hash
+
+
+JOURNAL_FILENAME = ".wm_journal.jsonl"
+JOURNAL_VERSION = 1
+
+
+# Write a file under a temporary name and rename it once complete, so that an interruption never leaves a partial file
+def write_atomically(path, write):
+	path = Path(path)
+	path_tmp = path.with_name("." + path.name + ".tmp")
+
+	try:
+		write(path_tmp)
+		os.replace(path_tmp, path)
+	except BaseException:
+		path_tmp.unlink(missing_ok=True)
+		raise
+
+
+# Journal of a run in the output folder: a first line with the planned jobs, their random choices and the duplicates of each input, then a line per finished image
+# Each line is written at once and synced, a line cut by a crash is ignored when the journal is read back
+class Journal:
+	def __init__(self, path_output):
+		self.path = path_output / JOURNAL_FILENAME
+		self.file = None
+
+	# Replace the journal of a previous run with the plan of this one
+	# Jobs are those planned before deduplication, so that duplicates left by an interruption can still be linked
+	def start(self, jobs, settings, duplicates=None):
+		plan = {
+			"version":			JOURNAL_VERSION,
+			"settings_hash":	settings_hash(settings),
+			"jobs":				[[image_path.name, position_list, color_mapping] for image_path, position_list, color_mapping in jobs],
+			"duplicates":		{image_path.name: [dup_path.name for dup_path in dups] for image_path, dups in (duplicates or dict()).items()},
+		}
+
+		def write(path_tmp):
+			with open(path_tmp, "w") as f:
+				f.write(json.dumps(plan) + "\n")
+				f.flush()
+				os.fsync(f.fileno())
+
+		write_atomically(self.path, write)
+		self.file = open(self.path, "a")
+
+	# Keep appending to the journal of an interrupted run, after the line the interruption may have cut
+	def reopen(self):
+		with open(self.path, "rb") as f:
+			f.seek(-1, os.SEEK_END)
+			cut = f.read(1) != b"\n"
+
+		self.file = open(self.path, "a")
+
+		if cut:
+			self.file.write("\n")
+
+	def record(self, result):
+		line = json.dumps({
+			"name":		result["path"].name,
+			"status":	result["status"],
+			"outputs":	sorted(Path(path_out).name for path_out in result["outputs"]),
+		})
+
+		self.file.write(line + "\n")
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+	# A finished run has nothing to resume
+	def finish(self):
+		self.close()
+		self.path.unlink(missing_ok=True)
+
+
+# Read back the plan and the finished images of an interrupted run, with their status and outputs, None if there is no usable journal
+def load_journal(path_output):
+	try:
+		with open(path_output / JOURNAL_FILENAME) as f:
+			lines = f.read().split("\n")
+	except FileNotFoundError:
+		return None
+
+	try:
+		plan = json.loads(lines[0])
+	except ValueError:
+		return None
+
+	if plan.get("version") != JOURNAL_VERSION:
+		return None
+
+	done = dict()
+
+	# The last line may have been cut by the interruption
+	for line in lines[1:]:
+		try:
+			record = json.loads(line)
+			done[record["name"]] = record
+		except (ValueError, KeyError):
+			continue
+
+	return {
+		"settings_hash":	plan["settings_hash"],
+		"jobs":				plan["jobs"],
+		"duplicates":		plan.get("duplicates", dict()),
+		"done":				done,
+	}
+
+
+# Jobs of an interrupted run that are left to do, with the positions and colors they were given, in the planned order
+def resume_jobs(journal, image_paths):
+	paths_by_name = {image_path.name: image_path for image_path in image_paths}
+	jobs = []
+
+	for name, position_list, color_mapping in journal["jobs"]:
+		if name in journal["done"] or name not in paths_by_name:
+			continue
+
+		# JSON turned the color tuples into lists
+		color_mapping = {color_name: tuple(color) for color_name, color in color_mapping.items()}
+		jobs.append((paths_by_name[name], position_list, color_mapping))
+
+	return jobs
@@ -0,0 +1,162 @@
+# Default libraries
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+MANIFEST_FILENAME = ".wm_manifest.json"
+MANIFEST_VERSION = 1
+
+# Settings that change the content or the names of the outputs
+OUTPUT_SETTING_KEYS = (
+	"image_watermark_ratio",
+	"logo_padding_ratio",
+	"logo_circle_ratio",
+	"circle_offset_ratio_x",
+	"circle_offset_ratio_y",
+	"ss_factor",
+	"draw_circle",
+	"color_setting",
+	"position_setting",
+	"prefix",
+	"format",
+	"quality",
+	"png_compress_level",
+	"png_optimize",
+	"keep_metadata",
+	"rotate",
+	"orientation_mode",
+	"max_size",
+	"sizes",
+	"large_image_pixels",
+	"engine",
+)
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_content_hash(path):
+	digest = hashlib.blake2b(digest_size=16)
+
+	with open(path, "rb") as f:
+		while chunk := f.read(HASH_CHUNK_SIZE):
+			digest.update(chunk)
+
+	return digest.hexdigest()
+
+
+# Same hash as file_content_hash, for file contents already in memory
+def bytes_content_hash(data):
+	return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def settings_hash(settings):
+	relevant = {key: settings.get(key) for key in OUTPUT_SETTING_KEYS}
+	serialized = json.dumps(relevant, sort_keys=True, default=str)
+	return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
+
+
+def empty_manifest(settings_hash_value):
+	return {
+		"version":			MANIFEST_VERSION,
+		"settings_hash":	settings_hash_value,
+		"entries":			dict(),
+	}
+
+
+def load_manifest(path_output):
+	try:
+		with open(path_output / MANIFEST_FILENAME) as f:
+			manifest = json.load(f)
+	except (FileNotFoundError, json.JSONDecodeError):
+		return None
+
+	if manifest.get("version") != MANIFEST_VERSION:
+		return None
+
+	return manifest
+
+
+# Write the manifest to a temporary file first, so that an interrupted run never leaves a truncated one
+def save_manifest(path_output, manifest):
+	path_manifest = path_output / MANIFEST_FILENAME
+	path_tmp = path_manifest.with_name(path_manifest.name + ".tmp")
+
+	with open(path_tmp, "w") as f:
+		json.dump(manifest, f, indent="\t", sort_keys=True)
+
+	os.replace(path_tmp, path_manifest)
+
+
+def remove_outputs(path_output, output_names):
+	for output_name in output_names:
+		(path_output / output_name).unlink(missing_ok=True)
+
+
+# Check whether an input is unchanged since its entry was recorded, using the size and mtime first and the content hash if they differ
+def is_entry_unchanged(entry, image_path, stat):
+	if entry is None:
+		return False
+
+	if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+		return True
+
+	if entry["size"] != stat.st_size:
+		return False
+
+	if file_content_hash(image_path) != entry["content_hash"]:
+		return False
+
+	# Touched but identical, refresh the fast path
+	entry["mtime_ns"] = stat.st_mtime_ns
+	return True
+
+
+# Split the inputs between the ones to process and the ones to skip, and remove the outputs that became stale
+# Returns the manifest to update during the run and the paths to process
+def plan_incremental_run(image_paths, path_output, settings):
+	settings_hash_value = settings_hash(settings)
+	manifest = load_manifest(path_output)
+
+	# Different settings invalidate every previous output
+	if manifest is None or manifest["settings_hash"] != settings_hash_value:
+		if manifest is not None:
+			for entry in manifest["entries"].values():
+				remove_outputs(path_output, entry["outputs"])
+
+		manifest = empty_manifest(settings_hash_value)
+
+	entries = manifest["entries"]
+	input_names = {image_path.name for image_path in image_paths}
+	paths_todo = []
+
+	# Inputs that disappeared
+	for input_name in list(entries):
+		if input_name not in input_names:
+			remove_outputs(path_output, entries.pop(input_name)["outputs"])
+
+	for image_path in image_paths:
+		entry = entries.get(image_path.name)
+
+		if is_entry_unchanged(entry, image_path, image_path.stat()):
+			continue
+
+		# Inputs that changed
+		if entry is not None:
+			remove_outputs(path_output, entries.pop(image_path.name)["outputs"])
+
+		paths_todo.append(image_path)
+
+	return manifest, paths_todo
+
+
+def record_entry(manifest, image_path, content_hash, paths_out):
+	stat = image_path.stat()
+
+	manifest["entries"][image_path.name] = {
+		"size":			stat.st_size,
+		"mtime_ns":		stat.st_mtime_ns,
+		"content_hash":	content_hash,
+		"outputs":		sorted(Path(path_out).name for path_out in paths_out),
+	}
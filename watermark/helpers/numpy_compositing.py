@@ -0,0 +1,62 @@
+# External libraries
+import numpy as np
+from PIL import Image
+
+
+# Get the anti-aliased coverage of a circle over each pixel, computed analytically from the distance to its center
+def circle_coverage_mask(canvas_dims, circle_bbox):
+	canvas_w, canvas_h = canvas_dims
+	x0, y0, x1, y1 = circle_bbox
+
+	center_x, center_y = (x0 + x1) / 2, (y0 + y1) / 2
+	radius = (x1 - x0) / 2
+
+	# Distances are measured from pixel centers
+	offsets_x = np.arange(canvas_w, dtype=np.float32) + .5 - center_x
+	offsets_y = np.arange(canvas_h, dtype=np.float32)[:, None] + .5 - center_y
+	distances = np.sqrt(offsets_x ** 2 + offsets_y ** 2)
+
+	return np.clip(radius - distances + .5, 0, 1)
+
+
+# Scale the logo straight to its final size and place it on a premultiplied layer of the canvas size
+def logo_premultiplied_layer(logo, canvas_dims, logo_dims, logo_pos):
+	logo_scaled = logo.convert("RGBA").convert("RGBa").resize(logo_dims)
+
+	layer = Image.new("RGBa", canvas_dims, (0, 0, 0, 0))
+	layer.paste(logo_scaled, logo_pos)
+
+	return np.asarray(layer, dtype=np.float32)
+
+
+# Render a watermark as a float array holding the premultiplied color (0 to 255) and the alpha (0 to 1)
+def render_watermark_stamp_array(logo, logo_dims, logo_pos, circle_color, canvas_dims, circle_bbox):
+	logo_layer = logo_premultiplied_layer(logo, canvas_dims=canvas_dims, logo_dims=logo_dims, logo_pos=logo_pos)
+
+	stamp = np.empty(logo_layer.shape, dtype=np.float32)
+	stamp[..., :3] = logo_layer[..., :3]
+	stamp[..., 3:] = logo_layer[..., 3:] / 255
+
+	# Put the circle behind the logo
+	if circle_color is not None:
+		circle_alpha = circle_coverage_mask(canvas_dims, circle_bbox=circle_bbox)[..., None] * (1 - stamp[..., 3:])
+		stamp[..., :3] += circle_alpha * np.asarray(circle_color[:3], dtype=np.float32)
+		stamp[..., 3:] += circle_alpha
+
+	return stamp
+
+
+# Blend a stamp array over an image region of the same size
+def blend_stamp_array(region, stamp):
+	if region.mode not in ("RGB", "RGBA"):
+		region = region.convert("RGB")
+
+	pixels = np.asarray(region, dtype=np.float32)
+	alpha = stamp[..., 3:]
+
+	pixels[..., :3] = pixels[..., :3] * (1 - alpha) + stamp[..., :3]
+
+	if region.mode == "RGBA":
+		pixels[..., 3:] = pixels[..., 3:] * (1 - alpha) + 255 * alpha
+
+	return Image.fromarray(np.clip(pixels + .5, 0, 255).astype(np.uint8))
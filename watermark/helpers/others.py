@@ -8,6 +8,32 @@ import textwrap
 from PIL import ImageColor
 
 
+# Default values of the command line arguments
+DEFAULT_VALUES = {
+	"ss_factor": 	2,
+	"wm_size": 		0.07,
+	"wm_ratio": 	1.6,
+	"wm_pad": 		0.15,
+	"wm_prefix":	"wm_",
+	"input_dir": 	"input",
+	"output_dir": 	"output",
+	"format": 		"png",
+	"quality":		90,
+	"png_compression":	4,
+	"encode_threads":	1,
+	"jobs":			1,
+	"engine":		"stamp",
+	"stamp_cache":	32,
+	"orientation":	"transpose",
+	"memory_budget":	1024,
+}
+
+# Names of logo files
+LOGO_FILENAMES = {
+	"color": "logo_color.png",
+	"white": "logo_white.png",
+}
+
 COLOR_OPTIONS = {
 	"white": 	(255, 255, 255),
 	"black": 	(  0,   0,   0),
@@ -27,21 +53,37 @@ POSITION_OPTIONS = [
 	"all",
 ]
 
+ENGINE_OPTIONS = [
+	"stamp",
+	"numpy",
+	"supersample",
+]
+
+ORIENTATION_OPTIONS = [
+	"transpose",
+	"tag",
+]
+
+DEDUP_OPTIONS = [
+	"exact",
+	"perceptual",
+]
+
 
 # Color parsing
-def color_names_list_from_setting(color_setting):
+def color_names_list_from_setting(color_setting, rng=random):
 	if color_setting == "random":
-		return [random.choice(list(COLOR_OPTIONS.keys()))]
+		return [rng.choice(list(COLOR_OPTIONS.keys()))]
 	elif color_setting == "all":
 		return list(COLOR_OPTIONS.keys())
 	else:
 		return [color_setting]
 
 
-def color_mapping_from_setting(color_setting):
+def color_mapping_from_setting(color_setting, rng=random):
 	ret = dict()
 
-	for color_name in color_names_list_from_setting(color_setting):
+	for color_name in color_names_list_from_setting(color_setting, rng=rng):
 		color = COLOR_OPTIONS.get(color_name)
 
 		if color is None:
@@ -57,9 +99,9 @@ def color_mapping_from_setting(color_setting):
 
 
 # Generate list of positions based on arguments
-def position_list_from_setting(position):
+def position_list_from_setting(position, rng=random):
 	if position == "random":
-		ret = [POSITION_OPTIONS[random.randint(0, 3)]]
+		ret = [POSITION_OPTIONS[rng.randint(0, 3)]]
 	elif position == "all":
 		ret = POSITION_OPTIONS[:4]
 	else:
@@ -68,20 +110,100 @@ def position_list_from_setting(position):
 	return ret
 
 
+# Gather the settings used by the processing functions from the parsed arguments
+def settings_from_args(args, path_output, path_invalid):
+	return {
+		"image_watermark_ratio": 	args["watermark_size"],
+		"logo_padding_ratio": 		args["watermark_padding"],
+		"logo_circle_ratio": 		args["watermark_ratio"],
+		"circle_offset_ratio_x": 	.5 if args["center_circle"] else 3 / 5,
+		"circle_offset_ratio_y": 	.5 if args["center_circle"] else 1,
+		"ss_factor": 				args["supersampling"],
+		"draw_circle":				not args["no_circle"],
+		"output_path":				path_output,
+		"color_setting":			args["color"],
+		"prefix":					"" if args["no_prefix"] else DEFAULT_VALUES["wm_prefix"], # TODO : Offer option to customise the prefix
+		"format":					args["output_format"],
+		"quality":					args["quality"],
+		"png_compress_level":		args["png_compression"],
+		"png_optimize":				args["png_optimize"],
+		"keep_metadata":			args["keep_metadata"],
+		"encode_threads":			args["encode_threads"],
+		"invalid_path":				path_invalid,
+		"rotate":					not args["no_rotate"],
+		"orientation_mode":			args["orientation"],
+		"engine":					args["engine"],
+		"stamp_cache_size":			args["stamp_cache"],
+		"position_setting":			args["position"],
+		"incremental":				args["incremental"],
+		"max_size":					args["max_size"],
+		"sizes":					args["sizes"],
+		"large_image_pixels":		None if args["large_image"] is None else int(args["large_image"] * 1e6),
+	}
+
+
+# The large-image mode raises Pillow's limit against decompression bombs to this many times its threshold, so that bombs are still refused
+LARGE_IMAGE_LIMIT_FACTOR = 4
+
+
+# Large images keep their stored orientation and are encoded from their own pixels, so that they are never copied whole
+def is_large_image(size, large_image_pixels):
+	return large_image_pixels is not None and size[0] * size[1] >= large_image_pixels
+
+
+# Parse a list of rendition sizes like "full,2048,512", "full" keeps the decoded size
+def sizes_from_setting(sizes_setting):
+	sizes = []
+
+	for size in sizes_setting.split(","):
+		size = size.strip().lower()
+
+		if size == "full":
+			sizes.append(None)
+		elif size.isdigit() and int(size) > 0:
+			sizes.append(int(size))
+		else:
+			raise argparse.ArgumentTypeError("invalid rendition size: '{}'".format(size))
+
+	return sizes
+
+
 # Setup argument parser
-def setup_argparser(default_vals, color_options, pos_choices):
+def setup_argparser(default_vals, color_options, pos_choices, format_choices):
 	ap = argparse.ArgumentParser(description="ESN Lausanne Watermark Inserter", formatter_class=argparse.RawTextHelpFormatter)
 	ap.add_argument("-f",	"--flush",				action="store_true",																help="flush output folder")
+	ap.add_argument("-w",	"--watch",				action="store_true",																help="keep running and watermark new files of the input folder once they are fully written, using file system events if the watchdog package is installed and polling otherwise")
+	ap.add_argument("-sv",	"--serve",				action="store", type=int,	default=None, metavar="PORT",							help="serve watermarking over HTTP on localhost instead of processing the input folder, POST an image to / to get it back watermarked")
+	ap.add_argument("-inc",	"--incremental",		action="store_true",																help="only process new or changed inputs and remove the outputs of deleted ones, using a manifest in the output folder")
+	ap.add_argument("-dd",	"--dedup",				action="store", type=str,	default=None, nargs="?", const=DEDUP_OPTIONS[0], choices=DEDUP_OPTIONS,	help="process identical inputs once and hard-link their outputs, 'perceptual' also matches re-encoded or resized copies from small thumbnails (default is '{}' when given without a value)".format(DEDUP_OPTIONS[0]))
+	ap.add_argument("-rs",	"--resume",			action="store_true",																	help="continue an interrupted run where it stopped, with the same colors and positions for the images it had already planned")
 	ap.add_argument("-np",	"--no-prefix",			action="store_true",																help="do not add a '{}' prefix to outputs".format(default_vals["wm_prefix"]))
 	ap.add_argument("-nr",	"--no-rotate",			action="store_true",																help="do not rotate images if they are not upright")
+	ap.add_argument("-or",	"--orientation",		action="store", type=str,	default=default_vals["orientation"], choices=ORIENTATION_OPTIONS,	help="set how upright pictures are obtained, 'transpose' turns the pixels and 'tag' leaves them as stored, places the watermark accordingly and keeps the EXIF orientation tag (default is {})".format(default_vals["orientation"]))
 	ap.add_argument("-nc",	"--no-circle",			action="store_true",																help="do not add a colored circle behind the logo (not recommended)")
 	ap.add_argument("-cc",	"--center-circle",		action="store_true",																help="center the circle around the logo (not recommended)")
-	ap.add_argument("-i",	"--input-dir",			action="store", type=str,	default=default_vals["input_dir"],						help="set a custom input directory path (default is '{}')".format(default_vals["input_dir"]))
-	ap.add_argument("-o",	"--output-dir",			action="store", type=str,	default=default_vals["output_dir"],						help="set a custom output directory path (default is '{}')".format(default_vals["output_dir"]))
+	ap.add_argument("-i",	"--input-dir",			action="store", type=str,	default=default_vals["input_dir"],						help="set a custom input directory path, or a zip or tar archive read without extracting it (default is '{}')".format(default_vals["input_dir"]))
+	ap.add_argument("-o",	"--output-dir",			action="store", type=str,	default=default_vals["output_dir"],						help="set a custom output directory path, or a zip or tar archive written as images are done (default is '{}')".format(default_vals["output_dir"]))
 	ap.add_argument("-wms",	"--watermark-size",		action="store", type=float,	default=default_vals["wm_size"],						help="set the size of the watermark compared to the image's size (default is {})".format(default_vals["wm_size"]))
 	ap.add_argument("-wmr",	"--watermark-ratio",	action="store", type=float,	default=default_vals["wm_ratio"],						help="set the size ratio between the logo's width and the circle's diameter, (default is {})".format(default_vals["wm_ratio"]))
 	ap.add_argument("-wmp",	"--watermark-padding",	action="store", type=float,	default=default_vals["wm_pad"],							help="set the padding between the logo and the edge of the picture, as a ratio of the logo's height (default is {})".format(default_vals["wm_pad"]))
 	ap.add_argument("-ss",  "--supersampling",		action="store", type=int,	default=default_vals["ss_factor"], metavar="FACTOR",	help="set the supersampling factor for smoothing the circle (default is {}, smaller means faster execution but less smoothing)".format(default_vals["ss_factor"]))
+	ap.add_argument("-e",	"--engine",				action="store", type=str,	default=default_vals["engine"], choices=ENGINE_OPTIONS,	help="set the compositing engine, 'stamp' reuses cached watermarks, 'numpy' blends an analytically anti-aliased circle without supersampling and 'supersample' redraws them on each image (default is {})".format(default_vals["engine"]))
+	ap.add_argument("-sc",	"--stamp-cache",		action="store", type=int,	default=default_vals["stamp_cache"], metavar="N",		help="set the number of rendered watermarks kept in the stamp cache (default is {})".format(default_vals["stamp_cache"]))
+	ap.add_argument("-ms",	"--max-size",			action="store", type=int,	default=None, metavar="PIXELS",							help="shrink images so that their longest side is at most this size, decoding them at a reduced resolution when possible")
+	ap.add_argument("-li",	"--large-image",		action="store", type=float,	default=None, metavar="MP",								help="handle images of at least this many megapixels without copying them whole: they keep their stored orientation with the EXIF tag, only the watermark region is composited and they are encoded straight to their output file, Pillow's limit against decompression bombs is raised to {} times this size as well, except when serving".format(LARGE_IMAGE_LIMIT_FACTOR))
+	ap.add_argument("-sz",	"--sizes",				action="store", type=sizes_from_setting,	default=None, metavar="SIZES",			help="write renditions of each image with these longest sides, e.g. 'full,2048,512', each one downscaled from the previous one and suffixed with its size except 'full'")
+	ap.add_argument("-of",	"--output-format",		action="store", type=str,	default=default_vals["format"], choices=format_choices,	help="set the output format, 'match' keeps the format of each input when it can be written and uses JPEG otherwise (default is {})".format(default_vals["format"]))
+	ap.add_argument("-q",	"--quality",			action="store", type=int,	default=default_vals["quality"],						help="set the quality of JPEG, WebP and AVIF outputs (default is {})".format(default_vals["quality"]))
+	ap.add_argument("-pc",	"--png-compression",	action="store", type=int,	default=default_vals["png_compression"], choices=range(10), metavar="LEVEL",	help="set the zlib compression level of PNG outputs, from 0 to 9 (default is {})".format(default_vals["png_compression"]))
+	ap.add_argument("-po",	"--png-optimize",		action="store_true",																help="make PNG outputs as small as possible, much slower")
+	ap.add_argument("-km",	"--keep-metadata",		action="store_true",																help="copy the EXIF data and ICC profile of inputs to outputs")
+	ap.add_argument("-et",	"--encode-threads",		action="store", type=int,	default=default_vals["encode_threads"], metavar="N",	help="set the number of threads encoding outputs, each of them holds a copy of the image (default is {})".format(default_vals["encode_threads"]))
+	ap.add_argument("-r",	"--report",				action="store", type=str,	default=None, metavar="PATH",							help="write a JSON report with the time spent in each stage, per input format")
+	ap.add_argument("-j",	"--jobs",				action="store", type=int,	default=default_vals["jobs"], metavar="N",				help="set the number of worker processes (default is {}, 0 means one per CPU core)".format(default_vals["jobs"]))
+	ap.add_argument("-pl",	"--pipeline",			action="store_true",																help="stream images through concurrent read, decode, watermark, encode and write stages in threads, with the number of threads per stage set by --jobs")
+	ap.add_argument("-mb",	"--memory-budget",		action="store", type=int,	default=default_vals["memory_budget"], metavar="MB",	help="set the memory held by decoded images in the pipeline, reading waits when it is reached (default is {} MB)".format(default_vals["memory_budget"]))
+	ap.add_argument("-s",	"--seed",				action="store", type=int,	default=None,											help="seed the random color and position choices to make runs reproducible")
 	ap.add_argument("-c",	"--color",				action="store",
 													type=str,
 													default="random",
@@ -0,0 +1,240 @@
+# Default libraries
+import io
+import os
+import queue
+import threading
+
+# External libraries
+from PIL import Image
+
+# Custom libraries
+from helpers.encoders import encode_image, output_format_from_setting
+from helpers.file_operations import attempt_load_image, attempt_orient_image, load_backend_for
+from helpers.image_manipulation import apply_variants, generate_variants, variant_output_path
+from helpers.journal import write_atomically
+from helpers.manifest import bytes_content_hash
+from helpers.others import is_large_image
+from helpers.timing import pop_timings, set_input_format, timed
+
+
+# Put in a queue after the last item of a stage
+END_OF_STREAM = object()
+
+# Items waiting between two stages, a full queue blocks the stage before it
+QUEUE_SIZE = 2
+
+
+# Bytes of decoded images held by the pipeline at once, reading waits until enough images are written
+# An image larger than the whole budget is let through alone instead of blocking forever
+class MemoryBudget:
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.used = 0
+		self.stopped = False
+		self.condition = threading.Condition()
+
+	def acquire(self, n_bytes):
+		with self.condition:
+			while not self.stopped and self.used > 0 and self.used + n_bytes > self.max_bytes:
+				self.condition.wait()
+
+			self.used += n_bytes
+
+	def release(self, n_bytes):
+		with self.condition:
+			self.used -= n_bytes
+			self.condition.notify_all()
+
+	# Wake up the reader when the pipeline fails
+	def stop(self):
+		with self.condition:
+			self.stopped = True
+			self.condition.notify_all()
+
+
+# Size of the decoded image from its header only, raw files can't be peeked at and get a pessimistic guess
+def estimate_decoded_bytes(data, max_size=None):
+	try:
+		with Image.open(io.BytesIO(data)) as image:
+			width, height = image.size
+			bands = len(image.getbands()) * getattr(image, "n_frames", 1)
+	except Exception:
+		return len(data) * 10
+
+	if max_size is not None and max(width, height) > max_size:
+		scale = max_size / max(width, height)
+		width, height = int(width * scale) + 1, int(height * scale) + 1
+
+	return len(data) + width * height * bands
+
+
+@timed("read")
+def read_file_bytes(path):
+	with open(path, "rb") as f:
+		return f.read()
+
+
+@timed("write")
+def write_file_bytes(path, data):
+	write_atomically(path, lambda path_tmp: path_tmp.write_bytes(data))
+
+
+# Run a function on every item of a queue in several threads, passing its results to the next queue
+# A function returning None has dealt with the item itself, the last thread to finish forwards the end of the stream
+def start_stage(function, in_queue, out_queue, n_threads, state):
+	remaining = [n_threads]
+	lock = threading.Lock()
+
+	def worker():
+		while True:
+			item = in_queue.get()
+
+			if item is END_OF_STREAM:
+				in_queue.put(END_OF_STREAM)
+				break
+
+			# Keep draining after a failure so that the stages before don't block on full queues
+			if state["failed"]:
+				continue
+
+			try:
+				set_input_format(item["path"].suffix[1:].lower())
+				item = function(item)
+			except BaseException as e:
+				state["failed"] = True
+				state["budget"].stop()
+				state["results"].put(e)
+				continue
+
+			if item is not None:
+				out_queue.put(item)
+
+		with lock:
+			remaining[0] -= 1
+			last = remaining[0] == 0
+
+		if last:
+			out_queue.put(END_OF_STREAM)
+
+	for _ in range(n_threads):
+		threading.Thread(target=worker, daemon=True).start()
+
+
+# Process all jobs through read, decode, orient, watermark, encode and write stages running concurrently
+# Yields the results in the same form as process_job, in the order in which images finish
+def run_pipeline(jobs, logos, settings, n_threads=1, memory_budget=1024 * 1024 ** 2):
+	if n_threads == 0:
+		n_threads = os.cpu_count() or 1
+
+	state = {
+		"failed":	False,
+		"budget":	MemoryBudget(memory_budget),
+		"results":	queue.Queue(),
+	}
+
+	def finish(item, status):
+		state["budget"].release(item["reserved"])
+		state["results"].put({
+			"path":			item["path"],
+			"status":		status,
+			"outputs":		item.get("outputs", []),
+			"content_hash":	item["content_hash"],
+			"timings":		[],
+		})
+
+	def read(item):
+		load_backend_for(item["path"])
+		item["data"] = read_file_bytes(item["path"])
+		item["content_hash"] = bytes_content_hash(item["data"]) if settings["incremental"] else None
+		item["reserved"] = estimate_decoded_bytes(item["data"], max_size=settings["max_size"])
+		state["budget"].acquire(item["reserved"])
+		return item
+
+	def decode(item):
+		image, source_info = attempt_load_image(item["path"],
+												path_invalid=settings["invalid_path"],
+												max_size=settings["max_size"],
+												fp=io.BytesIO(item.pop("data")))
+
+		if image is None:
+			finish(item, "ignored" if item["path"].exists() else "invalid")
+			return None
+
+		item["image"], item["source_info"] = image, source_info
+		return item
+
+	def orient(item):
+		item["image"] = attempt_orient_image(	item["image"],
+												item["source_info"],
+												attempt_rotate=settings["rotate"],
+												rotate_pixels=settings["orientation_mode"] == "transpose",
+												large_image_pixels=settings["large_image_pixels"])
+		return item
+
+	def watermark(item):
+		item["variants"] = generate_variants(	item["image"],
+												logos=logos,
+												position_list=item["position_list"],
+												color_mapping=item["color_mapping"],
+												settings=settings,
+												source_info=item["source_info"])
+		return item
+
+	# Encode in memory, the image and its variants can be dropped before the files are written
+	# Large images are encoded straight to their files instead, their encoded bytes are never held whole
+	def encode(item):
+		def emit(variant):
+			output_format = output_format_from_setting(settings["format"], variant["source_info"])
+			path_out = variant_output_path(item["path"], variant["suffix"], settings, variant["source_info"])
+
+			if is_large_image(variant["image"].size, settings["large_image_pixels"]):
+				encode_image(variant["image"], path_out, output_format=output_format, settings=settings, source_info=variant["source_info"])
+				return path_out, None
+
+			fp = io.BytesIO()
+			encode_image(variant["image"], fp, output_format=output_format, settings=settings, source_info=variant["source_info"])
+			return path_out, fp.getvalue()
+
+		del item["image"]
+		item["encoded"] = apply_variants(item.pop("variants"), emit=emit)
+		return item
+
+	def write(item):
+		for path_out, data in item["encoded"]:
+			if data is not None:
+				write_file_bytes(path_out, data)
+
+		item["outputs"] = [path_out for path_out, _ in item.pop("encoded")]
+		finish(item, "ok")
+		return None
+
+	stages = [(read, 1), (decode, n_threads), (orient, 1), (watermark, n_threads), (encode, n_threads), (write, 1)]
+	queues = [queue.Queue(maxsize=QUEUE_SIZE) for _ in range(len(stages))]
+	queues.append(state["results"])
+
+	for i, (function, stage_threads) in enumerate(stages):
+		start_stage(function, queues[i], queues[i + 1], stage_threads, state)
+
+	# Feed the jobs from a thread as well, the first queue is bounded too
+	def feed():
+		for image_path, position_list, color_mapping in jobs:
+			if state["failed"]:
+				break
+
+			queues[0].put({"path": image_path, "position_list": position_list, "color_mapping": color_mapping})
+
+		queues[0].put(END_OF_STREAM)
+
+	threading.Thread(target=feed, daemon=True).start()
+
+	while True:
+		result = state["results"].get()
+
+		if result is END_OF_STREAM:
+			break
+		elif isinstance(result, BaseException):
+			raise result
+
+		# Timings of every thread are gathered together, they are handed over with the results as they come
+		result["timings"] = pop_timings()
+		yield result
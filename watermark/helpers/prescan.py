@@ -0,0 +1,148 @@
+# Default libraries
+import fnmatch
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# External libraries
+from PIL import Image
+
+# Custom libraries
+from helpers.file_operations import extension_match, invalidate_path, load_pillow_heif, IGNORE_EXTS, IMG_EXTS, RAWPY_EXTS
+from helpers.image_manipulation import EXIF_ORIENTATION_TAG
+
+
+# Bytes read to recognize a file, enough for every signature below
+MAGIC_SIZE = 16
+
+# Brands of the ISO boxes of HEIF files
+HEIF_BRANDS = (b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"mif1", b"msf1")
+
+# Formats whose EXIF block is read with the header, the others may only give it once their pixels are decoded, like PNG
+EXIF_HEADER_FORMATS = ("JPEG", "WEBP", "TIFF", "HEIF")
+
+# Threads reading headers, prescanning is mostly waiting on the disk
+PRESCAN_THREADS = 8
+
+
+# Format of a file from its first bytes, or None if it isn't an image the tool can read
+def sniff_format(magic):
+	if magic.startswith(b"\xff\xd8\xff"):
+		return "JPEG"
+	elif magic.startswith(b"\x89PNG\r\n\x1a\n"):
+		return "PNG"
+	elif magic[:4] == b"RIFF" and magic[8:12] == b"WEBP":
+		return "WEBP"
+	elif magic[:6] in (b"GIF87a", b"GIF89a"):
+		return "GIF"
+	elif magic[4:8] == b"ftyp" and magic[8:12] in HEIF_BRANDS:
+		return "HEIF"
+	elif magic.startswith(b"\x00\x00\x01\x00"):
+		return "ICO"
+	elif magic[:4] in (b"II*\x00", b"MM\x00*"):
+		return "TIFF"
+
+	return None
+
+
+# Directory entries of the input folder in a single pass, without the excluded patterns
+def scan_dir(path, excluded_patterns=[]):
+	with os.scandir(path) as entries:
+		return [entry for entry in entries if entry.is_file() and not any(fnmatch.fnmatch(entry.name, pattern) for pattern in excluded_patterns)]
+
+
+# Orientation of an opened image from the EXIF data of its header, upright if it only comes later in the file
+def header_orientation(image, image_format):
+	if image_format in EXIF_HEADER_FORMATS:
+		return image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+
+	exif_data = image.info.get("exif")
+
+	if not exif_data:
+		return 1
+
+	exif = Image.Exif()
+	exif.load(exif_data)
+	return exif.get(EXIF_ORIENTATION_TAG, 1)
+
+
+# Read the signature and the header of a file, without decoding its pixels
+# Raw files are TIFF containers whose dimensions are only known to rawpy, they are left unknown
+def prescan_entry(entry):
+	path = Path(entry.path)
+
+	info = {
+		"path":			path,
+		"size":			entry.stat().st_size,
+		"status":		"ok",
+		"format":		None,
+		"dims":			None,
+		"orientation":	1,
+	}
+
+	if extension_match(path, IGNORE_EXTS):
+		info["status"] = "ignored"
+		return info
+
+	if not extension_match(path, IMG_EXTS):
+		info["status"] = "invalid"
+		return info
+
+	try:
+		with open(path, "rb") as f:
+			info["format"] = sniff_format(f.read(MAGIC_SIZE))
+
+		if info["format"] is None:
+			info["status"] = "invalid"
+		elif info["format"] == "TIFF" and extension_match(path, RAWPY_EXTS):
+			info["format"] = "RAW"
+		else:
+			if info["format"] == "HEIF":
+				load_pillow_heif()
+
+			with Image.open(path) as image:
+				info["dims"] = image.size
+				info["orientation"] = header_orientation(image, info["format"])
+	except Exception:
+		info["status"] = "invalid"
+
+	return info
+
+
+# Largest images first, so that the last jobs of a pool are short ones
+# The file size stands in for the number of pixels when the header doesn't give it
+def work_size(info):
+	if info["dims"] is None:
+		return info["size"]
+
+	return info["dims"][0] * info["dims"][1]
+
+
+# Read the headers of all inputs in threads, move the files that aren't images out and return the others, largest first
+def prescan_inputs(path_input, path_invalid, excluded_patterns=[], n_threads=PRESCAN_THREADS):
+	entries = scan_dir(path_input, excluded_patterns=excluded_patterns)
+
+	with ThreadPoolExecutor(max_workers=n_threads) as executor:
+		infos = list(executor.map(prescan_entry, entries))
+
+	for info in infos:
+		if info["status"] == "invalid":
+			invalidate_path(info["path"], path_invalid)
+
+	valid = [info for info in infos if info["status"] == "ok"]
+	valid.sort(key=lambda info: (-work_size(info), info["path"]))
+
+	return valid, [info for info in infos if info["status"] == "invalid"]
+
+
+def prescan_summary(valid, invalid):
+	formats = Counter(info["format"] for info in valid)
+	rotated = sum(1 for info in valid if info["orientation"] != 1)
+
+	return "Prescan: {} image(s) ({}), {} not upright, {} invalid".format(
+		len(valid),
+		", ".join("{} {}".format(count, name) for name, count in sorted(formats.items())),
+		rotated,
+		len(invalid),
+	)
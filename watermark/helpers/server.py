@@ -0,0 +1,70 @@
+# Default libraries
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Largest accepted upload, in bytes
+MAX_UPLOAD_SIZE = 256 * 1024 ** 2
+
+
+# POST an image to / to get it back watermarked, add ?filename=... for files that need their extension, like raw files
+# GET /health answers as soon as the logos are loaded
+def make_handler(watermarker):
+	class WatermarkHandler(BaseHTTPRequestHandler):
+		def send_body(self, status, body, content_type="text/plain; charset=utf-8"):
+			self.send_response(status)
+			self.send_header("Content-Type", content_type)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def do_GET(self):
+			if urlparse(self.path).path == "/health":
+				self.send_body(200, b"ok")
+			else:
+				self.send_body(404, b"not found")
+
+		def do_POST(self):
+			url = urlparse(self.path)
+
+			if url.path != "/":
+				self.send_body(404, b"not found")
+				return
+
+			length = int(self.headers.get("Content-Length") or 0)
+
+			if length <= 0 or length > MAX_UPLOAD_SIZE:
+				self.send_body(413 if length > 0 else 400, b"missing or too large image")
+				return
+
+			filename = parse_qs(url.query).get("filename", [None])[0]
+
+			try:
+				image, source_info = watermarker.load_bytes(self.rfile.read(length), filename=filename)
+				body = watermarker.watermark_encoded(image, source_info=source_info)
+			except ValueError as e:
+				self.send_body(400, str(e).encode())
+				return
+			except Exception:
+				# Answer rather than drop the connection, the traceback goes to the log of the sidecar
+				self.log_error("Failed to watermark the upload\n%s", traceback.format_exc())
+				self.send_body(500, b"internal error")
+				return
+
+			self.send_body(200, body, content_type=watermarker.mime_type(source_info))
+
+	return WatermarkHandler
+
+
+# Serve until interrupted, each request is handled in its own thread
+def serve(watermarker, host="127.0.0.1", port=8080):
+	server = ThreadingHTTPServer((host, port), make_handler(watermarker))
+	print("Serving on http://{}:{}, press Ctrl+C to stop".format(host, port))
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
@@ -0,0 +1,62 @@
+# Default libraries
+import threading
+from collections import OrderedDict
+
+
+# Bounded LRU cache of rendered watermark stamps, with hit and miss counters
+# Safe to share between threads, a stamp missing in two threads at once may be rendered twice
+class StampCache:
+	def __init__(self, max_size=32):
+		self.max_size = max_size
+		self.stamps = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	# Return the stamp stored under the key, rendering it with the given function if missing
+	def get(self, key, render):
+		with self.lock:
+			stamp = self.stamps.get(key)
+
+			if stamp is not None:
+				self.hits += 1
+				self.stamps.move_to_end(key)
+				return stamp
+
+			self.misses += 1
+
+		stamp = render()
+
+		with self.lock:
+			if self.max_size > 0:
+				self.stamps[key] = stamp
+
+				while len(self.stamps) > self.max_size:
+					self.stamps.popitem(last=False)
+
+		return stamp
+
+	def resize(self, max_size):
+		with self.lock:
+			self.max_size = max_size
+
+			while len(self.stamps) > max(max_size, 0):
+				self.stamps.popitem(last=False)
+
+	def clear(self):
+		with self.lock:
+			self.stamps.clear()
+			self.hits = 0
+			self.misses = 0
+
+	def info(self):
+		return {
+			"hits":		self.hits,
+			"misses":	self.misses,
+			"size":		len(self.stamps),
+			"max_size":	self.max_size,
+		}
+
+
+# Cache shared by all images processed in the current process
+STAMP_CACHE = StampCache()
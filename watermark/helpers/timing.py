@@ -0,0 +1,146 @@
+# Default libraries
+import functools
+import json
+import threading
+import time
+from collections import defaultdict
+
+
+# Timings recorded in the current process, as (stage, input format, seconds) tuples
+TIMINGS = {
+	"records":		[],
+}
+
+TIMINGS_LOCK = threading.Lock()
+
+# Format of the image being processed by each thread
+CURRENT_INPUT = threading.local()
+
+PERCENTILES = (50, 90, 99)
+
+
+# Set the format of the image being processed by the current thread
+def set_input_format(input_format):
+	CURRENT_INPUT.format = input_format
+
+
+def get_input_format():
+	return getattr(CURRENT_INPUT, "format", None)
+
+
+def record_timing(stage, seconds):
+	with TIMINGS_LOCK:
+		TIMINGS["records"].append((stage, get_input_format(), seconds))
+
+
+# Wrap a function so that it records its timings under the input format of the calling thread, wherever it runs
+def with_input_format(function):
+	input_format = get_input_format()
+
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		set_input_format(input_format)
+		return function(*args, **kwargs)
+
+	return wrapper
+
+
+# Return the timings recorded so far and forget them, so that worker processes can send them back with their results
+def pop_timings():
+	with TIMINGS_LOCK:
+		records = TIMINGS["records"]
+		TIMINGS["records"] = []
+
+	return records
+
+
+# Decorator recording the duration of each call of a function under a stage name
+def timed(stage):
+	def decorator(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			start = time.perf_counter()
+
+			try:
+				return function(*args, **kwargs)
+			finally:
+				record_timing(stage, time.perf_counter() - start)
+
+		return wrapper
+
+	return decorator
+
+
+# Nearest-rank percentile of sorted values
+def percentile(sorted_values, percent):
+	rank = max(0, -(-percent * len(sorted_values) // 100) - 1)
+	return sorted_values[rank]
+
+
+def summarize_durations(durations):
+	durations = sorted(durations)
+
+	summary = {
+		"count":	len(durations),
+		"total":	sum(durations),
+		"mean":		sum(durations) / len(durations),
+		"max":		durations[-1],
+	}
+
+	for percent in PERCENTILES:
+		summary["p" + str(percent)] = percentile(durations, percent)
+
+	return summary
+
+
+# Group durations per stage and per input format
+def summarize_timings(records):
+	per_stage = defaultdict(list)
+	per_format = defaultdict(lambda: defaultdict(list))
+
+	for stage, input_format, seconds in records:
+		per_stage[stage].append(seconds)
+		per_format[input_format or "unknown"][stage].append(seconds)
+
+	return {
+		"stages":	{stage: summarize_durations(durations) for stage, durations in per_stage.items()},
+		"formats":	{
+			input_format: {stage: summarize_durations(durations) for stage, durations in stages.items()}
+			for input_format, stages in per_format.items()
+		},
+	}
+
+
+def format_duration(seconds):
+	minutes, seconds = divmod(int(seconds), 60)
+	hours, minutes = divmod(minutes, 60)
+	return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+
+# Progress line with the current throughput and the estimated remaining time
+def progress_line(processed_count, total_count, invalid_count, start_time):
+	elapsed = time.perf_counter() - start_time
+	rate = processed_count / elapsed if elapsed > 0 else 0
+	eta = (total_count - processed_count) / rate if rate > 0 else 0
+
+	return "Processing image {} of {} | Invalid: {} | {:.2f} images/s | ETA {}".format(
+		processed_count,
+		total_count,
+		invalid_count,
+		rate,
+		format_duration(eta),
+	)
+
+
+def write_report(report_path, records, image_count, wall_time, extra=None):
+	report = {
+		"images":				image_count,
+		"wall_time":			wall_time,
+		"images_per_second":	image_count / wall_time if wall_time > 0 else 0,
+	}
+
+	report.update(summarize_timings(records))
+	report.update(extra or dict())
+
+	with open(report_path, "w") as f:
+		json.dump(report, f, indent="\t")
@@ -0,0 +1,203 @@
+# Default libraries
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Custom libraries
+from helpers.batch import init_worker, process_job, process_job_in_worker
+from helpers.file_operations import glob_all_except
+from helpers.manifest import plan_incremental_run, record_entry, save_manifest
+from helpers.others import position_list_from_setting, color_mapping_from_setting
+from helpers.timing import pop_timings
+
+# Seconds during which the size and modification time of a new file must not change before it is processed
+WATCH_SETTLE_TIME = 2.0
+
+# Seconds between two checks of the pending files, and between two scans of the folder when polling
+WATCH_INTERVAL = 0.5
+
+
+# New files reported by the file system watcher or found by a scan, with the time they were first seen
+class PendingFiles:
+	def __init__(self):
+		self.first_seen = dict()
+		self.lock = threading.Lock()
+
+	def add(self, path):
+		with self.lock:
+			self.first_seen.setdefault(path, time.perf_counter())
+
+	def pop(self, path):
+		with self.lock:
+			return self.first_seen.pop(path, None)
+
+	def paths(self):
+		with self.lock:
+			return list(self.first_seen)
+
+
+# Forward the creations, modifications and moves into the folder reported by inotify (or its equivalent)
+# Handlers of watchdog only need a dispatch method, so that watchdog is only imported by watch runs
+class PendingFilesHandler:
+	def __init__(self, pending):
+		self.pending = pending
+
+	def dispatch(self, event):
+		if event.is_directory or event.event_type not in ("created", "modified", "moved", "closed"):
+			return
+
+		path = getattr(event, "dest_path", None) or event.src_path
+		self.pending.add(Path(path))
+
+
+# The folder is polled instead when watchdog is missing
+def start_observer(path_input, pending):
+	try:
+		from watchdog.observers import Observer
+	except ImportError:
+		return None
+
+	observer = Observer()
+	observer.schedule(PendingFilesHandler(pending), str(path_input), recursive=False)
+	observer.start()
+	return observer
+
+
+def file_signature(path):
+	try:
+		stat = path.stat()
+	except FileNotFoundError:
+		return None
+
+	return stat.st_size, stat.st_mtime_ns
+
+
+def list_input(path_input):
+	return glob_all_except(path_input, excluded_patterns=["*.gitkeep"])
+
+
+# Keep the logos, stamp cache and worker processes loaded, and watermark each new file of the input folder once it is fully written
+def watch_folder(path_input, path_output, logos, logo_path, logo_filenames, settings, n_jobs=1, seed=None):
+	if n_jobs == 0:
+		n_jobs = os.cpu_count() or 1
+
+	rng = random.Random(seed)
+	pending = PendingFiles()
+
+	# Signature of the version of each file that was processed, so that a file is only processed again if it is replaced
+	processed = dict()
+
+	# Files already in the folder are handled first, unchanged ones are skipped in incremental runs
+	image_paths = list_input(path_input)
+	manifest = None
+
+	if settings["incremental"]:
+		manifest, paths_todo = plan_incremental_run(image_paths, path_output, settings)
+		save_manifest(path_output, manifest)
+		paths_todo = set(paths_todo)
+
+		for image_path in image_paths:
+			if image_path not in paths_todo:
+				processed[image_path] = file_signature(image_path)
+
+	for image_path in image_paths:
+		if image_path not in processed:
+			pending.add(image_path)
+
+	observer = start_observer(path_input, pending)
+	executor = None
+
+	if n_jobs > 1:
+		executor = ProcessPoolExecutor(	max_workers=n_jobs,
+										initializer=init_worker,
+										initargs=(logo_path, logo_filenames, settings))
+
+	print("Watching '{}' with {}, press Ctrl+C to stop".format(path_input, "file system events" if observer else "polling"))
+
+	# Signature and time at which each pending file was last seen changing
+	last_change = dict()
+	running = []
+	counts = {"ok": 0, "invalid": 0}
+
+	def report(result, first_seen, start):
+		now = time.perf_counter()
+		pop_timings()
+
+		if result["status"] == "invalid":
+			counts["invalid"] += 1
+			print("Invalid: {} (moved to 'invalid')".format(result["path"].name))
+			return
+
+		if result["status"] != "ok":
+			return
+
+		counts["ok"] += 1
+
+		if manifest is not None:
+			record_entry(manifest, result["path"], result["content_hash"], result["outputs"])
+			save_manifest(path_output, manifest)
+
+		print("Watermarked {} in {:.2f}s, {:.2f}s after it appeared".format(result["path"].name, now - start, now - first_seen))
+
+	try:
+		while True:
+			if observer is None:
+				for image_path in list_input(path_input):
+					if processed.get(image_path) != file_signature(image_path):
+						pending.add(image_path)
+
+			now = time.perf_counter()
+
+			for image_path in pending.paths():
+				signature = file_signature(image_path)
+
+				# Moved away or deleted before being processed, or an event about a version already processed
+				if signature is None or processed.get(image_path) == signature:
+					pending.pop(image_path)
+					last_change.pop(image_path, None)
+					continue
+
+				if last_change.get(image_path, (None,))[0] != signature:
+					last_change[image_path] = (signature, now)
+					continue
+
+				if now - last_change[image_path][1] < WATCH_SETTLE_TIME:
+					continue
+
+				first_seen = pending.pop(image_path)
+				last_change.pop(image_path)
+				processed[image_path] = signature
+
+				job = (	image_path,
+						position_list_from_setting(settings["position_setting"], rng=rng),
+						color_mapping_from_setting(settings["color_setting"], rng=rng))
+
+				if executor is None:
+					start = time.perf_counter()
+					report(process_job(job, logos=logos, settings=settings), first_seen, start)
+				else:
+					running.append((executor.submit(process_job_in_worker, job), first_seen, time.perf_counter()))
+
+			for item in [item for item in running if item[0].done()]:
+				running.remove(item)
+				future, first_seen, start = item
+				report(future.result(), first_seen, start)
+
+			time.sleep(WATCH_INTERVAL)
+	except KeyboardInterrupt:
+		print("Stopping, waiting for the images being processed")
+	finally:
+		if observer is not None:
+			observer.stop()
+			observer.join()
+
+		for future, first_seen, start in running:
+			report(future.result(), first_seen, start)
+
+		if executor is not None:
+			executor.shutdown()
+
+	return counts
@@ -0,0 +1,171 @@
+# Default libraries
+import io
+import random
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# External libraries
+from PIL import Image
+
+# Custom libraries
+from helpers.encoders import encode_image, output_format_from_setting, register_avif_plugin, OUTPUT_FORMAT_OPTIONS, OUTPUT_FORMATS
+from helpers.file_operations import attempt_orient_image, backend_errors, finish_loading_image, get_source_info, load_logos, load_pillow_heif, universal_load_image
+from helpers.image_manipulation import apply_variants, generate_variants
+from helpers.others import (
+	color_mapping_from_setting,
+	position_list_from_setting,
+	settings_from_args,
+	setup_argparser,
+	COLOR_OPTIONS,
+	DEFAULT_VALUES,
+	LOGO_FILENAMES,
+	POSITION_OPTIONS
+)
+from helpers.stamp_cache import StampCache
+from helpers.timing import pop_timings
+
+
+DEFAULT_LOGO_PATH = Path(__file__).resolve().parent.parent / "logos"
+
+
+# Watermark images in memory, with the logos and settings loaded once
+# Options take the names of the command line arguments, e.g. Watermarker(color="white", output_format="jpeg")
+class Watermarker:
+	def __init__(self, logo_path=DEFAULT_LOGO_PATH, seed=None, **options):
+		ap = setup_argparser(default_vals=DEFAULT_VALUES, color_options=COLOR_OPTIONS, pos_choices=POSITION_OPTIONS, format_choices=OUTPUT_FORMAT_OPTIONS)
+		args = vars(ap.parse_args([]))
+
+		unknown = set(options) - set(args)
+
+		if unknown:
+			raise TypeError("Unknown watermarking option(s): " + ", ".join(sorted(unknown)))
+
+		args.update(options)
+		self.settings = settings_from_args(args, path_output=None, path_invalid=None)
+
+		if self.settings["format"] == "avif" and not register_avif_plugin():
+			raise ValueError("AVIF output needs the pillow-avif-plugin package or a pillow-heif build with AVIF support.")
+
+		self.logos = load_logos(Path(logo_path), LOGO_FILENAMES)
+
+		# Stamps are rendered from the logos of this instance, so they can't come from the cache of the command line or of another instance
+		self.stamp_cache = StampCache(self.settings["stamp_cache_size"])
+		self.rng = random.Random(seed)
+
+	# Decode image bytes, the file name is only needed for formats Pillow can't recognize by themselves, like raw files
+	def load_bytes(self, data, filename=None):
+		fp = io.BytesIO(data)
+
+		try:
+			if filename is None:
+				# HEIF files start with an ISO box of type "ftyp", pillow-heif is only imported for them
+				if data[4:8] == b"ftyp":
+					load_pillow_heif()
+
+				image = Image.open(fp)
+				image.load()
+				is_hei = image.format == "HEIF"
+			else:
+				image, flag, is_hei = universal_load_image(Path(filename), max_size=self.settings["max_size"], fp=fp)
+
+				if image is None:
+					raise ValueError("Unsupported image type: " + str(filename))
+			return finish_loading_image(image, Path(filename or ""), is_hei=is_hei, max_size=self.settings["max_size"])
+		except backend_errors() as e:
+			raise ValueError("The image could not be decoded") from e
+
+	# Return the watermarked variants of an image as (suffix, image) pairs, the given image is left untouched
+	# The emit function can turn each variant into something else while its frames are patched, like encoded bytes
+	# Random positions and colors can be drawn upfront with draw_choices, to keep seeded runs reproducible across threads
+	def watermark_variants(self, image, source_info=None, emit=None, choices=None):
+		if choices is None:
+			choices = self.draw_choices()
+
+		if source_info is None:
+			source_info = get_source_info(image, Path(""))
+
+		image = attempt_orient_image(	image,
+										source_info,
+										attempt_rotate=self.settings["rotate"],
+										rotate_pixels=self.settings["orientation_mode"] == "transpose",
+										large_image_pixels=self.settings["large_image_pixels"])
+
+		variants = generate_variants(	image,
+										logos=self.logos,
+										position_list=choices[0],
+										color_mapping=choices[1],
+										settings=self.settings,
+										source_info=source_info,
+										stamp_cache=self.stamp_cache)
+
+		if emit is None:
+			emit = lambda variant: (variant["suffix"], variant["image"].copy())
+
+		watermarked = apply_variants(variants, emit=emit)
+
+		# Nothing collects the timings of library calls
+		pop_timings()
+		return watermarked
+
+	# Positions and colors of the next image
+	def draw_choices(self):
+		return (position_list_from_setting(self.settings["position_setting"], rng=self.rng),
+				color_mapping_from_setting(self.settings["color_setting"], rng=self.rng))
+
+	def single_variant(self, variants):
+		if len(variants) > 1:
+			raise ValueError("The color and position settings give several variants, use watermark_variants instead")
+
+		return variants[0]
+
+	# Only the first frame of an animation is returned, watermark_bytes keeps them all
+	def watermark_pil(self, image, source_info=None):
+		return self.single_variant(self.watermark_variants(image, source_info=source_info))[1]
+
+	# Output format of an encoded image, "match" depends on the input
+	def output_format(self, source_info=None):
+		return output_format_from_setting(self.settings["format"], source_info)
+
+	def mime_type(self, source_info=None):
+		return Image.MIME.get(OUTPUT_FORMATS[self.output_format(source_info)][0], "application/octet-stream")
+
+	def encode(self, image, source_info=None):
+		fp = io.BytesIO()
+		encode_image(image, fp, output_format=self.output_format(source_info), settings=self.settings, source_info=source_info)
+		return fp.getvalue()
+
+	# Watermark a loaded image and encode it in the output format of the settings
+	def watermark_encoded(self, image, source_info=None):
+		emit = lambda variant: self.encode(variant["image"], source_info=variant["source_info"])
+		return self.single_variant(self.watermark_variants(image, source_info=source_info, emit=emit))
+
+	# Watermark encoded image bytes into encoded image bytes
+	def watermark_bytes(self, data, filename=None):
+		image, source_info = self.load_bytes(data, filename=filename)
+		return self.watermark_encoded(image, source_info=source_info)
+
+	def watermark_any(self, item):
+		if isinstance(item, Image.Image):
+			return self.watermark_pil(item)
+
+		return self.watermark_bytes(item)
+
+	# Watermark bytes or images as they come and yield the results in the same order
+	# With several threads, at most n_threads items are read ahead of the results
+	def map(self, items, n_threads=1):
+		if n_threads == 1:
+			for item in items:
+				yield self.watermark_any(item)
+			return
+
+		with ThreadPoolExecutor(max_workers=n_threads) as executor:
+			pending = []
+
+			for item in items:
+				pending.append(executor.submit(self.watermark_any, item))
+
+				if len(pending) >= n_threads:
+					yield pending.pop(0).result()
+
+			while pending:
+				yield pending.pop(0).result()
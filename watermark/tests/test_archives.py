@@ -0,0 +1,88 @@
+# Tests of the watermarking of archives, written to a temporary folder
+# Run them from the watermark folder: python -m unittest discover -s tests
+
+# Default libraries
+import io
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+# External libraries
+from PIL import Image
+
+# Make the helpers importable when running from anywhere
+WATERMARK_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(WATERMARK_PATH))
+
+# Custom libraries
+from helpers.archives import run_archive
+from helpers.watermarker import Watermarker
+
+
+# Bytes that no decoder accepts, long enough to look like a file
+JUNK = bytes(range(256)) * 64
+
+
+def encoded_jpeg(size=(320, 240)):
+	fp = io.BytesIO()
+	Image.new("RGB", size, (100, 120, 140)).save(fp, "JPEG")
+	return fp.getvalue()
+
+
+class TestArchives(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.watermarker = Watermarker(color="white", position="br", output_format="png")
+
+	def setUp(self):
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.path = Path(self.temp_dir.name)
+		self.path_invalid = self.path / "invalid"
+		self.path_invalid.mkdir()
+
+	def tearDown(self):
+		self.temp_dir.cleanup()
+
+	def write_zip(self, members):
+		path_input = self.path / "input.zip"
+
+		with zipfile.ZipFile(path_input, "w") as archive:
+			for name, data in members.items():
+				archive.writestr(name, data)
+
+		return path_input
+
+	def run_zip(self, members, **kwargs):
+		path_output = self.path / "output.zip"
+		counts = run_archive(self.write_zip(members), path_output=path_output, path_invalid=self.path_invalid, watermarker=self.watermarker, **kwargs)
+
+		with zipfile.ZipFile(path_output) as archive:
+			return counts, sorted(archive.namelist())
+
+	# A corrupt raw file fails in rawpy, it is moved aside like a corrupt file of an input folder
+	def test_corrupt_raw_member_is_invalid(self):
+		counts, names = self.run_zip({"photos/a.jpg": encoded_jpeg(), "photos/b.nef": JUNK, "photos/c.jpg": encoded_jpeg()}, n_threads=2)
+
+		self.assertEqual(counts, {"ok": 2, "invalid": 1})
+		self.assertEqual(names, ["photos/wm_a.png", "photos/wm_c.png"])
+		self.assertEqual((self.path_invalid / "b.nef").read_bytes(), JUNK)
+
+	def test_member_over_the_pixel_limit_is_invalid(self):
+		with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 20000):
+			counts, names = self.run_zip({"small.jpg": encoded_jpeg((100, 100)), "large.jpg": encoded_jpeg((400, 400))})
+
+		self.assertEqual(counts, {"ok": 1, "invalid": 1})
+		self.assertEqual(names, ["wm_small.png"])
+
+	def test_members_leaving_the_output_are_invalid(self):
+		counts, names = self.run_zip({"../../up.jpg": encoded_jpeg(), "/abs.jpg": encoded_jpeg(), "in/ok.jpg": encoded_jpeg()})
+
+		self.assertEqual(counts, {"ok": 1, "invalid": 2})
+		self.assertEqual(names, ["in/wm_ok.png"])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,79 @@
+# Tests of the prescan of an input folder, written to a temporary folder
+# Run them from the watermark folder: python -m unittest discover -s tests
+
+# Default libraries
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# External libraries
+from PIL import Image
+
+# Make the helpers importable when running from anywhere
+WATERMARK_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(WATERMARK_PATH))
+
+# Custom libraries
+from helpers.file_operations import attempt_open_image
+from helpers.image_manipulation import EXIF_ORIENTATION_TAG
+from helpers.prescan import prescan_inputs, work_size
+
+
+class TestPrescan(unittest.TestCase):
+	def setUp(self):
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.path = Path(self.temp_dir.name)
+		self.path_input = self.path / "input"
+		self.path_invalid = self.path / "invalid"
+		self.path_input.mkdir()
+		self.path_invalid.mkdir()
+
+	def tearDown(self):
+		self.temp_dir.cleanup()
+
+	# Scans often come as TIFF files, Pillow decodes them like the other formats
+	def test_tiff_scans_are_valid(self):
+		exif = Image.Exif()
+		exif[EXIF_ORIENTATION_TAG] = 6
+		Image.new("RGB", (300, 200), (100, 120, 140)).save(self.path_input / "scan.tif", exif=exif)
+		Image.new("L", (200, 100), 80).save(self.path_input / "page.TIFF")
+
+		valid, invalid = prescan_inputs(self.path_input, self.path_invalid)
+
+		# Recent Pillow versions give the size of TIFF files already turned upright, only the number of pixels is used
+		self.assertEqual(invalid, [])
+		self.assertEqual([(info["path"].name, info["format"], work_size(info), info["orientation"]) for info in valid], [
+			("scan.tif", "TIFF", 300 * 200, 6),
+			("page.TIFF", "TIFF", 200 * 100, 1),
+		])
+		self.assertEqual(list(self.path_invalid.iterdir()), [])
+
+		image, source_info = attempt_open_image(self.path_input / "scan.tif", self.path_invalid, attempt_rotate=True)
+		self.assertEqual((image.size, source_info["format"]), ((200, 300), "TIFF"))
+		self.assertEqual(source_info["exif"].get(EXIF_ORIENTATION_TAG, 1), 1)
+		image.close()
+
+	# The pages of a multi-page TIFF are not frames of an animation
+	def test_only_the_first_page_is_kept(self):
+		pages = [Image.new("RGB", (120, 80), color) for color in ("red", "green", "blue")]
+		pages[0].save(self.path_input / "pages.tiff", save_all=True, append_images=pages[1:])
+
+		image, source_info = attempt_open_image(self.path_input / "pages.tiff", self.path_invalid, attempt_rotate=True)
+
+		self.assertIsNone(source_info["animation"])
+		self.assertEqual(image.getpixel((0, 0)), (255, 0, 0))
+		image.close()
+
+	def test_other_files_are_invalid(self):
+		(self.path_input / "notes.txt").write_text("not an image")
+		(self.path_input / "fake.tif").write_bytes(b"not a tiff either")
+
+		valid, invalid = prescan_inputs(self.path_input, self.path_invalid)
+
+		self.assertEqual(valid, [])
+		self.assertEqual(sorted(path.name for path in self.path_invalid.iterdir()), ["fake.tif", "notes.txt"])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,90 @@
+# Tests of the HTTP sidecar, on a free port of localhost
+# Run them from the watermark folder: python -m unittest discover -s tests
+
+# Default libraries
+import contextlib
+import io
+import sys
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+# External libraries
+from PIL import Image
+
+# Make the helpers importable when running from anywhere
+WATERMARK_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(WATERMARK_PATH))
+
+# Custom libraries
+from helpers.server import make_handler
+from helpers.watermarker import Watermarker
+
+
+# Bytes that no decoder accepts, long enough to look like a file
+JUNK = bytes(range(256)) * 64
+
+
+# Watermarker failing in a way the handler doesn't expect
+class BrokenWatermarker:
+	def load_bytes(self, data, filename=None):
+		raise RuntimeError("broken")
+
+
+@contextlib.contextmanager
+def running_server(watermarker):
+	server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(watermarker))
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+
+	try:
+		yield "http://127.0.0.1:{}".format(server.server_address[1])
+	finally:
+		server.shutdown()
+		server.server_close()
+
+
+# Status and body of a POST, errors included
+def post(url, data):
+	try:
+		with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=30) as response:
+			return response.status, response.read()
+	except urllib.error.HTTPError as e:
+		return e.code, e.read()
+
+
+class TestServer(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.watermarker = Watermarker(color="white", position="br", output_format="png")
+
+	def test_image_is_watermarked(self):
+		fp = io.BytesIO()
+		Image.new("RGB", (320, 240), (100, 120, 140)).save(fp, "JPEG")
+
+		with running_server(self.watermarker) as url:
+			status, body = post(url + "/", fp.getvalue())
+
+		self.assertEqual(status, 200)
+		self.assertEqual(Image.open(io.BytesIO(body)).size, (320, 240))
+
+	# Raw files are decoded by rawpy, whose errors aren't those of Pillow
+	def test_corrupt_uploads_are_refused(self):
+		with running_server(self.watermarker) as url:
+			for filename in ("x.jpg", "x.nef"):
+				with self.subTest(filename=filename):
+					status, _ = post(url + "/?filename=" + filename, JUNK)
+					self.assertEqual(status, 400)
+
+	def test_unexpected_errors_are_answered(self):
+		with running_server(BrokenWatermarker()) as url, contextlib.redirect_stderr(io.StringIO()):
+			status, body = post(url + "/", JUNK)
+
+		self.assertEqual((status, body), (500, b"internal error"))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,67 @@
+# Tests of the in-memory watermarking API
+# Run them from the watermark folder: python -m unittest discover -s tests
+
+# Default libraries
+import io
+import sys
+import unittest
+from pathlib import Path
+
+# External libraries
+from PIL import Image
+
+# Make the helpers importable when running from anywhere
+WATERMARK_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(WATERMARK_PATH))
+
+# Custom libraries
+from helpers.image_manipulation import EXIF_ORIENTATION_TAG
+from helpers.watermarker import Watermarker
+
+
+# Encoded image of a flat color, with an EXIF orientation if given
+def encoded_image(size=(640, 480), image_format="JPEG", orientation=None):
+	exif = Image.Exif()
+
+	if orientation is not None:
+		exif[EXIF_ORIENTATION_TAG] = orientation
+
+	fp = io.BytesIO()
+	Image.new("RGB", size, (100, 120, 140)).save(fp, image_format, exif=exif.tobytes())
+	return fp.getvalue()
+
+
+def decoded_image(data):
+	image = Image.open(io.BytesIO(data))
+	image.load()
+	return image
+
+
+class TestWatermarker(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.watermarker = Watermarker(color="white", position="br", output_format="png")
+
+	# Orienting the pixels must not reset the orientation of the given image, or the next call would see it upright
+	def test_watermark_pil_leaves_the_image_untouched(self):
+		image = decoded_image(encoded_image(orientation=6))
+
+		first = self.watermarker.watermark_pil(image)
+		second = self.watermarker.watermark_pil(image)
+
+		self.assertEqual(first.size, (480, 640))
+		self.assertEqual(second.size, (480, 640))
+		self.assertEqual(first.tobytes(), second.tobytes())
+		self.assertEqual(image.size, (640, 480))
+		self.assertEqual(image.getexif().get(EXIF_ORIENTATION_TAG), 6)
+
+	# The outputs are upright, so their EXIF data must not turn them again
+	def test_oriented_outputs_are_tagged_upright(self):
+		output = decoded_image(self.watermarker.watermark_bytes(encoded_image(orientation=6)))
+
+		self.assertEqual(output.size, (480, 640))
+		self.assertEqual(output.getexif().get(EXIF_ORIENTATION_TAG, 1), 1)
+
+
+if __name__ == "__main__":
+	unittest.main()
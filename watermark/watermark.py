@@ -1,26 +1,36 @@
 # Default libraries
+import itertools
 import sys
+import time
 from pathlib import Path
 
-# External libraries
-from PIL import Image
-from pillow_heif import register_heif_opener
-
 # Custom libraries
-from helpers.image_manipulation import watermark_image
+from helpers.archives import is_archive, run_archive
+from helpers.batch import plan_jobs, run_jobs
+from helpers.dedup import dedup_summary, link_duplicates, plan_dedup, resume_dedup
+from helpers.encoders import init_encode_pool, register_avif_plugin, OUTPUT_EXTS, OUTPUT_FORMAT_OPTIONS
 from helpers.file_operations import (
     create_dir_if_missing,
-    glob_all_except,
     flush_output,
-    attempt_open_image,
+    load_logos,
+    set_pixel_limit,
     IMG_EXTS
 )
 
+from helpers.journal import load_journal, resume_jobs, Journal, JOURNAL_FILENAME
+from helpers.manifest import plan_incremental_run, record_entry, save_manifest, settings_hash, MANIFEST_FILENAME
+from helpers.pipeline import run_pipeline
+from helpers.prescan import prescan_inputs, prescan_summary
+from helpers.stamp_cache import STAMP_CACHE
+from helpers.timing import pop_timings, progress_line, write_report
+from helpers.watch import watch_folder
+from helpers.watermarker import Watermarker
 from helpers.others import ( # Needs to become a * import
 	setup_argparser,
-	position_list_from_setting,
-	color_mapping_from_setting,
+	settings_from_args,
 	COLOR_OPTIONS,
+	DEFAULT_VALUES,
+	LOGO_FILENAMES,
 	POSITION_OPTIONS
 )
 
@@ -34,100 +44,211 @@ if __name__ == "__main__":
 	root_path = Path()
 	logo_path = root_path / "logos"
 
-	# Define default values
-	default_values = {
-		"ss_factor": 	2,
-		"wm_size": 		0.07,
-		"wm_ratio": 	1.6,
-		"wm_pad": 		0.15,
-		"wm_prefix":	"wm_",
-		"input_dir": 	"input",
-		"output_dir": 	"output",
-		"format": 		"png",
-	}
-
 	# Other parameters
 	str_process = "Processing image {} of {} \t({} of {} variations, \tinvalid: {})"
 	str_end = "Processed {} images successfully!"
 	str_invalid = " ({} image(s) failed and moved to 'invalid')"
 
-	# Names of logo files
-	fn_color = "logo_color.png"
-	fn_white = "logo_white.png"
-
 	# Open logo files
-	logos = {
-		"color": Image.open(logo_path / fn_color),
-		"white": Image.open(logo_path / fn_white),
-	}
+	logo_filenames = LOGO_FILENAMES
+	logos = load_logos(logo_path, logo_filenames)
 
 	# Setup argparser and parse arguments
-	ap = setup_argparser(default_vals=default_values, color_options=COLOR_OPTIONS, pos_choices=POSITION_OPTIONS)
+	ap = setup_argparser(default_vals=DEFAULT_VALUES, color_options=COLOR_OPTIONS, pos_choices=POSITION_OPTIONS, format_choices=OUTPUT_FORMAT_OPTIONS)
 	args = vars(ap.parse_args())
 
-	prefix = 			"" if args["no_prefix"] else default_values["wm_prefix"]
 	path_input =		root_path / args["input_dir"]
 	path_output =		root_path / args["output_dir"]
 	path_invalid =		root_path / "invalid"
 	position_setting = 	args["position"]
 	
-	settings = {
-		"image_watermark_ratio": 	args["watermark_size"],
-		"logo_padding_ratio": 		args["watermark_padding"],
-		"logo_circle_ratio": 		args["watermark_ratio"],
-		"circle_offset_ratio_x": 	.5 if args["center_circle"] else 3 / 5,
-		"circle_offset_ratio_y": 	.5 if args["center_circle"] else 1,
-		"ss_factor": 				args["supersampling"],
-		"draw_circle":				not args["no_circle"],
-		"output_path":				path_output,
-		"color_setting":			args["color"],
-		"prefix":					prefix, # TODO : Offer option to customise the prefix
-		"format":					default_values["format"] # TODO : Offer option to change output format
-	}
+	settings = settings_from_args(args, path_output=path_output, path_invalid=path_invalid)
+
+	if settings["format"] == "avif" and not register_avif_plugin():
+		sys.exit("AVIF output needs the pillow-avif-plugin package or a pillow-heif build with AVIF support.")
+
+	# Run as a sidecar of another service instead of processing the input folder
+	if args["serve"] is not None:
+		from helpers.server import serve # The HTTP modules take longer to import than the rest of the tool
+
+		serve(Watermarker(logo_path=logo_path, **args), port=args["serve"])
+		sys.exit()
+
+	# Uploads keep Pillow's limit against decompression bombs, local inputs may be larger in the large-image mode
+	set_pixel_limit(settings["large_image_pixels"])
+
+	# Read from or write to zip and tar archives directly, without extracting them
+	if is_archive(path_input) or is_archive(path_output):
+		if not path_input.exists():
+			sys.exit("Input archive not found. Make sure you arguments are correct.")
+
+		create_dir_if_missing(path_invalid)
+
+		if not is_archive(path_output):
+			create_dir_if_missing(path_output)
+
+		counts = run_archive(path_input, path_output=path_output, path_invalid=path_invalid, watermarker=Watermarker(logo_path=logo_path, **args), n_threads=args["jobs"])
+
+		print(str_end.format(counts["ok"]) + (str_invalid.format(counts["invalid"]) if counts["invalid"] else ""))
+		sys.exit()
 
 	# Create missing folders if needed
 	create_dir_if_missing(path_output)
 	create_dir_if_missing(path_invalid)
 
-	# Process filenames
+	# Process filenames, files that aren't images are moved out from their headers alone
 	if path_input.is_dir():
-		image_paths = glob_all_except(path_input, excluded_patterns=["*.gitkeep"])
+		image_infos, invalid_infos = prescan_inputs(path_input, path_invalid, excluded_patterns=["*.gitkeep"])
+		image_paths = sorted(info["path"] for info in image_infos)
+		print(prescan_summary(image_infos, invalid_infos))
 	else:
-		create_dir_if_missing(default_values["input"])
-		sys.exit("Input folder not found. Make sure you arguments are correct or use the default '" + default_values["input_dir"] + "' folder.")
+		create_dir_if_missing(path_input)
+		sys.exit("Input folder not found. Make sure you arguments are correct or use the default '" + DEFAULT_VALUES["input_dir"] + "' folder.")
 
-	# Flush all images in the output directory if asked to
+	# Flush all images in the output directory if asked to, the manifest no longer describes them
 	if args["flush"]:
-		flush_output(path_output, EXTS)
+		flush_output(path_output, IMG_EXTS + OUTPUT_EXTS)
+		(path_output / MANIFEST_FILENAME).unlink(missing_ok=True)
+		(path_output / JOURNAL_FILENAME).unlink(missing_ok=True)
 	
 	# Apply to all images
-	invalid_count = 0
-
-	# TODO : Condition this
-	# Enable the HEIF/HEIC Pillow plugin
-	register_heif_opener()
-
-	# Loop through images
-	for processed_count, image_path in enumerate(image_paths):
-		image = attempt_open_image(	image_path=image_path,
-							 		path_invalid=path_invalid,
-									attempt_rotate=not args["no_rotate"])
-		
-		if image is None:
-			continue
-		
-		# Randomize position if asked
-		position_list = position_list_from_setting(position_setting)
-		color_mapping = color_mapping_from_setting(settings["color_setting"])
-
-		print("Processing image", processed_count + 1, "of", len(image_paths), "| Invalid:", invalid_count, end="\r")
-
-		# Watermark picture
-		watermark_image(image,
-				  		path=image_path,
-						logos=logos,
-						position_list=position_list,
-						settings=settings)
+	invalid_count = len(invalid_infos)
+
+	STAMP_CACHE.resize(settings["stamp_cache_size"])
+	init_encode_pool(settings["encode_threads"])
+
+	# Keep the logos, caches and workers loaded and watermark new files as they arrive, until interrupted
+	if args["watch"]:
+		counts = watch_folder(	path_input,
+								path_output=path_output,
+								logos=logos,
+								logo_path=logo_path,
+								logo_filenames=logo_filenames,
+								settings=settings,
+								n_jobs=args["jobs"],
+								seed=args["seed"])
+
+		print(str_end.format(counts["ok"]) + (str_invalid.format(counts["invalid"]) if counts["invalid"] else ""))
+		sys.exit()
+
+	# Pick up the jobs an interrupted run left, with the choices it had drawn for them
+	if args["resume"]:
+		journal_data = load_journal(path_output)
+
+		if journal_data is None:
+			sys.exit("No interrupted run to resume in the output folder.")
+
+		if journal_data["settings_hash"] != settings_hash(settings):
+			sys.exit("The interrupted run used other output settings, run it again with the same arguments to resume it.")
+
+		jobs = resume_jobs(journal_data, image_paths)
+		print("Resuming:", len(jobs), "image(s) left")
+	else:
+		# Draw the random choices of all images with a single seeded generator
+		jobs = plan_jobs(image_paths, position_setting, settings["color_setting"], seed=args["seed"])
+
+		# Then hand out the largest images first, so that workers don't wait on a large one at the end
+		work_order = {info["path"]: i for i, info in enumerate(image_infos)}
+		jobs.sort(key=lambda job: work_order[job[0]])
+
+	# Skip the inputs that are unchanged since the last run
+	if settings["incremental"]:
+		manifest, paths_todo = plan_incremental_run(image_paths, path_output, settings)
+		paths_todo = set(paths_todo)
+		jobs = [job for job in jobs if job[0] in paths_todo]
+		print("Skipping", len(image_paths) - len(jobs), "unchanged image(s)")
+
+	# Process each picture once, its duplicates get links to its outputs
+	image_count = len(jobs)
+	planned_jobs = jobs
+	duplicates = dict()
+	finished_results = []
+
+	# Duplicates are grouped as the interrupted run did, those of finished images are linked to their outputs
+	if args["resume"]:
+		jobs, duplicates, finished_results = resume_dedup(journal_data, jobs, image_paths, settings)
+	elif args["dedup"]:
+		jobs, duplicates = plan_dedup(jobs, mode=args["dedup"])
+		print(dedup_summary(duplicates, image_infos))
+
+	# Journal the run as images complete, so that it can be resumed if interrupted
+	journal = Journal(path_output)
+
+	if args["resume"]:
+		journal.reopen()
+	else:
+		journal.start(planned_jobs, settings, duplicates=duplicates)
+
+	# Loop through images, in a streaming pipeline or in worker processes if asked
+	if args["pipeline"]:
+		results = run_pipeline(	jobs,
+								logos=logos,
+								settings=settings,
+								n_threads=args["jobs"],
+								memory_budget=args["memory_budget"] * 1024 ** 2)
+	else:
+		results = run_jobs(	jobs,
+							logos=logos,
+							logo_path=logo_path,
+							logo_filenames=logo_filenames,
+							settings=settings,
+							n_jobs=args["jobs"])
+
+	start_time = time.perf_counter()
+	timing_records = []
+
+	processed_count = 0
+	link_count = 0
+	copy_count = 0
+
+	try:
+		for job_result in itertools.chain(finished_results, results):
+			# Images finished before an interruption only come back for their duplicates
+			own_results = [] if job_result.get("resumed") else [job_result]
+
+			for result in own_results + link_duplicates(job_result, duplicates, settings):
+				timing_records += result["timings"]
+
+				if result["status"] == "invalid":
+					invalid_count += 1
+				elif result["status"] == "ok" and settings["incremental"]:
+					record_entry(manifest, result["path"], result["content_hash"], result["outputs"])
+
+				if "links" in result:
+					link_count += result["links"]
+					copy_count += len(result["outputs"]) - result["links"]
+
+				journal.record(result)
+				processed_count += 1
+				print(progress_line(processed_count, image_count, invalid_count, start_time), end="\r")
+	finally:
+		# Keep what was done so far, even if the run was interrupted
+		journal.close()
+
+		if settings["incremental"]:
+			save_manifest(path_output, manifest)
+
+	journal.finish()
 	
 	print()
+
+	# Timings recorded after the last result was handed over
+	timing_records += pop_timings()
+
+	if args["report"]:
+		write_report(args["report"],
+					 records=timing_records,
+					 image_count=image_count,
+					 wall_time=time.perf_counter() - start_time,
+					 extra={"jobs": args["jobs"], "pipeline": args["pipeline"], "engine": settings["engine"], "format": settings["format"], "duplicates": image_count - len(jobs)})
+		print("Report written to", args["report"])
+
+	# Worker processes keep their own caches, only report the one of a serial run
+	if (args["jobs"] == 1 or args["pipeline"]) and settings["engine"] == "stamp":
+		cache_info = STAMP_CACHE.info()
+		print("Stamp cache:", cache_info["hits"], "hits,", cache_info["misses"], "misses")
+
+	if args["dedup"] or duplicates:
+		print("Duplicate outputs:", link_count, "hard-linked,", copy_count, "copied")
+
 	print("Done")
\ No newline at end of file